@@ -38,7 +38,36 @@ pprint(response.json())
 GET /products/?shop_id=1
 GET /products/?category_id=2
 GET /products/?search=Smartphone
+GET /products/?search=смартфн aple&fuzzy=1 - поиск с опечатками, сначала самые похожие
 GET /products/?min_price=500&max_price=1000
+GET /products/?param[Цвет]=черный&param[Цвет]=белый&param[Встроенная память (Гб)]=128..512
+GET /products/?page_size=100
+GET /products/?ordering=-price&category_id=1 - сортировка: price, -price, name, quantity (по умолчанию по ИД)
+GET /products/?in_stock=1&ordering=price - только товары в наличии
+Ответ: {"next": "...?cursor=cD00MA%3D%3D", "previous": null, "results": [...]}, следующая страница - ссылка next
+Ответы содержат ETag, повторный запрос с заголовком If-None-Match: <ETag> получит 304, если каталог не менялся:
+response = requests.get(f'{url}products/?shop_id=1', headers={'If-None-Match': response.headers['ETag']})
+POST /products/lookup/ {"ids": [12, 7, 31]} - товары по списку ИД (до 5000), GET /products/lookup/?ids=12,7,31
+Ответ: {"results": [...], "missing": [31]} - в порядке ИД, missing - неизвестные товары и товары закрытых магазинов
+Счетчики кэша каталога (только для персонала): GET /products/cache-stats/, сброс: DELETE /products/cache-stats/
+Ответ: {"products": {"hits": 120, "misses": 30, "hit_rate": 0.8}, "facets": {...}}
+"""
+
+"""
+# Для тестирования GET запроса подсказок при вводе, q - префикс, limit - число подсказок (до 50)
+
+GET /products/suggest/?q=смарт&limit=5
+Ответ: {"prefix": "смарт", "results": [{"type": "shop", "value": "Смартторг", "count": 120},
+                                      {"type": "product", "value": "Смартфон Apple iPhone XR 128GB (синий)", "count": 3}]}, type - product, model или shop
+"""
+
+"""
+# Для тестирования GET запроса счетчиков фасетов каталога, принимает те же фильтры, что и products/
+
+GET /products/facets/?category_id=1&bins=10
+GET /products/facets/?param[Цвет]=черный&min_price=500
+Ответ: {"total": ..., "categories": [{"id", "name", "count"}], "shops": [...],
+        "parameters": {"Цвет": [{"value": "черный", "count": ...}]}, "price": {"min", "max", "histogram": [...]}}
 """
 
 """
@@ -182,4 +211,39 @@ file: [ваш_файл.jpg]
 """
 # Authorization by Github, Авторизация через GitHub
 http://127.0.0.1:8000/auth/login/github/
-"""
\ No newline at end of file
+"""
+"""
+Загрузка прайс-листа партнером, импорт выполняется в фоне (Celery)
+Доступна персоналу и владельцу магазина (Shop.user задается в админке), для чужого магазина - 403;
+ссылки только http(s) на публичные адреса
+POST /api/v1/partner/update
+Authorization: Token ваш_токен
+
+{
+    "url": "https://example.com/shop.yaml"
+}
+or
+file: [ваш_прайс.yaml]
+
+Ответ: {"Status": true, "job_id": 1, "status_url": "/api/v1/partner/update/1"}
+
+Статус импорта: обработано/всего товаров и время выполнения
+GET /api/v1/partner/update/1
+Authorization: Token ваш_токен
+"""
+"""
+Обновление остатков и цен партнером без импорта прайс-листа
+Доступно персоналу и владельцу магазина, для чужого магазина - 403
+POST /api/v1/partner/stock
+Authorization: Token ваш_токен
+
+{
+    "shop": "Связной",
+    "items": [[4216292, 14], [4672670, 0, 12990]]
+}
+or
+shop: Связной
+file: [остатки.csv] - строки external_id,quantity[,price]
+
+Ответ: {"Status": true, "rows": 2, "updated": 2, "unchanged": 0, "missing": 0, ...}
+"""
@@ -1,5 +1,8 @@
 from django.contrib import admin
-from .models import Shop, Product, ProductInfo, Category, Contact, Order, OrderedItem
+from .models import Shop, Product, ProductInfo, Category, Contact, Order, OrderedItem, ImportJob
+from .catalog import bump_catalog_version
+from .catalog_items import refresh_catalog_items
+from .search import update_search_index
 
 
 class ProductInfoInline(admin.TabularInline):
@@ -11,10 +14,26 @@ class ProductAdmin(admin.ModelAdmin):
     inlines = [ProductInfoInline]
 
 
+class ProductInfoAdmin(admin.ModelAdmin):
+
+    def delete_queryset(self, request, queryset):
+        """
+        Bulk delete skips the per-row signal of goods, the search index and the read model are updated once
+        Массовое удаление пропускает построчный сигнал товаров, поисковый индекс и модель чтения обновляются один раз
+        """
+        goods = list(queryset.values_list('id', 'shop_id'))
+        super().delete_queryset(request, queryset)
+        ids = [pk for pk, _ in goods]
+        update_search_index(ids)
+        refresh_catalog_items(ids)
+        bump_catalog_version(parameters=True, shops={shop_id for _, shop_id in goods})
+
+
 admin.site.register(Shop)
 admin.site.register(Category)
 admin.site.register(Product, ProductAdmin)
-admin.site.register(ProductInfo)
+admin.site.register(ProductInfo, ProductInfoAdmin)
 admin.site.register(Contact)
 admin.site.register(Order)
-admin.site.register(OrderedItem)
\ No newline at end of file
+admin.site.register(OrderedItem)
+admin.site.register(ImportJob)
\ No newline at end of file
@@ -1,4 +1,5 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 
 class BackendConfig(AppConfig):
@@ -7,3 +8,7 @@ class BackendConfig(AppConfig):
 
     def ready(self):
         import backend.signals
+        from backend.catalog_items import fill_catalog_items
+        from backend.search import create_search_index
+        post_migrate.connect(create_search_index, sender=self)
+        post_migrate.connect(fill_catalog_items, sender=self)
@@ -0,0 +1,499 @@
+import hashlib
+import json
+import re
+import threading
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import Counter
+from datetime import datetime, timezone
+from decimal import Decimal, InvalidOperation
+from uuid import uuid4
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Q
+
+from backend.models import CatalogItem, Parameter, ProductParameter
+from backend.search import search_products
+
+
+"""
+Catalog query helpers shared by the catalog views: filter parsing, parameter facets backed by
+an in-memory inverted index and facet counts.
+Вспомогательные функции запросов каталога для его представлений: разбор фильтров, фильтры по
+параметрам на инвертированном индексе в памяти и подсчет фасетов.
+"""
+
+CATALOG_VERSION_KEY = 'catalog:version'  # Any change, любое изменение
+COMMON_VERSION_KEY = 'catalog:version:common'  # Changes shared by all shops, изменения, общие для всех магазинов
+SHOP_VERSION_KEY = 'catalog:version:shop:{}'  # Changes of goods of one shop, изменения товаров одного магазина
+FACET_VERSION_KEY = 'catalog:facets:version'
+FACET_COUNTS_KEY = 'catalog:facet_counts:{}:{}'
+FACET_COUNTS_TIMEOUT = 60 * 60
+CATALOG_RESPONSE_KEY = 'catalog:response:{}'
+CATALOG_RESPONSE_TIMEOUT = 60 * 60 * 24  # Versions in keys make stale entries unreachable, версии в ключах скрывают устаревшие записи
+CACHE_STATS_KEY = 'catalog:cache_stats:{}:{}'
+CACHE_NAMES = ('products', 'facets')
+FACET_TOP_VALUES = 10  # Values per parameter in facet counts, значений параметра в подсчете фасетов
+PRICE_BINS = 10
+FACET_IDS_LIMIT = 5000  # Above this ids are not inlined into SQL, выше ИД не подставляются в SQL
+LOOKUP_IDS_LIMIT = 5000  # Ids per bulk lookup, ИД в одном пакетном запросе
+ID_MAX = 2 ** 63 - 1  # Largest id of a BigAutoField column, наибольший ИД колонки BigAutoField
+FACET_PARAMETER = re.compile(r'^param\[(.+)\]$')
+# ?ordering values and their index backed orderings, id breaks ties for the cursor
+# Значения ?ordering и соответствующие сортировки по индексам, ИД различает равные значения для курсора
+CATALOG_ORDERINGS = {
+    'price': ('price', 'id'),
+    '-price': ('-price', '-id'),
+    'name': ('product_name', 'id'),
+    'quantity': ('quantity', 'id'),
+}
+RANGE_SEPARATOR = '..'
+
+
+class FacetIndex:
+    """
+    Inverted index from (parameter name, value) to sorted arrays of ProductInfo ids.
+    Numeric values of every parameter are also kept sorted for range lookups.
+    Инвертированный индекс из (название параметра, значение) в отсортированные массивы ИД ProductInfo.
+    Числовые значения каждого параметра также хранятся отсортированными для поиска по диапазону.
+    """
+    def __init__(self, version=None):
+        self.version = version
+        self.values = {}  # Name -> value -> array of ids, название -> значение -> массив ИД
+        self.numbers = {}  # Name -> sorted [(number, value)], название -> отсортированные [(число, значение)]
+
+    @classmethod
+    def build(cls, version=None):
+        """
+        Build the index with one pass over ProductParameter ordered by ProductInfo id.
+        Строит индекс одним проходом по ProductParameter в порядке ИД ProductInfo.
+        """
+        index = cls(version)
+        names = dict(Parameter.objects.values_list('id', 'name'))
+        rows = ProductParameter.objects.order_by('product_info_id').values_list(
+            'parameter_id', 'value', 'product_info_id')
+        for parameter_id, value, product_info_id in rows.iterator(chunk_size=10000):
+            index.values.setdefault(names[parameter_id], {}).setdefault(value, array('q')).append(product_info_id)
+
+        for name, values in index.values.items():
+            numbers = []
+            for value in values:
+                try:
+                    numbers.append((float(value), value))
+                except ValueError:
+                    continue
+            index.numbers[name] = sorted(numbers)
+        return index
+
+    def matching_values(self, name, value):
+        """
+        Stored values of a parameter matching one filter value: the exact value or a numeric range
+        "low..high", either end may be omitted.
+        Сохраненные значения параметра, подходящие под одно значение фильтра: точное значение или
+        числовой диапазон "от..до", любой конец можно опустить.
+        """
+        values = self.values.get(name, {})
+        if RANGE_SEPARATOR not in value:
+            return [value] if value in values else []
+
+        low, high = (part.strip() for part in value.split(RANGE_SEPARATOR, 1))
+        numbers = self.numbers.get(name, [])
+        start = bisect_left(numbers, (float(low),)) if low else 0
+        end = bisect_right(numbers, (float(high), '\uffff')) if high else len(numbers)
+        return [value for _, value in numbers[start:end]]
+
+    def match(self, facets):
+        """
+        Ids matching every facet, values of one facet are combined with OR.
+        ИД, подходящие под все фильтры, значения одного фильтра объединяются через ИЛИ.
+        """
+        groups = []
+        for name, values in facets.items():
+            group = set()
+            for value in values:
+                for matched in self.matching_values(name, value):
+                    group.update(self.values[name][matched])
+            groups.append(group)
+        groups.sort(key=len)
+        result = groups[0]
+        for group in groups[1:]:
+            result.intersection_update(group)
+        return result
+
+
+_facet_index = FacetIndex()
+_facet_lock = threading.Lock()
+
+
+def new_version():
+    """
+    Unique version value starting with its creation time in milliseconds.
+    Уникальное значение версии, начинающееся со времени создания в миллисекундах.
+    """
+    return '%d-%s' % (time.time() * 1000, uuid4().hex[:16])
+
+
+def version_time(version):
+    """
+    Creation time of a version value, None for values without it.
+    Время создания значения версии, None для значений без него.
+    """
+    try:
+        return datetime.fromtimestamp(int(version.split('-', 1)[0]) / 1000, tz=timezone.utc)
+    except ValueError:
+        return None
+
+
+def shared_version(key):
+    """
+    Current value of a shared version key, a new one is stored when the key is missing.
+    Текущее значение общего ключа версии, при отсутствии ключа сохраняется новое.
+    """
+    version = cache.get(key)
+    if version is None:
+        version = new_version()
+        if not cache.add(key, version, None):
+            version = cache.get(key)
+    return version
+
+
+def bump_catalog_version(parameters=False, shops=None):
+    """
+    Mark cached catalog data stale in every process after the catalog changed, parameter facets too
+    when characteristics of goods changed. shops are ids of shops whose goods changed, None for changes
+    shared by all shops (categories, products, parameters).
+    Помечает кэшированные данные каталога устаревшими во всех процессах после изменения каталога,
+    фильтры по параметрам тоже, если изменились характеристики товаров. shops - ИД магазинов, товары
+    которых изменились, None для изменений, общих для всех магазинов (категории, продукты, параметры).
+    New versions are published after commit, so no request caches data of an open transaction under them.
+    Новые версии публикуются после коммита, чтобы ни один запрос не закэшировал под ними данные
+    незавершенной транзакции.
+    """
+    shops = None if shops is None else list(shops)
+
+    def publish():
+        version = new_version()
+        versions = {CATALOG_VERSION_KEY: version}
+        if shops is None:
+            versions[COMMON_VERSION_KEY] = version
+        else:
+            versions.update((SHOP_VERSION_KEY.format(shop_id), version) for shop_id in shops)
+        if parameters:
+            versions[FACET_VERSION_KEY] = version
+        cache.set_many(versions, None)
+
+    transaction.on_commit(publish)
+
+
+def catalog_versions(filters):
+    """
+    Versions the result of the filters depends on: shared and shop versions for one shop,
+    the global version otherwise.
+    Версии, от которых зависит результат фильтров: общая версия и версия магазина для одного магазина,
+    иначе глобальная версия.
+    """
+    if 'shop_id' in filters:
+        return [shared_version(COMMON_VERSION_KEY), shared_version(SHOP_VERSION_KEY.format(filters['shop_id']))]
+    return [shared_version(CATALOG_VERSION_KEY)]
+
+
+def canonical_value(value):
+    """
+    JSON form of a filter value for cache keys: prices without trailing zeros, 500, 500.0 and 500.00 are equal.
+    JSON форма значения фильтра для ключей кэша: цены без конечных нулей, 500, 500.0 и 500.00 равны.
+    """
+    if isinstance(value, Decimal):
+        return format(value.normalize(), 'f')
+    raise TypeError('Unsupported filter value %r' % value)
+
+
+def filters_key(filters, *parts):
+    """
+    Cache key part of parsed filters and other request parts, semantically equal queries get equal keys.
+    Часть ключа кэша для разобранных фильтров и других частей запроса, одинаковые по смыслу запросы
+    получают одинаковые ключи.
+    """
+    content = json.dumps([filters, parts], sort_keys=True, ensure_ascii=False, default=canonical_value)
+    return hashlib.sha1(content.encode()).hexdigest()
+
+
+def catalog_etag(filters, *parts):
+    """
+    ETag of a catalog response for the filters and other request parts, changes with the relevant versions.
+    ETag ответа каталога для фильтров и других частей запроса, меняется вместе с соответствующими версиями.
+    """
+    return filters_key(filters, catalog_versions(filters), *parts)
+
+
+def count_cache_lookup(name, hit):
+    """
+    Count a hit or a miss of a catalog cache (products or facets), counters are shared by all processes.
+    Учитывает попадание или промах кэша каталога (products или facets), счетчики общие для всех процессов.
+    """
+    key = CACHE_STATS_KEY.format(name, 'hits' if hit else 'misses')
+    if not cache.add(key, 1, None):
+        cache.incr(key)
+
+
+def cache_stats():
+    """
+    Hits, misses and hit rate of every catalog cache.
+    Попадания, промахи и доля попаданий каждого кэша каталога.
+    """
+    counters = cache.get_many([CACHE_STATS_KEY.format(name, kind) for name in CACHE_NAMES for kind in ('hits', 'misses')])
+    stats = {}
+    for name in CACHE_NAMES:
+        hits = counters.get(CACHE_STATS_KEY.format(name, 'hits'), 0)
+        misses = counters.get(CACHE_STATS_KEY.format(name, 'misses'), 0)
+        stats[name] = {'hits': hits, 'misses': misses, 'hit_rate': round(hits / (hits + misses), 4) if hits + misses else None}
+    return stats
+
+
+def reset_cache_stats():
+    """
+    Reset counters of catalog caches.
+    Сбрасывает счетчики кэшей каталога.
+    """
+    cache.delete_many([CACHE_STATS_KEY.format(name, kind) for name in CACHE_NAMES for kind in ('hits', 'misses')])
+
+
+def catalog_last_modified(filters):
+    """
+    Last-Modified of a catalog response: time of the latest relevant version.
+    Last-Modified ответа каталога: время последней из соответствующих версий.
+    """
+    times = [moment for moment in map(version_time, catalog_versions(filters)) if moment is not None]
+    return max(times) if times else None
+
+
+def get_facet_index():
+    """
+    Facet index of this process, rebuilt when the shared version in cache has changed.
+    Индекс фильтров этого процесса, перестраивается при изменении общей версии в кэше.
+    """
+    global _facet_index
+    version = shared_version(FACET_VERSION_KEY)
+    if _facet_index.version != version:
+        with _facet_lock:
+            if _facet_index.version != version:
+                _facet_index = FacetIndex.build(version)
+    return _facet_index
+
+
+def parse_facets(query_params):
+    """
+    Collect ?param[<name>]=<value> filters into {name: [values]}, a value may be a range "low..high".
+    Raises ValueError for a range with a non-numeric end.
+    Собирает фильтры ?param[<название>]=<значение> в {название: [значения]}, значение может быть
+    диапазоном "от..до". Для диапазона с нечисловой границей вызывает ValueError.
+    """
+    facets = {}
+    for key in query_params:
+        match = FACET_PARAMETER.match(key)
+        if not match:
+            continue
+        values = [value for value in query_params.getlist(key) if value != '']
+        for value in values:
+            if RANGE_SEPARATOR in value:
+                for end in value.split(RANGE_SEPARATOR, 1):
+                    if end.strip():
+                        float(end)
+        if values:
+            facets[match.group(1)] = values
+    return facets
+
+
+def parse_filters(query_params):
+    """
+    Normalized catalog filters from query parameters: shop_id, category_id, min_price, max_price,
+    search (lower case, single spaces), fuzzy (typo tolerant search, ?fuzzy=1), in_stock (?in_stock=1) and facets,
+    equal filter sets give equal dicts. Raises ValueError for invalid values.
+    Нормализованные фильтры каталога из параметров запроса: shop_id, category_id, min_price, max_price,
+    search (в нижнем регистре, с одиночными пробелами), fuzzy (поиск с опечатками, ?fuzzy=1), in_stock
+    (?in_stock=1) и facets, одинаковые наборы фильтров дают одинаковые словари. Для неверных значений вызывает ValueError.
+    """
+    filters = {}
+    for name, convert in (('shop_id', int), ('category_id', int), ('min_price', Decimal), ('max_price', Decimal)):
+        value = query_params.get(name)
+        if not value:
+            continue
+        try:
+            filters[name] = convert(value)
+        except (ValueError, InvalidOperation):
+            raise ValueError('Неверное значение %s: %s' % (name, value))
+        if isinstance(filters[name], Decimal) and not filters[name].is_finite():
+            raise ValueError('Неверное значение %s: %s' % (name, value))
+
+    search = ' '.join(query_params.get('search', '').lower().split())
+    if search:
+        filters['search'] = search
+        if query_params.get('fuzzy', '').lower() in ('1', 'true'):
+            filters['fuzzy'] = True
+    if query_params.get('in_stock', '').lower() in ('1', 'true'):
+        filters['in_stock'] = True
+    try:
+        facets = parse_facets(query_params)
+    except ValueError:
+        raise ValueError('Границы диапазона должны быть числами')
+    if facets:
+        filters['facets'] = {name: sorted(set(values)) for name, values in sorted(facets.items())}
+    return filters
+
+
+def parse_ordering(value):
+    """
+    Ordering of the catalog for an ?ordering value, None when it is empty. Raises ValueError for unknown values.
+    Сортировка каталога для значения ?ordering, None, если оно пустое. Для неизвестных значений вызывает ValueError.
+    """
+    value = (value or '').strip()
+    if not value:
+        return None
+    if value not in CATALOG_ORDERINGS:
+        raise ValueError('Неверное значение ordering: %s, допустимо: %s' % (value, ', '.join(CATALOG_ORDERINGS)))
+    return CATALOG_ORDERINGS[value]
+
+
+def parse_ids(value):
+    """
+    Unique ids from 1 to ID_MAX in their order from a list or a comma separated string, at most LOOKUP_IDS_LIMIT.
+    Raises ValueError for invalid, empty or too long lists.
+    Уникальные ИД от 1 до ID_MAX в их порядке из списка или строки через запятую, не больше LOOKUP_IDS_LIMIT.
+    Для неверных, пустых и слишком длинных списков вызывает ValueError.
+    """
+    if isinstance(value, str):
+        value = [part for part in value.split(',') if part.strip()]
+    if not isinstance(value, list) or not value:
+        raise ValueError('ids должен быть непустым списком ИД')
+    if len(value) > LOOKUP_IDS_LIMIT:
+        raise ValueError('ids должен содержать не больше %d ИД' % LOOKUP_IDS_LIMIT)
+    try:
+        ids = [int(pk) for pk in value if not isinstance(pk, (bool, float))]
+    except (TypeError, ValueError):
+        raise ValueError('ids должен содержать целые числа')
+    if len(ids) != len(value) or min(ids) < 1 or max(ids) > ID_MAX:
+        raise ValueError('ids должен содержать целые числа от 1 до %d' % ID_MAX)
+    return list(dict.fromkeys(ids))
+
+
+def filter_products(filters, queryset=None):
+    """
+    Apply parsed filters to a CatalogItem queryset, goods of closed shops are excluded.
+    With search the queryset is annotated with search_rank.
+    Применяет разобранные фильтры к queryset CatalogItem, товары закрытых магазинов исключаются.
+    При поиске queryset получает аннотацию search_rank.
+    """
+    queryset = CatalogItem.objects.all() if queryset is None else queryset
+    query = Q(shop_state=True)
+    if 'shop_id' in filters:
+        query &= Q(shop_id=filters['shop_id'])
+    if 'category_id' in filters:
+        query &= Q(category_id=filters['category_id'])
+    if 'min_price' in filters:
+        query &= Q(price__gte=filters['min_price'])
+    if 'max_price' in filters:
+        query &= Q(price__lte=filters['max_price'])
+    if filters.get('in_stock'):
+        query &= Q(quantity__gt=0)
+
+    queryset = filter_facets(queryset.filter(query), filters.get('facets'))
+    if 'search' in filters:
+        queryset = search_products(queryset, filters['search'], fields=('product_name', 'model', 'shop_name'),
+                                   fuzzy=filters.get('fuzzy', False))
+    return queryset
+
+
+def filter_facets(queryset, facets):
+    """
+    Filter CatalogItem queryset by parameter facets. Ids are intersected in memory and inlined into
+    the query; when too many goods match, facets are applied as one id subquery each instead of joins.
+    Фильтрует queryset CatalogItem по параметрам. ИД пересекаются в памяти и подставляются в запрос;
+    если подходит слишком много товаров, фильтры применяются подзапросами по ИД вместо соединений.
+    """
+    if not facets:
+        return queryset
+    index = get_facet_index()
+    ids = index.match(facets)
+    if len(ids) <= FACET_IDS_LIMIT:
+        return queryset.filter(id__in=sorted(ids))
+
+    for name, values in facets.items():
+        matched = [value for query in values for value in index.matching_values(name, query)]
+        queryset = queryset.filter(id__in=ProductParameter.objects.filter(
+            parameter__name=name, value__in=matched).values('product_info_id'))
+    return queryset
+
+
+def price_histogram(prices, bins=PRICE_BINS):
+    """
+    Equal width histogram of prices: [{'min', 'max', 'count'}], empty for no prices.
+    Гистограмма цен с равной шириной интервалов: [{'min', 'max', 'count'}], пустая, если цен нет.
+    """
+    if not prices:
+        return []
+    low, high = min(prices), max(prices)
+    if low == high:
+        return [{'min': str(low), 'max': str(high), 'count': len(prices)}]
+    width = (high - low) / bins
+    counts = [0] * bins
+    for price in prices:
+        counts[min(int((price - low) / width), bins - 1)] += 1
+    return [{'min': str((low + width * number).quantize(low)), 'max': str((low + width * (number + 1)).quantize(low)),
+             'count': count} for number, count in enumerate(counts)]
+
+
+def count_facets(filters, bins=PRICE_BINS, top=FACET_TOP_VALUES):
+    """
+    Facet counts of goods matching the filters: per category, per shop, top values of every parameter
+    and a price histogram. Goods are read in a single pass, parameter values are counted against
+    the inverted index.
+    Подсчет фасетов товаров, подходящих под фильтры: по категориям, магазинам, самым частым значениям
+    каждого параметра и гистограмма цен. Товары читаются за один проход, значения параметров
+    подсчитываются по инвертированному индексу.
+    """
+    rows = filter_products(filters).values_list('id', 'shop_id', 'shop_name', 'category_id', 'category_name', 'price')
+    ids, prices = set(), []
+    categories, shops, names = Counter(), Counter(), {}
+    for pk, shop_id, shop_name, category_id, category_name, price in rows.iterator(chunk_size=10000):
+        ids.add(pk)
+        prices.append(price)
+        categories[category_id] += 1
+        shops[shop_id] += 1
+        names[('category', category_id)] = category_name
+        names[('shop', shop_id)] = shop_name
+
+    parameters = {}
+    for name, values in get_facet_index().values.items():
+        counts = Counter({value: sum(1 for pk in value_ids if pk in ids) for value, value_ids in values.items()})
+        top_values = [{'value': value, 'count': count} for value, count in counts.most_common(top) if count]
+        if top_values:
+            parameters[name] = top_values
+
+    return {
+        'total': len(ids),
+        'categories': [{'id': pk, 'name': names[('category', pk)], 'count': count}
+                       for pk, count in categories.most_common()],
+        'shops': [{'id': pk, 'name': names[('shop', pk)], 'count': count} for pk, count in shops.most_common()],
+        'parameters': parameters,
+        'price': {
+            'min': str(min(prices)) if prices else None,
+            'max': str(max(prices)) if prices else None,
+            'histogram': price_histogram(prices, bins),
+        },
+    }
+
+
+def cached_facets(filters, bins=PRICE_BINS):
+    """
+    count_facets cached per normalized filter set and catalog version, so any catalog change
+    makes the cached counts unreachable.
+    count_facets с кэшированием по нормализованному набору фильтров и версии каталога, поэтому любое
+    изменение каталога делает кэшированные счетчики недоступными.
+    """
+    key = FACET_COUNTS_KEY.format(shared_version(CATALOG_VERSION_KEY), filters_key(filters, bins))
+    facets = cache.get(key)
+    count_cache_lookup('facets', facets is not None)
+    if facets is None:
+        facets = count_facets(filters, bins)
+        cache.set(key, facets, FACET_COUNTS_TIMEOUT)
+    return facets
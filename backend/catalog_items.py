@@ -0,0 +1,171 @@
+import hashlib
+import json
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from django.db import connection, transaction
+
+from backend.models import CatalogItem, ProductInfo, ProductParameter
+from backend.suggest import SUGGEST_CHANGES_LIMIT, publish_suggest_changes, rebuild_suggestions, text_counts
+
+
+"""
+Maintenance of the CatalogItem read model: flat catalog rows with product, category, shop and parameters
+copied from the normalized tables, so the catalog is answered from one table without joins.
+Rows are refreshed by ids of ProductInfo after imports, stock updates and edits of the source models.
+Поддержка модели чтения CatalogItem: плоские строки каталога с данными продукта, категории, магазина и
+параметрами, скопированными из нормализованных таблиц, чтобы каталог отвечал из одной таблицы без соединений.
+Строки обновляются по ИД ProductInfo после импорта, обновления остатков и изменения исходных моделей.
+"""
+
+CATALOG_ITEM_CHUNK_SIZE = 500  # Ids per refresh step, ИД в одном шаге обновления
+# CatalogItem fields and their ProductInfo lookups, поля CatalogItem и соответствующие поля ProductInfo
+ITEM_FIELDS = (
+    ('id', 'id'), ('product_id', 'product_id'), ('product_name', 'product__name'),
+    ('category_id', 'product__category_id'), ('category_name', 'product__category__name'),
+    ('shop_id', 'shop_id'), ('shop_name', 'shop__name'), ('shop_state', 'shop__state'), ('model', 'model'),
+    ('quantity', 'quantity'), ('price', 'price'), ('price_rrc', 'price_rrc'),
+)
+SUGGEST_ROW_FIELDS = ('product_name', 'model', 'shop_name', 'shop_state')  # Rows of text_counts, строки text_counts
+
+_deferred = threading.local()
+
+
+def item_version(item):
+    """
+    Version of a catalog row: digest of its content, equal rows have equal versions.
+    Версия строки каталога: дайджест ее содержимого, одинаковые строки имеют одинаковые версии.
+    """
+    content = [getattr(item, field) for field, _ in ITEM_FIELDS] + [item.parameters]
+    return hashlib.md5(json.dumps(content, ensure_ascii=False, default=str).encode()).hexdigest()
+
+
+def build_catalog_items(product_info_ids):
+    """
+    CatalogItem rows of the given ProductInfo ids, read with one query for goods and one for parameters.
+    Ids of deleted goods are skipped.
+    Строки CatalogItem для переданных ИД ProductInfo, читаются одним запросом товаров и одним параметров.
+    ИД удаленных товаров пропускаются.
+    """
+    parameters = {}
+    for product_info_id, name, value in ProductParameter.objects.filter(
+            product_info_id__in=product_info_ids).order_by('id').values_list('product_info_id', 'parameter__name', 'value'):
+        parameters.setdefault(product_info_id, []).append({'parameter': name, 'value': value})
+
+    items = []
+    rows = ProductInfo.objects.filter(id__in=product_info_ids).order_by('id').values_list(
+        *(lookup for _, lookup in ITEM_FIELDS))
+    for row in rows:
+        item = CatalogItem(**dict(zip((field for field, _ in ITEM_FIELDS), row)), parameters=parameters.get(row[0], []))
+        item.version = item_version(item)
+        items.append(item)
+    return items
+
+
+def write_catalog_items(ids):
+    """
+    Rewrite catalog rows of the given sorted ProductInfo ids, return the changes of suggested texts.
+    Перезаписывает строки каталога для переданных отсортированных ИД ProductInfo, возвращает изменения текстов
+    подсказок.
+    """
+    changes = Counter()
+    for start in range(0, len(ids), CATALOG_ITEM_CHUNK_SIZE):
+        chunk = ids[start:start + CATALOG_ITEM_CHUNK_SIZE]
+        items = build_catalog_items(chunk)
+        changes.subtract(text_counts(CatalogItem.objects.filter(id__in=chunk).values_list(*SUGGEST_ROW_FIELDS)))
+        changes.update(text_counts((getattr(item, field) for field in SUGGEST_ROW_FIELDS) for item in items))
+        CatalogItem.objects.filter(id__in=chunk).delete()
+        CatalogItem.objects.bulk_create(items)
+    return changes
+
+
+def refresh_catalog_items(product_info_ids):
+    """
+    Rewrite catalog rows of the given ProductInfo ids, rows of deleted goods are removed.
+    Inside deferred_refresh the ids are collected and refreshed on flush_refresh or on exit.
+    Changes of suggested texts are published after commit.
+    Перезаписывает строки каталога для переданных ИД ProductInfo, строки удаленных товаров удаляются.
+    Внутри deferred_refresh ИД накапливаются и обновляются при flush_refresh или при выходе.
+    Изменения текстов подсказок публикуются после коммита.
+    """
+    ids = sorted(set(product_info_ids))
+    if getattr(_deferred, 'ids', None) is not None:
+        _deferred.ids.update(ids)
+        return
+    changes = write_catalog_items(ids)
+    if changes:
+        transaction.on_commit(lambda: publish_suggest_changes(changes))
+
+
+def flush_refresh():
+    """
+    Refresh the ids collected so far by the enclosing deferred_refresh block, so long blocks do not keep
+    the ids of all their rows. Changes of suggested texts are still published once on exit; past
+    SUGGEST_CHANGES_LIMIT only a rebuild is remembered.
+    Обновляет ИД, накопленные внешним блоком deferred_refresh, чтобы длинные блоки не держали ИД всех своих
+    строк. Изменения текстов подсказок по-прежнему публикуются один раз при выходе; после
+    SUGGEST_CHANGES_LIMIT запоминается только перестроение.
+    """
+    ids = getattr(_deferred, 'ids', None)
+    if not ids:
+        return
+    changes = write_catalog_items(sorted(ids))
+    ids.clear()
+    if _deferred.changes is None:  # A rebuild is published anyway, перестроение публикуется в любом случае
+        return
+    _deferred.changes.update(changes)
+    for key in [key for key, delta in _deferred.changes.items() if not delta]:
+        del _deferred.changes[key]
+    if len(_deferred.changes) > SUGGEST_CHANGES_LIMIT:
+        _deferred.changes = None
+
+
+@contextmanager
+def deferred_refresh():
+    """
+    Collect ids of every refresh_catalog_items call inside the block and refresh them once on normal exit,
+    unless the enclosing transaction is marked for rollback. Bulk deletes send signals per row, so rows
+    are not refreshed one by one. flush_refresh refreshes the collected ids earlier.
+    Накапливает ИД всех вызовов refresh_catalog_items внутри блока и обновляет их один раз при обычном выходе,
+    если внешняя транзакция не помечена для отката. Массовое удаление отправляет сигналы на каждую строку,
+    поэтому строки не обновляются по одной. flush_refresh обновляет накопленные ИД раньше.
+    """
+    if getattr(_deferred, 'ids', None) is not None:  # Nested block, вложенный блок
+        yield
+        return
+    _deferred.ids, _deferred.changes = set(), Counter()
+    try:
+        yield
+        if not (connection.in_atomic_block and transaction.get_rollback()):
+            flush_refresh()
+            changes = _deferred.changes
+            if changes is None:
+                transaction.on_commit(rebuild_suggestions)
+            elif changes:
+                transaction.on_commit(lambda: publish_suggest_changes(changes))
+    finally:
+        _deferred.ids = _deferred.changes = None
+
+
+def rebuild_catalog_items():
+    """
+    Refill the whole read model from the catalog.
+    Полностью перезаполняет модель чтения из каталога.
+    """
+    with transaction.atomic():
+        CatalogItem.objects.all().delete()
+        ids = list(ProductInfo.objects.order_by('id').values_list('id', flat=True))
+        for start in range(0, len(ids), CATALOG_ITEM_CHUNK_SIZE):
+            CatalogItem.objects.bulk_create(build_catalog_items(ids[start:start + CATALOG_ITEM_CHUNK_SIZE]))
+        transaction.on_commit(rebuild_suggestions)
+
+
+def fill_catalog_items(using='default', **kwargs):
+    """
+    post_migrate receiver: fill the read model when it is empty and the catalog is not.
+    Обработчик post_migrate: заполняет модель чтения, если она пуста, а каталог нет.
+    """
+    if using != 'default':
+        return
+    if not CatalogItem.objects.exists() and ProductInfo.objects.exists():
+        rebuild_catalog_items()
@@ -0,0 +1,157 @@
+import threading
+from decimal import ROUND_CEILING, ROUND_FLOOR, Decimal
+from django.conf import settings
+
+from backend.catalog import CATALOG_VERSION_KEY, shared_version
+from backend.models import CatalogItem
+
+try:
+    import numpy
+except ImportError:  # Optional dependency, необязательная зависимость
+    numpy = None
+
+
+"""
+Optional in-process columnar engine for the catalog listing. Ids, prices, quantities, shop and category
+ids of goods of open shops are held in NumPy arrays in every process, filters are evaluated as vectorized
+masks and only the rows of the requested page are read from the database. The arrays are reloaded when
+the catalog version changes. Search, parameter facets and name ordering are left to the ORM.
+Enabled by CATALOG_COLUMNAR_ENGINE = True when numpy is installed.
+Необязательный колоночный движок каталога внутри процесса. ИД, цены, остатки, ИД магазинов и категорий
+товаров открытых магазинов хранятся в массивах NumPy в каждом процессе, фильтры вычисляются векторными
+масками, а из базы читаются только строки запрошенной страницы. Массивы перезагружаются при изменении
+версии каталога. Поиск, фильтры по параметрам и сортировка по названию остаются за ORM.
+Включается настройкой CATALOG_COLUMNAR_ENGINE = True, если установлен numpy.
+"""
+
+COLUMNAR_FILTERS = {'shop_id', 'category_id', 'min_price', 'max_price', 'in_stock'}
+# Orderings of the engine: ordering -> column, упорядочивания движка: сортировка -> колонка
+COLUMNAR_ORDERINGS = {('id',): 'ids', ('price', 'id'): 'prices', ('-price', '-id'): 'prices',
+                      ('quantity', 'id'): 'quantities'}
+CENTS = 100
+
+
+def cents(value, rounding=ROUND_FLOOR):
+    """
+    Price in integer cents, prices are compared exactly as DecimalField values. Bounds with fractions
+    of a cent are rounded towards the prices they admit: ROUND_CEILING for a lower bound, ROUND_FLOOR
+    for an upper one.
+    Цена в целых копейках, цены сравниваются точно, как значения DecimalField. Границы с долями копейки
+    округляются в сторону допустимых цен: ROUND_CEILING для нижней границы, ROUND_FLOOR для верхней.
+    """
+    return int((Decimal(value) * CENTS).to_integral_value(rounding))
+
+
+class ColumnarCatalog:
+    """
+    Columns of goods of open shops ordered by id, with permutations ordering them by price and by quantity.
+    Колонки товаров открытых магазинов в порядке ИД с перестановками, упорядочивающими их по цене и остатку.
+    """
+    def __init__(self, version=None):
+        self.version = version
+        self.ids = self.prices = self.quantities = self.shops = self.categories = numpy.zeros(0, dtype=numpy.int64)
+        self.orders = {}
+
+    @classmethod
+    def build(cls, version=None):
+        """
+        Load the columns with one query over CatalogItem.
+        Загружает колонки одним запросом к CatalogItem.
+        """
+        catalog = cls(version)
+        rows = list(CatalogItem.objects.filter(shop_state=True).order_by('id').values_list(
+            'id', 'price', 'quantity', 'shop_id', 'category_id'))
+        if rows:
+            ids, prices, quantities, shops, categories = zip(*rows)
+            catalog.ids = numpy.array(ids, dtype=numpy.int64)
+            catalog.prices = numpy.array([int(price * CENTS) for price in prices], dtype=numpy.int64)
+            catalog.quantities = numpy.array(quantities, dtype=numpy.int64)
+            catalog.shops = numpy.array(shops, dtype=numpy.int64)
+            catalog.categories = numpy.array(categories, dtype=numpy.int64)
+        # Ties are ordered by id as in the ORM ordering, равные значения упорядочены по ИД, как в ORM
+        catalog.orders = {
+            'prices': numpy.lexsort((catalog.ids, catalog.prices)),
+            'quantities': numpy.lexsort((catalog.ids, catalog.quantities)),
+        }
+        return catalog
+
+    def mask(self, filters):
+        """
+        Boolean mask of rows matching the filters.
+        Булева маска строк, подходящих под фильтры.
+        """
+        mask = numpy.ones(len(self.ids), dtype=bool)
+        if 'shop_id' in filters:
+            mask &= self.shops == filters['shop_id']
+        if 'category_id' in filters:
+            mask &= self.categories == filters['category_id']
+        if 'min_price' in filters:
+            mask &= self.prices >= cents(filters['min_price'], ROUND_CEILING)
+        if 'max_price' in filters:
+            mask &= self.prices <= cents(filters['max_price'])
+        if filters.get('in_stock'):
+            mask &= self.quantities > 0
+        return mask
+
+    def window(self, filters, ordering, cursor, page_size):
+        """
+        Ids of the rows CursorPagination reads for the page: matching rows after the cursor position
+        in the scan order, offset rows included, plus one to detect the next page.
+        ИД строк, которые CursorPagination читает для страницы: подходящие строки после позиции курсора
+        в порядке обхода, включая строки смещения, плюс одна для определения следующей страницы.
+        """
+        column = COLUMNAR_ORDERINGS[ordering]
+        offset, reverse, position = cursor if cursor is not None else (0, False, None)
+        size = offset + page_size + 1
+        mask = self.mask(filters)
+        # Matching rows ascending by the column, rows are already ordered by id
+        # Подходящие строки по возрастанию колонки, строки уже упорядочены по ИД
+        matched = numpy.flatnonzero(mask) if column == 'ids' else self.orders[column][mask[self.orders[column]]]
+        values = getattr(self, column)[matched] if position is not None else None
+        if position is not None:
+            position = cents(position) if column == 'prices' else int(position)
+        if ordering[0].startswith('-') != reverse:
+            end = len(matched) if position is None else numpy.searchsorted(values, position, 'left')
+            page = matched[max(end - size, 0):end][::-1]
+        else:
+            start = 0 if position is None else numpy.searchsorted(values, position, 'right')
+            page = matched[start:start + size]
+        return self.ids[page].tolist()
+
+
+_columnar_catalog = None
+_columnar_lock = threading.Lock()
+
+
+def columnar_engine_enabled():
+    """
+    Whether the engine is switched on and numpy is installed.
+    Включен ли движок и установлен ли numpy.
+    """
+    return numpy is not None and getattr(settings, 'CATALOG_COLUMNAR_ENGINE', False)
+
+
+def get_columnar_catalog():
+    """
+    Columnar catalog of this process, reloaded when the shared catalog version in cache has changed.
+    Колоночный каталог этого процесса, перезагружается при изменении общей версии каталога в кэше.
+    """
+    global _columnar_catalog
+    version = shared_version(CATALOG_VERSION_KEY)
+    if _columnar_catalog is None or _columnar_catalog.version != version:
+        with _columnar_lock:
+            if _columnar_catalog is None or _columnar_catalog.version != version:
+                _columnar_catalog = ColumnarCatalog.build(version)
+    return _columnar_catalog
+
+
+def columnar_window(filters, ordering, cursor, page_size):
+    """
+    Ids of the page rows from the engine, None when the engine is off or cannot answer the query
+    and the ORM has to filter.
+    ИД строк страницы из движка, None, если движок выключен или не может ответить на запрос
+    и фильтровать должен ORM.
+    """
+    if not columnar_engine_enabled() or not set(filters) <= COLUMNAR_FILTERS or ordering not in COLUMNAR_ORDERINGS:
+        return None
+    return get_columnar_catalog().window(filters, ordering, cursor, page_size)
@@ -0,0 +1,93 @@
+import json
+from decimal import Decimal
+from django.core.cache import cache
+
+from backend.models import CatalogItem
+
+
+"""
+Pre-rendered JSON fragments of catalog rows. Every CatalogItem is rendered once per row version and kept
+in cache as bytes, list responses are assembled from the fragments without serializing unchanged rows.
+Rows are rendered without DRF serializers: plain dicts are built from values_list rows, the output is
+the same as ProductInfoSerializer rendered by JSONRenderer.
+Заранее отрисованные JSON фрагменты строк каталога. Каждая строка CatalogItem отрисовывается один раз
+на версию строки и хранится в кэше в байтах, ответы со списками собираются из фрагментов без сериализации
+неизмененных строк. Строки отрисовываются без сериализаторов DRF: словари строятся из строк values_list,
+вывод такой же, как у ProductInfoSerializer с JSONRenderer.
+"""
+
+FRAGMENT_KEY = 'catalog:item:{}:{}'
+FRAGMENT_TIMEOUT = 60 * 60 * 24  # Changed rows get new keys, измененные строки получают новые ключи
+ROW_FIELDS = ('id', 'version', 'model', 'product_name', 'category_name', 'shop_id', 'quantity', 'price', 'price_rrc',
+              'parameters')
+CENT = Decimal('0.01')
+
+
+def decimal_string(value):
+    """
+    Price as DRF renders a DecimalField with two decimal places: "1000.00".
+    Цена в виде, как DRF отрисовывает DecimalField с двумя знаками: "1000.00".
+    """
+    return format(value.quantize(CENT), 'f')
+
+
+def render_json(data):
+    """
+    JSON bytes in the JSONRenderer format: compact separators, unicode kept, U+2028/U+2029 escaped.
+    JSON в байтах в формате JSONRenderer: компактные разделители, юникод без экранирования, U+2028/U+2029
+    экранируются.
+    """
+    content = json.dumps(data, ensure_ascii=False, allow_nan=False, separators=(',', ':'))
+    return content.replace('\u2028', '\\u2028').replace('\u2029', '\\u2029').encode()
+
+
+def catalog_item_rows(ids):
+    """
+    Catalog rows of the given ids as {id: (version, dict)}, dicts have the ProductInfoSerializer shape.
+    Rows are read with values_list, without model instances and serializer fields.
+    Строки каталога для переданных ИД в виде {ИД: (версия, словарь)}, словари в формате ProductInfoSerializer.
+    Строки читаются через values_list, без экземпляров моделей и полей сериализатора.
+    """
+    rows = {}
+    for pk, version, model, name, category, shop_id, quantity, price, price_rrc, parameters in \
+            CatalogItem.objects.filter(id__in=ids).values_list(*ROW_FIELDS):
+        rows[pk] = (version, {
+            'id': pk,
+            'model': model,
+            'product': {'name': name, 'category': category},
+            'shop': shop_id,
+            'quantity': quantity,
+            'price': decimal_string(price),
+            'price_rrc': decimal_string(price_rrc),
+            'product_parameters': parameters,
+        })
+    return rows
+
+
+def render_fragments(items):
+    """
+    JSON bytes of CatalogItem rows in their order, only rows missing in cache are rendered.
+    Items need id and version only, rows of cache misses are read with one query.
+    JSON в байтах для строк CatalogItem в их порядке, отрисовываются только строки, которых нет в кэше.
+    Элементам нужны только ИД и версия, строки промахов читаются одним запросом.
+    """
+    keys = {item.id: FRAGMENT_KEY.format(item.id, item.version) for item in items}
+    cached = cache.get_many(keys.values())
+    fragments = {pk: cached[key] for pk, key in keys.items() if key in cached}
+    missing = [item.id for item in items if item.id not in fragments]
+    if missing:
+        rendered = {}
+        # Keys of the rows as read, a row may change after the page query
+        # Ключи строк в прочитанном виде, строка может измениться после запроса страницы
+        for pk, (version, row) in catalog_item_rows(missing).items():
+            fragments[pk] = rendered[FRAGMENT_KEY.format(pk, version)] = render_json(row)
+        cache.set_many(rendered, FRAGMENT_TIMEOUT)
+    return [fragments[item.id] for item in items if item.id in fragments]
+
+
+def join_fragments(fragments):
+    """
+    JSON array of rendered fragments.
+    JSON массив из отрисованных фрагментов.
+    """
+    return b'[' + b','.join(fragments) + b']'
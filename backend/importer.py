@@ -0,0 +1,1112 @@
+import csv
+import hashlib
+import ipaddress
+import json
+import mmap
+import os
+import random
+import socket
+import tempfile
+import time
+from array import array
+from bisect import bisect_right
+from copy import copy
+from decimal import Decimal, InvalidOperation
+from contextlib import contextmanager
+from itertools import islice
+from urllib.parse import urljoin, urlsplit
+
+import msgpack
+import requests
+import yaml
+from yaml.composer import Composer
+from yaml.constructor import SafeConstructor
+from yaml.events import MappingEndEvent, MappingStartEvent, SequenceEndEvent, SequenceStartEvent
+from yaml.resolver import Resolver
+from cacheops import invalidate_model, invalidate_obj, no_invalidation
+import django
+from django.conf import settings
+from django.core.exceptions import PermissionDenied
+from django.db import IntegrityError, OperationalError, connection, connections, transaction
+
+from backend.models import Category, Product, ProductInfo, Shop, Parameter, ProductParameter
+from backend.catalog import bump_catalog_version
+from backend.catalog_items import deferred_refresh, flush_refresh, refresh_catalog_items
+from backend.search import update_search_index
+
+
+"""
+Set-based import engine for supplier price lists.
+Движок пакетного импорта прайс-листов поставщиков.
+"""
+
+IMPORT_BATCH_SIZE = 1000  # Goods per batch, товаров в одном пакете
+INVALIDATE_OBJECTS_LIMIT = 10000  # Above this the whole model is invalidated, выше инвалидируется вся модель
+IMPORT_RETRIES = 3  # Attempts per file on DB conflicts, попыток на файл при конфликтах БД
+IMPORT_RETRY_DELAY = 0.5  # Seconds before the first retry, doubled each time, секунд до первого повтора, удваивается
+FILE_CHUNK_SIZE = 1024 * 1024  # Read and download chunk, размер блока чтения и скачивания
+STOCK_GROUP_SIZE = 20  # Rows per value to update stock by value, строк на значение для обновления по значению
+INTEGER_MAX = 2147483647  # Range of IntegerField columns, диапазон колонок IntegerField
+SYNC_FIELDS = ('product_id', 'model', 'price', 'price_rrc', 'quantity')
+PRICE_LIST_REDIRECTS = 5  # Checked redirects of user urls, проверяемые перенаправления ссылок пользователей
+
+try:
+    from yaml.cyaml import CParser
+except ImportError:  # PyYAML built without libyaml, PyYAML собран без libyaml
+    CParser = None
+
+
+if CParser is not None:
+    class StreamLoader(CParser, Composer, SafeConstructor, Resolver):
+        """
+        Safe loader on the C parser which can compose single nodes of a document.
+        Безопасный загрузчик на C-парсере, умеющий собирать отдельные узлы документа.
+        """
+        def __init__(self, stream):
+            CParser.__init__(self, stream)
+            Composer.__init__(self)
+            SafeConstructor.__init__(self)
+            Resolver.__init__(self)
+else:
+    StreamLoader = yaml.SafeLoader
+
+
+class ImportStats:
+    """
+    Counters collected during one import: rows, DB queries and timing.
+    Счетчики одного импорта: строки, запросы к БД и время выполнения.
+    """
+    def __init__(self):
+        self.shop_id = None
+        self.rows = 0
+        self.inserted = 0
+        self.updated = 0
+        self.unchanged = 0
+        self.removed = 0
+        self.missing = 0  # Unknown external ids of stock updates, неизвестные внешние ИД обновлений остатков
+        # Parameter rows of goods were written or removed, записаны или удалены параметры товаров
+        self.parameters_changed = False
+        self.queries = 0
+        self.started = time.monotonic()
+        self.elapsed = 0.0
+
+    def finish(self):
+        self.elapsed = time.monotonic() - self.started
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.elapsed if self.elapsed else 0.0
+
+    def as_dict(self):
+        return {
+            'rows': self.rows,
+            'inserted': self.inserted,
+            'updated': self.updated,
+            'unchanged': self.unchanged,
+            'removed': self.removed,
+            'missing': self.missing,
+            'queries': self.queries,
+            'elapsed': round(self.elapsed, 3),
+            'rows_per_second': round(self.rows_per_second, 1),
+        }
+
+    def __str__(self):
+        return (f"{self.rows} rows in {self.elapsed:.2f}s ({self.rows_per_second:.0f} rows/s), "
+                f"{self.queries} queries; inserted {self.inserted}, updated {self.updated}, "
+                f"unchanged {self.unchanged}, removed {self.removed}")
+
+
+@contextmanager
+def count_queries(stats):
+    """
+    Count every SQL statement executed inside the block into stats.queries.
+    Подсчитывает все SQL-запросы внутри блока в stats.queries.
+    """
+    def wrapper(execute, sql, params, many, context):
+        stats.queries += 1
+        return execute(sql, params, many, context)
+
+    with connection.execute_wrapper(wrapper):
+        yield
+
+
+def batched(iterable, size):
+    """
+    Split iterable into lists of at most size items.
+    Разбивает итерируемый объект на списки длиной не более size.
+    """
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def load_data_from_yaml(file_path):
+    """
+    This function download data from yaml file, to variable and return that.
+    Функция загружает данные из файла в переменную  data, возвращая ее в результате исполнения.
+    """
+    with open(file_path, 'r', encoding='utf-8') as file:
+        data = yaml.safe_load(file)
+    return data
+
+
+def stream_data_from_yaml(file_path):
+    """
+    Read shop and categories from yaml file, goods are returned as a lazy iterator.
+    Items of the goods sequence are parsed one by one, so memory does not depend on the file size.
+    When goods precede shop in the file, the file is read twice: header first, then goods.
+    Читает магазин и категории из yaml файла, товары возвращаются ленивым итератором.
+    Элементы goods разбираются по одному, поэтому расход памяти не зависит от размера файла.
+    Если goods идут в файле раньше shop, файл читается дважды: сначала заголовок, затем товары.
+    """
+    file = open(file_path, 'rb')
+    loader = StreamLoader(file)
+    try:
+        data = read_yaml_header(loader)
+        if 'goods' not in data and 'shop' not in data:
+            skip_yaml_goods(loader)
+            data = read_yaml_keys(loader, data)
+            del data['goods']
+            loader.dispose()
+            file.close()
+            file = open(file_path, 'rb')
+            loader = StreamLoader(file)
+            read_yaml_header(loader)
+        if 'shop' not in data:
+            raise ValueError('%s: shop is missing' % file_path)
+    except BaseException:
+        loader.dispose()
+        file.close()
+        raise
+    if 'goods' in data:  # No goods sequence in the file, в файле нет последовательности goods
+        loader.dispose()
+        file.close()
+        return data
+    data['goods'] = iter_yaml_goods(file, loader)
+    return data
+
+
+def read_yaml_header(loader):
+    """
+    Construct top level keys of the document until the goods sequence is reached.
+    Собирает ключи верхнего уровня документа до начала последовательности goods.
+    """
+    loader.get_event()  # StreamStart
+    loader.get_event()  # DocumentStart
+    if not loader.check_event(MappingStartEvent):
+        raise ValueError('Price list must be a mapping')
+    loader.get_event()
+    return read_yaml_keys(loader, {'categories': []})
+
+
+def read_yaml_keys(loader, data):
+    """
+    Construct top level keys into data, stop right after the start of the goods sequence.
+    When the document ends without goods sequence, goods is set to an empty list.
+    Собирает ключи верхнего уровня в data, останавливается сразу после начала последовательности goods.
+    Если документ закончился без последовательности goods, goods становится пустым списком.
+    """
+    while not loader.check_event(MappingEndEvent):
+        key = loader.construct_document(loader.compose_node(None, None))
+        if key == 'goods' and loader.check_event(SequenceStartEvent):
+            loader.get_event()
+            return data
+        data[key] = loader.construct_document(loader.compose_node(None, None))
+    data.setdefault('goods', [])
+    return data
+
+
+def skip_yaml_goods(loader):
+    """
+    Walk parser events to the end of the goods sequence without building objects, return number of items.
+    Проходит события парсера до конца последовательности goods без построения объектов, возвращает число
+    элементов.
+    """
+    count = depth = 0
+    while True:
+        event = loader.get_event()
+        if depth == 0:
+            if isinstance(event, SequenceEndEvent):
+                return count
+            count += 1
+        if isinstance(event, (MappingStartEvent, SequenceStartEvent)):
+            depth += 1
+        elif isinstance(event, (MappingEndEvent, SequenceEndEvent)):
+            depth -= 1
+
+
+def iter_yaml_goods(file, loader):
+    """
+    Yield items of the goods sequence, close the file when done.
+    Возвращает элементы последовательности goods, по окончании закрывает файл.
+    """
+    try:
+        while not loader.check_event(SequenceEndEvent):
+            yield loader.construct_document(loader.compose_node(None, None))
+            loader.anchors = {}  # Anchors do not span items, якоря не переходят между товарами
+    finally:
+        loader.dispose()
+        file.close()
+
+
+def read_shop_name(file_path):
+    """
+    Read shop name from the header of yaml file without constructing goods. An open binary file,
+    e.g. an upload, is read from the start and rewound.
+    Читает имя магазина из заголовка yaml файла, не собирая товары. Открытый бинарный файл,
+    например загруженный, читается с начала и перематывается обратно.
+    """
+    if hasattr(file_path, 'read'):
+        file_path.seek(0)
+        try:
+            return read_shop_name_from(file_path)
+        finally:
+            file_path.seek(0)
+    with open(file_path, 'rb') as file:
+        return read_shop_name_from(file)
+
+
+def read_shop_name_from(file):
+    """
+    Read shop name from the header of an open yaml file.
+    Читает имя магазина из заголовка открытого yaml файла.
+    """
+    loader = StreamLoader(file)
+    try:
+        data = read_yaml_header(loader)
+        if 'goods' not in data and 'shop' not in data:
+            skip_yaml_goods(loader)
+            data = read_yaml_keys(loader, data)
+        return data.get('shop')
+    finally:
+        loader.dispose()
+
+
+def count_yaml_goods(file_path):
+    """
+    Count items of the goods sequence walking parser events only, without building objects.
+    Подсчитывает элементы последовательности goods только по событиям парсера, без построения объектов.
+    """
+    with open(file_path, 'rb') as file:
+        loader = StreamLoader(file)
+        try:
+            data = read_yaml_header(loader)
+            if 'goods' in data:
+                return len(data['goods'] or [])
+            return skip_yaml_goods(loader)
+        finally:
+            loader.dispose()
+
+
+def snapshot_path(content_hash):
+    """
+    Path of the binary snapshot of a price list with the given content hash, None when snapshots are off.
+    Путь к бинарному снимку прайс-листа с заданным хэшем содержимого, None, если снимки отключены.
+    """
+    directory = getattr(settings, 'PRICE_LIST_SNAPSHOT_DIR', None)
+    if not directory or not content_hash:
+        return None
+    return os.path.join(directory, f'{content_hash}.msgpack')
+
+
+def write_snapshot(data, content_hash):
+    """
+    Wrap parsed price list so that goods are packed into a msgpack snapshot while they are consumed.
+    The snapshot is a header object (shop, categories) followed by one object per item; it is moved
+    into place only when goods are read to the end, so an interrupted import leaves no snapshot.
+    Оборачивает разобранный прайс-лист, чтобы товары упаковывались в msgpack снимок по мере чтения.
+    Снимок состоит из заголовка (shop, categories) и отдельного объекта на каждый товар; он занимает
+    свое место только после чтения товаров до конца, поэтому прерванный импорт не оставляет снимка.
+    """
+    path = snapshot_path(content_hash)
+    if path is None:
+        return data
+    header = {key: value for key, value in data.items() if key != 'goods'}
+    goods = data.get('goods') or []
+
+    def iter_goods():
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Unique per call, so threads of one process do not share it, уникален для вызова, потоки не делят его
+        descriptor, temporary = tempfile.mkstemp(suffix='.tmp', dir=os.path.dirname(path))
+        packer = msgpack.Packer()
+        try:
+            with open(descriptor, 'wb') as file:
+                file.write(packer.pack(header))
+                for item in goods:
+                    file.write(packer.pack(item))
+                    yield item
+        except BaseException:
+            os.remove(temporary)
+            raise
+        os.replace(temporary, path)
+        prune_snapshots(os.path.dirname(path))
+
+    return {**header, 'goods': iter_goods()}
+
+
+def prune_snapshots(directory):
+    """
+    Keep at most PRICE_LIST_SNAPSHOT_LIMIT snapshots, the least recently used are removed.
+    Хранит не более PRICE_LIST_SNAPSHOT_LIMIT снимков, давно не использованные удаляются.
+    """
+    limit = getattr(settings, 'PRICE_LIST_SNAPSHOT_LIMIT', None)
+    if not limit:
+        return
+    with os.scandir(directory) as entries:
+        snapshots = sorted((entry for entry in entries if entry.name.endswith('.msgpack')),
+                           key=lambda entry: entry.stat().st_mtime, reverse=True)
+    for entry in snapshots[limit:]:
+        try:
+            os.remove(entry.path)
+        except FileNotFoundError:  # Removed by a parallel import, удален параллельным импортом
+            pass
+
+
+def open_snapshot(content_hash):
+    """
+    Open the snapshot of a price list memory-mapped, return (header, unpacker positioned at the first item)
+    or None when there is no snapshot for the hash.
+    Открывает снимок прайс-листа через отображение в память, возвращает (заголовок, распаковщик на первом
+    товаре) или None, если снимка для хэша нет.
+    """
+    path = snapshot_path(content_hash)
+    if path is None or not os.path.exists(path):
+        return None
+    with open(path, 'rb') as file:
+        buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    os.utime(path)  # Mark as recently used, отмечаем как недавно использованный
+    unpacker = msgpack.Unpacker(buffer, raw=False, strict_map_key=False, read_size=FILE_CHUNK_SIZE)
+    return unpacker.unpack(), unpacker, buffer
+
+
+def read_snapshot_header(content_hash):
+    """
+    Read shop and categories from the snapshot of a price list, None when there is no snapshot.
+    Читает магазин и категории из снимка прайс-листа, None, если снимка нет.
+    """
+    snapshot = open_snapshot(content_hash)
+    if snapshot is None:
+        return None
+    header, _, buffer = snapshot
+    buffer.close()
+    return header
+
+
+def load_snapshot(content_hash):
+    """
+    Load price list from its snapshot, goods are returned as a lazy iterator. None when there is no snapshot.
+    Загружает прайс-лист из снимка, товары возвращаются ленивым итератором. None, если снимка нет.
+    """
+    snapshot = open_snapshot(content_hash)
+    if snapshot is None:
+        return None
+    header, unpacker, buffer = snapshot
+
+    def iter_goods():
+        try:
+            yield from unpacker
+        finally:
+            buffer.close()
+
+    return {**header, 'goods': iter_goods()}
+
+
+def count_snapshot_goods(content_hash):
+    """
+    Count items of a snapshot skipping them without building objects, None when there is no snapshot.
+    Подсчитывает товары снимка, пропуская их без построения объектов, None, если снимка нет.
+    """
+    snapshot = open_snapshot(content_hash)
+    if snapshot is None:
+        return None
+    _, unpacker, buffer = snapshot
+    count = 0
+    try:
+        while True:
+            unpacker.skip()
+            count += 1
+    except msgpack.OutOfData:
+        return count
+    finally:
+        buffer.close()
+
+
+def read_price_list(file_path, stream=False, content_hash=None):
+    """
+    Read price list from its snapshot when there is one for content_hash, otherwise parse yaml file
+    and write the snapshot along the way.
+    Читает прайс-лист из снимка, если он есть для content_hash, иначе разбирает yaml файл и попутно
+    записывает снимок.
+    """
+    data = load_snapshot(content_hash)
+    if data is None:
+        data = stream_data_from_yaml(file_path) if stream else load_data_from_yaml(file_path)
+        data = write_snapshot(data, content_hash)
+    return data
+
+
+def price_list_shop_name(file_path, content_hash):
+    """
+    Shop name of a price list from its snapshot when there is one, otherwise from the yaml header.
+    Имя магазина прайс-листа из его снимка, если он есть, иначе из заголовка yaml.
+    """
+    header = read_snapshot_header(content_hash)
+    return read_shop_name(file_path) if header is None else header['shop']
+
+
+def file_hash(file_path):
+    """
+    SHA-256 of file content, read in chunks.
+    SHA-256 содержимого файла, читается блоками.
+    """
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        for chunk in iter(lambda: file.read(FILE_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def item_hash(item):
+    """
+    Hash of a price list item, equal for equal items regardless of key order.
+    Хэш товара прайс-листа, одинаковый для одинаковых товаров независимо от порядка ключей.
+    """
+    content = json.dumps(item, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.blake2b(content.encode(), digest_size=16).hexdigest()
+
+
+def check_price_list_url(url):
+    """
+    Check that a user supplied url is http(s) and its host resolves only to public addresses,
+    so the server does not fetch internal services. Raises ValueError otherwise.
+    Проверяет, что ссылка пользователя - http(s), а ее хост разрешается только в публичные адреса,
+    чтобы сервер не обращался к внутренним сервисам. Иначе вызывает ValueError.
+    """
+    parts = urlsplit(url)
+    if parts.scheme not in ('http', 'https') or not parts.hostname:
+        raise ValueError('Допустимы только ссылки http и https')
+    try:
+        addresses = {info[4][0] for info in socket.getaddrinfo(parts.hostname, parts.port or None)}
+    except (socket.gaierror, UnicodeError, ValueError):
+        raise ValueError('Не удалось разрешить адрес %s' % parts.hostname)
+    if not all(ipaddress.ip_address(address.split('%')[0]).is_global for address in addresses):
+        raise ValueError('Адрес %s недоступен для загрузки' % parts.hostname)
+
+
+def fetch_price_list(url, shop=None, force=False, public_only=False):
+    """
+    Download price list with a conditional GET using ETag/Last-Modified saved for the shop.
+    With public_only every url, redirects included, is checked by check_price_list_url before the request.
+    Returns (temporary file path, price list state of the shop) or None when the server answers 304.
+    Скачивает прайс-лист условным GET с ETag/Last-Modified, сохраненными для магазина.
+    При public_only каждая ссылка, включая перенаправления, проверяется check_price_list_url перед запросом.
+    Возвращает (путь ко временному файлу, состояние прайс-листа магазина) или None при ответе 304.
+    """
+    headers = {}
+    if shop is not None and not force:
+        if shop.price_list_etag:
+            headers['If-None-Match'] = shop.price_list_etag
+        if shop.price_list_modified:
+            headers['If-Modified-Since'] = shop.price_list_modified
+
+    location = url
+    for _ in range(PRICE_LIST_REDIRECTS + 1):
+        if public_only:
+            check_price_list_url(location)
+        response = requests.get(location, headers=headers, stream=True, timeout=30, allow_redirects=not public_only)
+        if not public_only or not response.is_redirect:
+            break
+        response.close()
+        location = urljoin(location, response.headers['Location'])
+    else:
+        raise ValueError('Слишком много перенаправлений')
+
+    digest = hashlib.sha256()
+    with response:
+        if response.status_code == 304:
+            return None
+        response.raise_for_status()
+        with tempfile.NamedTemporaryFile(suffix='.yaml', delete=False) as file:
+            for chunk in response.iter_content(chunk_size=FILE_CHUNK_SIZE):
+                file.write(chunk)
+                digest.update(chunk)
+    return file.name, {
+        'url': url,
+        'price_list_etag': response.headers.get('ETag', ''),
+        'price_list_modified': response.headers.get('Last-Modified', ''),
+        'price_list_hash': digest.hexdigest(),
+    }
+
+
+def check_shop_access(name, user):
+    """
+    Raise PermissionDenied unless the user may import goods of the shop: staff or the owner of an existing shop.
+    Вызывает PermissionDenied, если пользователь не может импортировать товары магазина: это может персонал
+    или владелец существующего магазина.
+    """
+    shop = Shop.objects.filter(name=name).first()
+    if not user.is_staff and (shop is None or not shop.is_managed_by(user)):
+        raise PermissionDenied('Нет прав на обновление магазина %s' % name)
+
+
+def import_categories(shop, categories):
+    """
+    Create missing categories, rename changed ones and link all of them to the shop.
+    Rows are written in id order with conflicts ignored, so parallel imports do not collide.
+    Создает недостающие категории, переименовывает измененные и привязывает их к магазину.
+    Строки пишутся в порядке ИД с игнорированием конфликтов, чтобы параллельные импорты не сталкивались.
+    Returns ids of renamed and of created categories, возвращает ИД переименованных и созданных категорий.
+    """
+    names = dict(sorted((category['id'], category['name']) for category in categories))
+    existing = Category.objects.in_bulk(list(names))
+
+    Category.objects.bulk_create([Category(id=pk, name=name) for pk, name in names.items() if pk not in existing],
+                                 ignore_conflicts=True)
+    renamed = []
+    for pk, category in sorted(existing.items()):
+        if category.name != names[pk]:
+            category.name = names[pk]
+            renamed.append(category)
+    Category.objects.bulk_update(renamed, ['name'])
+
+    # Link shop to categories, Добавляем магазин в категории
+    through = Category.shops.through
+    through.objects.bulk_create([through(category_id=pk, shop_id=shop.id) for pk in names], ignore_conflicts=True)
+    return [category.id for category in renamed], [pk for pk in names if pk not in existing]
+
+
+def create_dimensions(data, batch_size=IMPORT_BATCH_SIZE):
+    """
+    Create missing categories, products and parameters of a price list before its shop transaction.
+    Every batch is written in a short transaction of its own with rows in sorted order, so parallel imports
+    only read shared rows inside their long shop transactions and never lock them in conflicting order.
+    Returns the number of goods, возвращает число товаров.
+    Создает недостающие категории, продукты и параметры прайс-листа до транзакции магазина.
+    Каждый пакет пишется в своей короткой транзакции со строками в отсортированном порядке, поэтому
+    параллельные импорты внутри длинных транзакций магазинов только читают общие строки и никогда не
+    блокируют их в противоположном порядке.
+    """
+    categories = dict(sorted((category['id'], category['name']) for category in data['categories']))
+    with transaction.atomic():
+        existing = set(Category.objects.filter(id__in=list(categories)).values_list('id', flat=True))
+        Category.objects.bulk_create([Category(id=pk, name=name) for pk, name in categories.items()
+                                      if pk not in existing], ignore_conflicts=True)
+    total = 0
+    for batch in batched(data['goods'], batch_size):
+        total += len(batch)
+        names = {name for item in batch for name in item['parameters']}
+        keys = {(item['name'], item['category']) for item in batch}
+        with transaction.atomic():
+            names -= set(Parameter.objects.filter(name__in=names).values_list('name', flat=True))
+            Parameter.objects.bulk_create([Parameter(name=name) for name in sorted(names)], ignore_conflicts=True)
+            keys -= set(Product.objects.filter(
+                name__in={name for name, _ in keys}, category_id__in={category_id for _, category_id in keys}
+            ).values_list('name', 'category_id'))
+            Product.objects.bulk_create([Product(name=name, category_id=category_id)
+                                         for name, category_id in sorted(keys)], ignore_conflicts=True)
+    return total
+
+
+class DimensionMaps:
+    """
+    In-process lookup maps of Parameter and Product ids kept for the whole import.
+    Parameters are preloaded at once, products are loaded per category the first time the category
+    is met; only missing entries are created, in one batch each. Missing rows are inserted with
+    conflicts ignored and read back, so rows created by a parallel import are reused.
+    Maps are not shared between imports: a rolled back import would leave ids of rows that do not exist.
+    Словари ИД параметров и продуктов в памяти процесса на все время импорта.
+    Параметры загружаются сразу, продукты загружаются по категории при первой встрече с ней;
+    создаются только недостающие записи, одним пакетом. Недостающие строки вставляются с игнорированием
+    конфликтов и перечитываются, поэтому строки, созданные параллельным импортом, используются повторно.
+    Словари не разделяются между импортами: откаченный импорт оставил бы ИД несуществующих строк.
+    """
+    def __init__(self):
+        self.parameters = None
+        self.products = {}
+        self.categories = set()  # Categories with loaded products, категории с загруженными продуктами
+
+    def parameter_ids(self, names):
+        """
+        Map parameter names to Parameter ids, creating missing parameters in one batch.
+        Сопоставляет имена параметров с ИД, создавая недостающие параметры одним пакетом.
+        """
+        if self.parameters is None:
+            self.parameters = dict(Parameter.objects.values_list('name', 'id'))
+
+        missing = sorted(name for name in names if name not in self.parameters)
+        if missing:
+            Parameter.objects.bulk_create([Parameter(name=name) for name in missing], ignore_conflicts=True)
+            self.parameters.update(Parameter.objects.filter(name__in=missing).values_list('name', 'id'))
+        return self.parameters
+
+    def product_ids(self, keys, created=None):
+        """
+        Map (name, category_id) pairs to Product ids, creating missing products in one batch.
+        Created products are appended to created when it is given.
+        Сопоставляет пары (имя, категория) с ИД продуктов, создавая недостающие одним пакетом.
+        Созданные продукты добавляются в created.
+        """
+        categories = {category_id for _, category_id in keys} - self.categories
+        if categories:
+            for pk, name, category_id in Product.objects.filter(category_id__in=categories).values_list(
+                    'id', 'name', 'category_id'):
+                self.products[(name, category_id)] = pk
+            self.categories |= categories
+
+        missing = sorted(key for key in keys if key not in self.products)
+        if not missing:
+            return self.products
+        Product.objects.bulk_create([Product(name=name, category_id=category_id) for name, category_id in missing],
+                                    ignore_conflicts=True)
+        for pk, name, category_id in Product.objects.filter(
+                name__in={name for name, _ in missing}, category_id__in={category_id for _, category_id in missing}
+        ).values_list('id', 'name', 'category_id'):
+            self.products[(name, category_id)] = pk
+        if created is not None:
+            created.extend(Product(id=self.products[key], name=key[0], category_id=key[1]) for key in missing)
+        return self.products
+
+
+def goods_fields(item, products):
+    """
+    ProductInfo field values of a price list item, in the form they are read from the DB.
+    Значения полей ProductInfo для товара прайс-листа в том виде, в каком они читаются из БД.
+    """
+    return {
+        'product_id': products[(item['name'], item['category'])],
+        'model': str(item['model']),
+        'price': Decimal(str(item['price'])),
+        'price_rrc': Decimal(str(item['price_rrc'])),
+        'quantity': int(item['quantity']),
+    }
+
+
+def import_goods_batch(shop, goods, stats, touched, hashes, dimensions):
+    """
+    Sync one batch of goods by (shop, external_id): insert new rows, update changed rows and their
+    parameters, leave unchanged rows untouched. hashes maps external ids to item hashes to store,
+    dimensions is the DimensionMaps of the import.
+    Return ids of the ProductInfo rows of the batch.
+    Changed and created rows are reindexed at once and added to touched, a PendingInvalidation, together
+    with created products.
+    Синхронизирует пакет товаров по (магазин, внешний ИД): добавляет новые строки, обновляет измененные
+    строки и их параметры, неизмененные не трогает. hashes сопоставляет внешние ИД с хэшами товаров,
+    dimensions - DimensionMaps импорта.
+    Возвращает ИД строк ProductInfo пакета.
+    Измененные и созданные строки сразу переиндексируются и добавляются в touched, PendingInvalidation,
+    вместе с созданными продуктами.
+    """
+    # Last occurrence wins for duplicated ids, при повторе ИД берем последнее вхождение
+    goods = list({item['id']: item for item in goods}.values())
+
+    products = dimensions.product_ids({(item['name'], item['category']) for item in goods}, touched)
+    parameters = dimensions.parameter_ids({name for item in goods for name in item['parameters']})
+
+    existing = {
+        product_info.external_id: product_info for product_info in ProductInfo.objects.filter(
+            shop_id=shop.id, external_id__in=[item['id'] for item in goods]
+        ).order_by('-id')
+    }
+    current_parameters = {product_info.id: {} for product_info in existing.values()}
+    for product_info_id, parameter_id, value in ProductParameter.objects.filter(
+            product_info_id__in=current_parameters).values_list('product_info_id', 'parameter_id', 'value'):
+        current_parameters[product_info_id][parameter_id] = value
+
+    rows, created, changed, replaced, new_parameters, reindexed = {}, [], [], [], [], []
+    for item in goods:
+        fields = goods_fields(item, products)
+        item_parameters = {parameters[name]: str(value) for name, value in item['parameters'].items()}
+        product_info = existing.get(item['id'])
+
+        if product_info is None:
+            product_info = ProductInfo(shop_id=shop.id, external_id=item['id'], import_hash=hashes[item['id']],
+                                       **fields)
+            created.append(product_info)
+            new_parameters.append((product_info, item_parameters))
+            rows[item['id']] = product_info
+            continue
+        rows[item['id']] = product_info
+
+        fields_changed = any(getattr(product_info, field) != value for field, value in fields.items())
+        parameters_changed = current_parameters[product_info.id] != item_parameters
+        if fields_changed:
+            touched.append(copy(product_info))  # Old state for invalidation, старое состояние для инвалидации
+            for field, value in fields.items():
+                setattr(product_info, field, value)
+        if fields_changed or product_info.import_hash != hashes[item['id']]:
+            product_info.import_hash = hashes[item['id']]
+            changed.append(product_info)
+        if parameters_changed:
+            replaced.append(product_info.id)
+            new_parameters.append((product_info, item_parameters))
+        if fields_changed or parameters_changed:
+            touched.append(product_info)
+            reindexed.append(product_info.id)
+            stats.updated += 1
+        else:
+            stats.unchanged += 1
+
+    ProductInfo.objects.bulk_create(created)
+    ProductInfo.objects.bulk_update(changed, [*SYNC_FIELDS, 'import_hash'])
+    touched.extend(created)
+    stats.inserted += len(created)
+
+    # Replace parameters of changed goods only, Заменяем параметры только измененных товаров
+    ProductParameter.objects.filter(product_info_id__in=replaced).delete()
+    inserted = ProductParameter.objects.bulk_create([
+        ProductParameter(product_info_id=product_info.id, parameter_id=parameter_id, value=value)
+        for product_info, item_parameters in new_parameters for parameter_id, value in item_parameters.items()
+    ])
+    if replaced or inserted:
+        stats.parameters_changed = True
+    reindexed.extend(product_info.id for product_info in created)
+    update_search_index(reindexed)
+    refresh_catalog_items(reindexed)
+    return [product_info.id for product_info in rows.values()]
+
+
+class PendingInvalidation:
+    """
+    Rows to invalidate in cacheops after the transaction. Past INVALIDATE_OBJECTS_LIMIT rows the objects are
+    dropped and only their models are kept to be invalidated whole, so long imports do not hold every row.
+    Строки для инвалидации в cacheops после транзакции. После INVALIDATE_OBJECTS_LIMIT строк объекты
+    отбрасываются и остаются только их модели для инвалидации целиком, чтобы долгий импорт не держал все строки.
+    """
+    def __init__(self):
+        self.objects = []
+        self.models = set()
+
+    def __bool__(self):
+        return bool(self.objects or self.models)
+
+    def append(self, obj):
+        self.extend([obj])
+
+    def extend(self, objects):
+        if self.objects is not None:
+            self.objects.extend(objects)
+            if len(self.objects) <= INVALIDATE_OBJECTS_LIMIT:
+                return
+            objects, self.objects = self.objects, None
+        self.models.update(type(obj) for obj in objects)
+
+    def invalidate(self):
+        for model in self.models:
+            invalidate_model(model)
+        for obj in self.objects or ():
+            invalidate_obj(obj)
+
+
+def invalidate_objects(objects):
+    """
+    Invalidate cacheops keys of the given rows, whole models when there are too many of them.
+    Инвалидирует ключи cacheops для переданных строк, модели целиком, если строк слишком много.
+    """
+    pending = PendingInvalidation()
+    pending.extend(objects)
+    pending.invalidate()
+
+
+def import_goods(data, batch_size=IMPORT_BATCH_SIZE, progress=None, dry_run=False):
+    """
+    Function to import goods from data to database, from data variable.
+    Goods are synced in batches of batch_size by (shop, external_id), rows of the shop missing
+    in data are removed. Goods whose hash equals the stored one are skipped without further queries.
+    Every batch is reindexed before the next one and only ids of imported goods are kept for the whole
+    import, so memory grows with the price list only by them and by the product maps of DimensionMaps.
+    progress(stats) is called after every batch. With dry_run the transaction is rolled back,
+    so stats show the difference between data and the database without changing it.
+    Функция импортирует данные в БД из переменной data.
+    Товары синхронизируются пакетами по batch_size по (магазин, внешний ИД), отсутствующие в data
+    строки магазина удаляются. Товары с хэшем, равным сохраненному, пропускаются без дальнейших запросов.
+    Каждый пакет переиндексируется до следующего, а на весь импорт хранятся только ИД импортированных товаров,
+    поэтому с размером прайс-листа растут только они и словари продуктов DimensionMaps.
+    progress(stats) вызывается после каждого пакета. При dry_run транзакция откатывается, и stats
+    показывают разницу между data и базой данных, не изменяя ее.
+    Returns ImportStats, возвращает ImportStats.
+    """
+    stats = ImportStats()
+    touched = PendingInvalidation()
+    imported = array('q')  # Ids of goods in data, ИД товаров из данных
+    dimensions = DimensionMaps()
+    with count_queries(stats), transaction.atomic(), no_invalidation, deferred_refresh():
+        shop, _ = Shop.objects.get_or_create(name=data['shop'])  # Get or create shop, Получаем или создаем магазин
+        stats.shop_id = shop.id
+        renamed, created_categories = import_categories(shop, data['categories'])
+
+        for batch in batched(data['goods'], batch_size):
+            hashes = {item['id']: item_hash(item) for item in batch}
+            known = {external_id: (pk, import_hash) for external_id, pk, import_hash in ProductInfo.objects.filter(
+                shop_id=shop.id, external_id__in=hashes).values_list('external_id', 'id', 'import_hash')}
+            goods = []
+            for item in batch:
+                pk, import_hash = known.get(item['id'], (None, None))
+                if import_hash == hashes[item['id']]:
+                    imported.append(pk)
+                    stats.unchanged += 1
+                else:
+                    goods.append(item)
+            if goods:
+                imported.extend(import_goods_batch(shop, goods, stats, touched, hashes, dimensions))
+                flush_refresh()
+            stats.rows += len(batch)
+            if progress is not None:
+                progress(stats)
+
+        # Delete goods missing in data page by page, Удаляем товары, которых нет в данных, постранично
+        imported = array('q', sorted(imported))
+        last = 0
+        while True:
+            page = list(ProductInfo.objects.filter(shop_id=shop.id, id__gt=last).order_by('id').values_list(
+                'id', flat=True)[:batch_size])
+            if not page:
+                break
+            seen = set(imported[bisect_right(imported, last):bisect_right(imported, page[-1])])
+            last = page[-1]
+            stale = [pk for pk in page if pk not in seen]
+            if stale:
+                removed = list(ProductInfo.objects.filter(id__in=stale))
+                ProductInfo.objects.filter(id__in=stale).delete()
+                touched.extend(removed)
+                stats.removed += len(removed)
+                update_search_index(stale)
+                refresh_catalog_items(stale)
+                flush_refresh()
+            if len(page) < batch_size:
+                break
+
+        if renamed:  # Category names are copied to the read model, названия категорий копируются в модель чтения
+            refresh_catalog_items(ProductInfo.objects.filter(product__category_id__in=renamed).values_list('id', flat=True))
+        if dry_run:
+            transaction.set_rollback(True)
+
+    if not dry_run:
+        touched.invalidate()
+        if touched or renamed:
+            # Renamed categories are shared by all shops, переименованные категории общие для всех магазинов
+            # Facets are rebuilt only when parameters of goods, parameters or categories changed, not for
+            # prices and stock; removed goods take their parameters along
+            # Фильтры перестраиваются только при изменении параметров товаров, параметров или категорий,
+            # а не цен и остатков; удаленные товары уносят свои параметры
+            facets = stats.parameters_changed or bool(stats.removed or renamed or created_categories)
+            bump_catalog_version(parameters=facets, shops=None if renamed else [shop.id])
+    stats.finish()
+    return stats
+
+
+def init_import_worker():
+    """
+    Initializer of import pool processes: set up Django and drop connections inherited from the parent.
+    Инициализация процессов пула импорта: настройка Django и сброс унаследованных от родителя соединений.
+    """
+    django.setup()
+    connections.close_all()
+
+
+def import_file(location, stream=False, batch_size=IMPORT_BATCH_SIZE, force=False, progress=None, on_total=None,
+                dry_run=False, user=None):
+    """
+    Import one price list from file path or url in its own transaction, retrying with backoff on DB conflicts
+    with parallel imports. Shared categories, products and parameters are created before it by create_dimensions.
+    Urls are fetched with a conditional GET, files are compared by content hash
+    with the last import of the shop; unchanged price lists are skipped unless force is set.
+    Parsed price lists are cached as binary snapshots keyed by content hash, so forced re-imports and
+    dry runs of the same file do not parse yaml again.
+    on_total(count) is called with the number of goods before the import.
+    With dry_run nothing is written, stats show what the import would change.
+    With user, for uploads of partners, only public urls are fetched and the price list must belong to a shop
+    the user manages (check_shop_access).
+    Импортирует один прайс-лист из файла или по ссылке в отдельной транзакции, повторяя попытку с паузой при
+    конфликтах с параллельными импортами. Общие категории, продукты и параметры создаются до нее в
+    create_dimensions. Ссылки скачиваются условным GET, файлы сравниваются по хэшу
+    с последним импортом магазина; неизмененные прайс-листы пропускаются, если не задан force.
+    Разобранные прайс-листы кэшируются бинарными снимками по хэшу содержимого, поэтому повторные
+    импорты и пробные запуски того же файла не разбирают yaml заново.
+    on_total(count) вызывается с числом товаров перед импортом.
+    При dry_run ничего не записывается, stats показывают, что изменил бы импорт.
+    С user, для загрузок партнеров, скачиваются только публичные ссылки, а прайс-лист должен относиться
+    к магазину, которым управляет пользователь (check_shop_access).
+    Returns ImportStats or None for skipped price list, возвращает ImportStats или None, если пропущен.
+    """
+    if location.startswith(('http://', 'https://')):
+        shop = Shop.objects.filter(url=location).first()
+        if user is not None and shop is not None:
+            # State of the shop is used and written below, состояние магазина используется и пишется ниже
+            check_shop_access(shop.name, user)
+        fetched = fetch_price_list(location, shop, force, public_only=user is not None)
+        if fetched is None:
+            return None
+        file_path, state = fetched
+        if not force and shop is not None and shop.price_list_hash == state['price_list_hash']:
+            os.remove(file_path)
+            if not dry_run:
+                Shop.objects.filter(id=shop.id).update(**state)  # Keep new ETag, сохраняем новый ETag
+            return None
+    else:
+        file_path, state = location, {'price_list_hash': file_hash(location)}
+        if not force or user is not None:
+            name = price_list_shop_name(location, state['price_list_hash'])
+            if user is not None:
+                check_shop_access(name, user)
+            shop = Shop.objects.filter(name=name).first()
+            if not force and shop is not None and shop.price_list_hash == state['price_list_hash']:
+                return None
+
+    try:
+        if user is not None and file_path != location:  # Shop of the downloaded file, магазин скачанного файла
+            check_shop_access(price_list_shop_name(file_path, state['price_list_hash']), user)
+        if not dry_run:
+            # Shared rows are committed before the shop transaction, общие строки фиксируются до транзакции магазина
+            total = create_dimensions(read_price_list(file_path, stream, state['price_list_hash']), batch_size)
+        elif on_total is not None:
+            total = count_snapshot_goods(state['price_list_hash'])
+            total = count_yaml_goods(file_path) if total is None else total
+        if on_total is not None:
+            on_total(total)
+        for attempt in range(1, IMPORT_RETRIES + 1):
+            data = read_price_list(file_path, stream, state['price_list_hash'])
+            try:
+                stats = import_goods(data, batch_size=batch_size, progress=progress, dry_run=dry_run)
+                break
+            except (IntegrityError, OperationalError):
+                if attempt == IMPORT_RETRIES:
+                    raise
+                # Back off with jitter so conflicting imports do not collide again
+                # Пауза со случайным разбросом, чтобы конфликтующие импорты не столкнулись снова
+                time.sleep(IMPORT_RETRY_DELAY * 2 ** (attempt - 1) * random.uniform(1, 2))
+        if not dry_run:
+            Shop.objects.filter(id=stats.shop_id).update(**state)
+        return stats
+    finally:
+        if file_path != location:
+            os.remove(file_path)
+
+
+def check_stock_row(external_id, quantity, price):
+    """
+    Check that a parsed stock row fits the ProductInfo columns: integer external id, quantity from 0 up to
+    INTEGER_MAX, finite non-negative price with at most the decimal places and digits of the price field.
+    Raises ValueError with the reason.
+    Проверяет, что разобранная строка остатков помещается в колонки ProductInfo: целый внешний ИД, количество
+    от 0 до INTEGER_MAX, конечная неотрицательная цена не больше чем с количеством знаков и цифр поля цены.
+    Вызывает ValueError с причиной.
+    """
+    if not -INTEGER_MAX - 1 <= external_id <= INTEGER_MAX:
+        raise ValueError('external_id вне допустимого диапазона')
+    if not 0 <= quantity <= INTEGER_MAX:
+        raise ValueError('количество должно быть от 0 до %d' % INTEGER_MAX)
+    if price is None:
+        return
+    field = ProductInfo._meta.get_field('price')
+    if not price.is_finite() or price < 0:
+        raise ValueError('цена должна быть конечным неотрицательным числом')
+    if price >= Decimal(10) ** (field.max_digits - field.decimal_places):
+        raise ValueError('цена должна быть меньше %s' % Decimal(10) ** (field.max_digits - field.decimal_places))
+    if price != price.quantize(Decimal(1).scaleb(-field.decimal_places)):
+        raise ValueError('цена может содержать не больше %d знаков после запятой' % field.decimal_places)
+
+
+def read_stock_csv(lines):
+    """
+    Read (external_id, quantity[, price]) rows from CSV lines, a header line is skipped.
+    Rows are checked by check_stock_row.
+    Читает строки (внешний ИД, количество[, цена]) из строк CSV, строка заголовка пропускается.
+    Строки проверяются check_stock_row.
+    """
+    rows = []
+    for number, row in enumerate(csv.reader(lines), start=1):
+        if not row or (number == 1 and not row[0].strip().lstrip('-').isdigit()):
+            continue
+        try:
+            external_id, quantity = int(row[0]), int(row[1])
+            price = Decimal(row[2].strip()) if len(row) > 2 and row[2].strip() else None
+        except (IndexError, ValueError, InvalidOperation):
+            raise ValueError('Строка %d: ожидается external_id,quantity[,price], получено %r' % (number, row))
+        try:
+            check_stock_row(external_id, quantity, price)
+        except ValueError as e:
+            raise ValueError('Строка %d: %s' % (number, e))
+        rows.append((external_id, quantity, price))
+    return rows
+
+
+def write_stock_field(field, groups, batch_size):
+    """
+    Write new values of one field from {value: [rows]}: one UPDATE per value and chunk of ids, since
+    stock levels repeat a lot. When values repeat less than STOCK_GROUP_SIZE times on average, every
+    chunk is written by one UPDATE ... CASE statement built directly, without the per-row expressions
+    of bulk_update.
+    Записывает новые значения одного поля из {значение: [строки]}: один UPDATE на значение и пакет ИД,
+    так как остатки часто повторяются. Если значения повторяются в среднем реже STOCK_GROUP_SIZE раз,
+    каждый пакет пишется одним UPDATE ... CASE, собранным напрямую, без построчных выражений bulk_update.
+    """
+    count = sum(len(product_infos) for product_infos in groups.values())
+    if len(groups) * STOCK_GROUP_SIZE <= count:
+        for value, product_infos in groups.items():
+            for chunk in batched([product_info.id for product_info in product_infos], batch_size):
+                ProductInfo.objects.filter(id__in=chunk).update(**{field: value, 'import_hash': ''})
+        return
+
+    model_field = ProductInfo._meta.get_field(field)
+    quote = connection.ops.quote_name
+    values = ((product_info.id, model_field.get_db_prep_save(value, connection))
+              for value, product_infos in groups.items() for product_info in product_infos)
+    for chunk in batched(values, batch_size):
+        params = [param for pair in chunk for param in pair] + [pk for pk, _ in chunk]
+        with connection.cursor() as cursor:
+            cursor.execute('UPDATE %s SET %s = CASE %s %s END, %s = \'\' WHERE %s IN (%s)' % (
+                quote(ProductInfo._meta.db_table), quote(model_field.column), quote('id'),
+                ' '.join(['WHEN %s THEN %s'] * len(chunk)), quote('import_hash'), quote('id'),
+                ', '.join(['%s'] * len(chunk))), params)
+
+
+def update_stock(shop, rows, batch_size=IMPORT_BATCH_SIZE):
+    """
+    Apply (external_id, quantity[, price]) rows to goods of the shop with batched updates,
+    products and parameters are not touched. Only rows whose quantity or price differ are written
+    and invalidated. Import hashes of written rows and the price list state of the shop are reset,
+    so the next price list import syncs these goods again.
+    Применяет строки (внешний ИД, количество[, цена]) к товарам магазина пакетными обновлениями,
+    продукты и параметры не затрагиваются. Записываются и инвалидируются только строки с другим
+    количеством или ценой. Хэши импорта записанных строк и состояние прайс-листа магазина сбрасываются,
+    чтобы следующий импорт прайс-листа снова синхронизировал эти товары.
+    Returns ImportStats, возвращает ImportStats.
+    """
+    stats = ImportStats()
+    stats.shop_id = shop.id
+    touched = []
+    changes = {'quantity': {}, 'price': {}}  # Field -> value -> rows, поле -> значение -> строки
+    # Last occurrence wins for duplicated ids, при повторе ИД берем последнее вхождение
+    rows = {row[0]: (row[1], row[2] if len(row) > 2 else None) for row in rows}
+    with count_queries(stats), transaction.atomic(), no_invalidation:
+        for chunk in batched(rows, batch_size):
+            found = set()
+            for product_info in ProductInfo.objects.filter(shop_id=shop.id, external_id__in=chunk):
+                found.add(product_info.external_id)
+                quantity, price = rows[product_info.external_id]
+                price = product_info.price if price is None else Decimal(str(price))
+                if product_info.quantity == quantity and product_info.price == price:
+                    stats.unchanged += 1
+                    continue
+                touched.append(copy(product_info))  # Old state for invalidation, старое состояние для инвалидации
+                for field, value in (('quantity', quantity), ('price', price)):
+                    if getattr(product_info, field) != value:
+                        setattr(product_info, field, value)
+                        changes[field].setdefault(value, []).append(product_info)
+                product_info.import_hash = ''
+                touched.append(product_info)
+                stats.updated += 1
+            stats.missing += len(chunk) - len(found)
+            stats.rows += len(chunk)
+
+        for field, groups in changes.items():
+            write_stock_field(field, groups, batch_size)
+        if stats.updated:
+            Shop.objects.filter(id=shop.id).update(price_list_etag='', price_list_modified='', price_list_hash='')
+        refresh_catalog_items(obj.id for obj in touched)
+
+    invalidate_objects(touched)
+    if touched:
+        bump_catalog_version(shops=[shop.id])
+    stats.finish()
+    return stats
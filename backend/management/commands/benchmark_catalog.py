@@ -0,0 +1,92 @@
+import json
+import os
+import tempfile
+import time
+from django.core.management.base import BaseCommand
+from django.db import connections
+from rest_framework.renderers import JSONRenderer
+from backend.fragments import catalog_item_rows, join_fragments, render_json
+from backend.importer import import_file
+from backend.management.commands.generate_price_list import write_price_list
+from backend.models import CatalogItem, ProductInfo, Shop
+from backend.serializers import CatalogItemSerializer, ProductInfoSerializer
+
+
+def product_info_serializer(ids):
+    """
+    Existing path: ProductInfo with joins and prefetched parameters through ProductInfoSerializer.
+    Существующий путь: ProductInfo с соединениями и параметрами через ProductInfoSerializer.
+    """
+    queryset = ProductInfo.objects.filter(id__in=ids).order_by('id').select_related(
+        'shop', 'product__category').prefetch_related('product_parameters__parameter')
+    return JSONRenderer().render(ProductInfoSerializer(queryset, many=True).data)
+
+
+def catalog_item_serializer(ids):
+    """
+    Read model rows through CatalogItemSerializer.
+    Строки модели чтения через CatalogItemSerializer.
+    """
+    queryset = CatalogItem.objects.filter(id__in=ids).order_by('id')
+    return JSONRenderer().render(CatalogItemSerializer(queryset, many=True).data)
+
+
+def values_rows(ids):
+    """
+    Read model rows as plain dicts from values_list, without serializers.
+    Строки модели чтения в виде словарей из values_list, без сериализаторов.
+    """
+    rows = catalog_item_rows(ids)
+    return join_fragments([render_json(rows[pk][1]) for pk in sorted(rows)])
+
+
+PATHS = {
+    'product_info_serializer': product_info_serializer,
+    'catalog_item_serializer': catalog_item_serializer,
+    'values_rows': values_rows,
+}
+
+
+class Command(BaseCommand):
+    help = 'Бенчмарк сериализации каталога: ProductInfoSerializer, CatalogItemSerializer и словари из values()'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--goods', type=int, default=10000, help='Число товаров в выборке')
+        parser.add_argument('--repeat', type=int, default=5, help='Повторов каждого варианта, берется лучший')
+        parser.add_argument('--output', default='catalog_benchmark.json', help='Файл с результатами (JSON)')
+        parser.add_argument('--keep', action='store_true', help='Не удалять импортированный магазин')
+
+    def handle(self, *args, **kwargs):
+        shop = f'Benchmark catalog {kwargs["goods"]}'
+        with tempfile.TemporaryDirectory() as directory:
+            file_path = os.path.join(directory, 'catalog.yaml')
+            write_price_list(file_path, kwargs['goods'], shop=shop)
+            import_file(file_path, stream=True, force=True)
+        ids = list(ProductInfo.objects.filter(shop__name=shop).values_list('id', flat=True))
+
+        results = {
+            'started_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'database': connections['default'].vendor,
+            'goods': len(ids),
+            'paths': {},
+        }
+        outputs = {}
+        for name, path in PATHS.items():
+            timings = []
+            for _ in range(kwargs['repeat']):
+                started = time.monotonic()
+                outputs[name] = path(ids)
+                timings.append(time.monotonic() - started)
+            best = min(timings)
+            results['paths'][name] = {'wall_time': round(best, 4), 'items_per_second': round(len(ids) / best, 1)}
+            self.stdout.write('%s: %.1f мс (%.0f товаров/с)' % (name, best * 1000, len(ids) / best))
+
+        results['identical'] = len(set(outputs.values())) == 1
+        if not results['identical']:
+            self.stdout.write(self.style.ERROR('Вывод вариантов отличается'))
+        if not kwargs['keep']:
+            Shop.objects.filter(name=shop).delete()
+
+        with open(kwargs['output'], 'w', encoding='utf-8') as file:
+            json.dump(results, file, ensure_ascii=False, indent=2)
+        self.stdout.write(self.style.SUCCESS('Результаты записаны в %s' % kwargs['output']))
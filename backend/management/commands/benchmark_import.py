@@ -0,0 +1,90 @@
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from django.core.management.base import BaseCommand
+from django.db import connections
+from backend.importer import IMPORT_BATCH_SIZE, file_hash, import_file, init_import_worker, snapshot_path
+from backend.management.commands.generate_price_list import write_price_list
+from backend.models import Shop
+
+
+def peak_rss_mb():
+    """
+    Peak resident memory of the current process in megabytes.
+    Пиковый объем резидентной памяти текущего процесса в мегабайтах.
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def run_import(file_path, stream, batch_size):
+    """
+    Import one file in a fresh worker process and measure it: first import parsing yaml, then an unchanged
+    re-import from the binary snapshot. The snapshot is removed afterwards.
+    Импортирует файл в новом процессе и измеряет: первый импорт с разбором yaml, затем повторный импорт
+    без изменений из бинарного снимка. Снимок затем удаляется.
+    """
+    phases = {}
+    for phase in ('import', 'reimport'):
+        started = time.monotonic()
+        stats = import_file(file_path, stream=stream, batch_size=batch_size, force=True)
+        wall = time.monotonic() - started
+        phases[phase] = {
+            'wall_time': round(wall, 3),
+            'rows_per_second': round(stats.rows / wall, 1) if wall else None,
+            'queries': stats.queries,
+            **{key: value for key, value in stats.as_dict().items() if key not in ('elapsed', 'rows_per_second')},
+        }
+    phases['peak_rss_mb'] = round(peak_rss_mb(), 1)
+    snapshot = snapshot_path(file_hash(file_path))
+    if snapshot is not None and os.path.exists(snapshot):
+        os.remove(snapshot)
+    return phases
+
+
+class Command(BaseCommand):
+    help = 'Бенчмарк импорта прайс-листов синтетическими файлами разного размера'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 100000, 1000000],
+                            help='Размеры прайс-листов в товарах')
+        parser.add_argument('--output', default='import_benchmark.json', help='Файл с результатами (JSON)')
+        parser.add_argument('--batch-size', type=int, default=IMPORT_BATCH_SIZE, help='Товаров в одном пакете записи')
+        parser.add_argument('--no-stream', action='store_true', help='Загружать файл целиком, без потокового чтения')
+        parser.add_argument('--keep', action='store_true', help='Не удалять импортированные магазины')
+
+    def handle(self, *args, **kwargs):
+        results = {
+            'started_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'database': connections['default'].vendor,
+            'batch_size': kwargs['batch_size'],
+            'stream': not kwargs['no_stream'],
+            'runs': [],
+        }
+        with tempfile.TemporaryDirectory() as directory:
+            for size in kwargs['sizes']:
+                shop = f'Benchmark {size}'
+                file_path = os.path.join(directory, f'bench_{size}.yaml')
+                write_price_list(file_path, size, shop=shop)
+
+                # Fresh process per size to get its own peak RSS, новый процесс на размер для отдельного пика RSS
+                connections.close_all()
+                with ProcessPoolExecutor(max_workers=1, initializer=init_import_worker) as pool:
+                    phases = pool.submit(run_import, file_path, not kwargs['no_stream'], kwargs['batch_size']).result()
+
+                run = {'goods': size, 'file_size_mb': round(os.path.getsize(file_path) / (1024 * 1024), 2), **phases}
+                results['runs'].append(run)
+                self.stdout.write('%d товаров: импорт %.2fs (%.0f строк/с, %d запросов), повторно %.2fs, RSS %.1f МБ' % (
+                    size, run['import']['wall_time'], run['import']['rows_per_second'], run['import']['queries'],
+                    run['reimport']['wall_time'], run['peak_rss_mb']))
+
+                if not kwargs['keep']:
+                    Shop.objects.filter(name=shop).delete()
+
+        with open(kwargs['output'], 'w', encoding='utf-8') as file:
+            json.dump(results, file, ensure_ascii=False, indent=2)
+        self.stdout.write(self.style.SUCCESS('Результаты записаны в %s' % kwargs['output']))
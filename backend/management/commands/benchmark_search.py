@@ -0,0 +1,106 @@
+import json
+import statistics
+import time
+from itertools import islice
+from django.core.management.base import BaseCommand
+from django.db import connection, connections, transaction
+from django.db.models import Max
+from backend.catalog import filter_products
+from backend.management.commands.generate_price_list import generate_goods
+from backend.models import CatalogItem
+from backend.search import SEARCH_TABLE, fuzzy_index_available, index_words, search_index_available
+
+QUERIES = ['смартфн aple', 'samsng b39', 'наушнки sony', 'xiaomi a74 128gb', 'телевизр lg', 'планшет huawey']
+CHUNK_SIZE = 10000
+
+
+def fill_names(names):
+    """
+    Insert synthetic CatalogItem rows with their full-text and trigram index rows, ids follow the existing
+    rows. Returns the number of rows.
+    Вставляет синтетические строки CatalogItem вместе со строками полнотекстового и триграммного индексов,
+    ИД идут после существующих строк. Возвращает число строк.
+    """
+    start = (CatalogItem.objects.aggregate(last=Max('id'))['last'] or 0) + 1
+    goods = generate_goods(names)
+    count = 0
+    while True:
+        chunk = list(islice(goods, CHUNK_SIZE))
+        if not chunk:
+            break
+        CatalogItem.objects.bulk_create([CatalogItem(
+            id=start + count + number, product_id=0, product_name=item['name'], category_id=item['category'],
+            category_name='', shop_id=0, shop_name='Benchmark search', shop_state=True, model=item['model'],
+            quantity=item['quantity'], price=item['price'], price_rrc=item['price_rrc'], version='')
+            for number, item in enumerate(chunk)])
+        if connection.vendor == 'sqlite' and fuzzy_index_available():
+            index_words(text for item in chunk for text in (item['name'], item['model']))
+        count += len(chunk)
+
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute('INSERT INTO {0} (rowid, name, model, shop) SELECT id, product_name, model, shop_name '
+                           'FROM {1} WHERE id >= %s'.format(SEARCH_TABLE, CatalogItem._meta.db_table), [start])
+        else:
+            cursor.execute("INSERT INTO {0} (product_info_id, document) SELECT id, "
+                           "setweight(to_tsvector('russian', product_name), 'A') || "
+                           "setweight(to_tsvector('russian', model), 'B') FROM {1} WHERE id >= %s".format(
+                               SEARCH_TABLE, CatalogItem._meta.db_table), [start])
+    return count
+
+
+def first_page(text, fuzzy):
+    """
+    Ids of the first catalog page for the search, as ProductInfoView selects them.
+    ИД первой страницы каталога для поиска, как их выбирает ProductInfoView.
+    """
+    filters = {'search': text, 'fuzzy': True} if fuzzy else {'search': text}
+    return list(filter_products(filters).order_by('-search_rank', 'id').values_list('id', flat=True)[:40])
+
+
+class Command(BaseCommand):
+    help = 'Бенчмарк обычного и нечеткого поиска на синтетических названиях, данные откатываются после замера'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--names', type=int, default=1000000, help='Число синтетических товаров')
+        parser.add_argument('--repeat', type=int, default=20, help='Повторов каждого запроса')
+        parser.add_argument('--query', action='append', help='Строка поиска, можно несколько раз')
+        parser.add_argument('--output', default='search_benchmark.json', help='Файл с результатами (JSON)')
+
+    def handle(self, *args, **kwargs):
+        if not search_index_available() or not fuzzy_index_available():
+            self.stdout.write(self.style.WARNING('Индексы поиска недоступны, выполните migrate'))
+            return
+
+        results = {
+            'started_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'database': connections['default'].vendor,
+            'names': kwargs['names'],
+            'queries': {},
+        }
+        with transaction.atomic():
+            started = time.monotonic()
+            fill_names(kwargs['names'])
+            results['fill_time'] = round(time.monotonic() - started, 1)
+            self.stdout.write('Заполнено %d названий за %.1f с' % (kwargs['names'], results['fill_time']))
+
+            for text in kwargs['query'] or QUERIES:
+                results['queries'][text] = {}
+                for mode, fuzzy in (('exact', False), ('fuzzy', True)):
+                    first_page(text, fuzzy)  # Warm up, прогрев
+                    timings = []
+                    for _ in range(kwargs['repeat']):
+                        started = time.perf_counter()
+                        found = len(first_page(text, fuzzy))
+                        timings.append((time.perf_counter() - started) * 1000)
+                    results['queries'][text][mode] = {
+                        'found': found, 'median_ms': round(statistics.median(timings), 2),
+                        'max_ms': round(max(timings), 2),
+                    }
+                    self.stdout.write('%s [%s]: %d найдено, медиана %.1f мс, максимум %.1f мс' % (
+                        text, mode, found, statistics.median(timings), max(timings)))
+            transaction.set_rollback(True)
+
+        with open(kwargs['output'], 'w', encoding='utf-8') as file:
+            json.dump(results, file, ensure_ascii=False, indent=2)
+        self.stdout.write(self.style.SUCCESS('Результаты записаны в %s' % kwargs['output']))
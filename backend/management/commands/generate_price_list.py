@@ -0,0 +1,92 @@
+import random
+from django.core.management.base import BaseCommand
+
+
+CATEGORIES = [('Смартфоны', 'Смартфон'), ('Аксессуары', 'Аксессуар'), ('Flash-накопители', 'Flash-накопитель'),
+              ('Телевизоры', 'Телевизор'), ('Ноутбуки', 'Ноутбук'), ('Планшеты', 'Планшет'),
+              ('Наушники', 'Наушники'), ('Умные часы', 'Умные часы'), ('Зубные щетки', 'Зубная щетка'),
+              ('Фотоаппараты', 'Фотоаппарат')]
+BRANDS = ['Apple', 'Samsung', 'Xiaomi', 'Huawei', 'Sony', 'LG', 'Lenovo', 'Asus', 'Honor', 'Realme']
+COLORS = ['черный', 'белый', 'синий', 'красный', 'золотистый', 'серебристый', 'зеленый']
+PARAMETERS = {
+    'Диагональ (дюйм)': lambda rnd: rnd.choice([5.8, 6.1, 6.5, 6.7, 10.2, 13.3, 15.6, 43, 55, 65]),
+    'Разрешение (пикс)': lambda rnd: rnd.choice(['2688x1242', '1792x828', '1920x1080', '3840x2160']),
+    'Встроенная память (Гб)': lambda rnd: rnd.choice([32, 64, 128, 256, 512]),
+    'Цвет': lambda rnd: rnd.choice(COLORS),
+    'Вес (г)': lambda rnd: rnd.randint(20, 3000),
+    'Гарантия (мес)': lambda rnd: rnd.choice([6, 12, 24]),
+    'Тип': lambda rnd: rnd.choice(['электрическая', 'беспроводной', 'проводной', 'смарт']),
+    'Емкость аккумулятора (мАч)': lambda rnd: rnd.choice([3000, 4000, 5000, 10000]),
+}
+
+
+def generate_goods(goods, seed=0):
+    """
+    Synthetic goods as dicts in the price list shape: id, category, model, name, prices, quantity, parameters.
+    Синтетические товары в виде словарей в формате прайс-листа: id, category, model, name, цены, quantity,
+    parameters.
+    """
+    rnd = random.Random(seed)
+    for number in range(goods):
+        category = rnd.randint(1, len(CATEGORIES))
+        brand = rnd.choice(BRANDS)
+        model = f'{brand.lower()}/{rnd.choice("abcdefgh")}{rnd.randint(1, 999)}'
+        memory = PARAMETERS['Встроенная память (Гб)'](rnd)
+        color = rnd.choice(COLORS)
+        price = rnd.randint(5, 20000) * 10
+        item = {
+            'id': 1000000 + number,
+            'category': category,
+            'model': model,
+            'name': f'{CATEGORIES[category - 1][1]} {brand} {model.split("/")[1].upper()} {memory}GB ({color})',
+            'price': price,
+            'price_rrc': price + rnd.randint(0, 50) * 100,
+            'quantity': rnd.randint(0, 50),
+            'parameters': {'Встроенная память (Гб)': memory, 'Цвет': color},
+        }
+        for parameter in rnd.sample(sorted(PARAMETERS), 3):
+            if parameter not in ('Встроенная память (Гб)', 'Цвет'):
+                item['parameters'][parameter] = PARAMETERS[parameter](rnd)
+        yield item
+
+
+def write_price_list(file_path, goods, shop='Генератор', seed=0):
+    """
+    Write a synthetic supplier price list in the shop/categories/goods/parameters shape.
+    The file is written item by item, so any number of goods fits in constant memory.
+    Записывает синтетический прайс-лист поставщика в формате shop/categories/goods/parameters.
+    Файл пишется по одному товару, поэтому любое число товаров помещается в постоянный объем памяти.
+    """
+    with open(file_path, 'w', encoding='utf-8') as file:
+        file.write(f'shop: {shop}\ncategories:\n')
+        for number, (name, _) in enumerate(CATEGORIES, start=1):
+            file.write(f'  - id: {number}\n    name: {name}\n')
+
+        file.write('goods:\n')
+        for item in generate_goods(goods, seed):
+            file.write(
+                f'  - id: {item["id"]}\n'
+                f'    category: {item["category"]}\n'
+                f'    model: {item["model"]}\n'
+                f'    name: {item["name"]}\n'
+                f'    price: {item["price"]}\n'
+                f'    price_rrc: {item["price_rrc"]}\n'
+                f'    quantity: {item["quantity"]}\n'
+                f'    parameters:\n'
+            )
+            for parameter, value in item['parameters'].items():
+                file.write(f'      "{parameter}": {value}\n')
+
+
+class Command(BaseCommand):
+    help = 'Генерация синтетического прайс-листа поставщика'
+
+    def add_arguments(self, parser):
+        parser.add_argument('output', help='Путь к создаваемому YAML файлу')
+        parser.add_argument('--goods', type=int, default=1000, help='Число товаров')
+        parser.add_argument('--shop', default='Генератор', help='Название магазина')
+        parser.add_argument('--seed', type=int, default=0, help='Зерно генератора случайных чисел')
+
+    def handle(self, *args, **kwargs):
+        write_price_list(kwargs['output'], kwargs['goods'], shop=kwargs['shop'], seed=kwargs['seed'])
+        self.stdout.write(self.style.SUCCESS('Создан прайс-лист %s на %d товаров' % (kwargs['output'], kwargs['goods'])))
@@ -1,65 +1,86 @@
+import glob
 import os
-import yaml
-from django.core.management.base import BaseCommand
-from backend.models import Category, Product, ProductInfo, Shop, Parameter, ProductParameter
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from backend.importer import IMPORT_BATCH_SIZE, import_file, init_import_worker
 
 
-def load_data_from_yaml(file_path):
+def collect_files(paths):
     """
-    This function download data from yaml file, to variable and return that.
-    Функция загружает данные из файла в переменную  data, возвращая ее в результате исполнения.
+    Expand files, directories and glob patterns into a sorted list of yaml files.
+    Раскрывает файлы, каталоги и glob-шаблоны в отсортированный список yaml файлов.
     """
-    with open(file_path, 'r', encoding='utf-8') as file:
-        data = yaml.safe_load(file)
-    return data
+    files = set()
+    for path in paths:
+        if os.path.isdir(path):
+            files.update(glob.glob(os.path.join(path, '*.yaml')) + glob.glob(os.path.join(path, '*.yml')))
+        else:
+            files.update(glob.glob(path) or [path])
+    return sorted(files)
 
 
-def import_goods(data):
-    """
-    Function to import goods from data to database, from data variable.
-    Функция импортирует данные в БД из переменной data
-    """
-    shop, created = Shop.objects.get_or_create(name=data['shop']) # Get or create shop, Получаем или создаем магазин
-
-    for category in data['categories']:  # Import categories, Импорт категорий
-        category_object, _ = Category.objects.get_or_create(id=category['id'], name=category['name'])
-        category_object.shops.add(shop.id)  #  Add shop to category, Добавляем магазин в категорию
-        category_object.save()
-
-    ProductInfo.objects.filter(shop_id=shop.id).delete()
-    # Удаляем старые данные по товару для текущего магазина
-    # Delete old data in productinfo for this shop
+class Command(BaseCommand):
+    help = 'Импорт товаров из YAML файлов, по одному магазину на процесс'
 
-    for item in data['goods']:  # ImportGoods, Импорт товаров
-        # Get or create product in database, Получаем или создаем продукт в базе данных
-        product, _ = Product.objects.get_or_create(name=item['name'], category_id=item['category'])
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='*', default=[os.path.join('data', 'shop1.yaml')],
+                            help='Файлы, каталоги, glob-шаблоны или ссылки на прайс-листы')
+        parser.add_argument('--workers', type=int, default=1,
+                            help='Число параллельных процессов импорта')
+        parser.add_argument('--batch-size', type=int, default=IMPORT_BATCH_SIZE,
+                            help='Товаров в одном пакете записи')
+        parser.add_argument('--stream', action='store_true',
+                            help='Потоковое чтение файла, для больших прайс-листов')
+        parser.add_argument('--force', action='store_true',
+                            help='Импортировать даже неизмененные прайс-листы')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Показать изменения без записи в базу данных')
 
-        # Create productinfo, Создаем информацию о товаре
-        product_info = ProductInfo.objects.create(
-            product_id=product.id,
-            external_id=item['id'],
-            model=item['model'],
-            price=item['price'],
-            price_rrc=item['price_rrc'],
-            quantity=item['quantity'],
-            shop_id=shop.id
-        )
+    def handle(self, *args, **kwargs):
+        files = collect_files(kwargs['paths'])
+        if not files:
+            raise CommandError('Не найдено файлов для импорта')
 
-        # Import ProductParameter, Импортируем параметры товара
-        for name, value in item['parameters'].items():
-            parameter_object, _ = Parameter.objects.get_or_create(name=name)
-            ProductParameter.objects.create(
-                product_info_id=product_info.id,
-                parameter_id=parameter_object.id,
-                value=value
-            )
+        workers = min(kwargs['workers'], len(files))
+        if workers > 1 and connection.vendor == 'sqlite':
+            # SQLite allows one writer at a time, SQLite допускает только одного пишущего
+            self.stdout.write(self.style.WARNING('SQLite не поддерживает параллельную запись, импорт в 1 процесс'))
+            workers = 1
 
+        options = {'stream': kwargs['stream'], 'batch_size': kwargs['batch_size'], 'force': kwargs['force'],
+                   'dry_run': kwargs['dry_run']}
+        started = time.monotonic()
+        failed = []
+        if workers == 1:
+            for file_path in files:
+                try:
+                    self.report(file_path, import_file(file_path, **options), options['dry_run'])
+                except Exception as e:
+                    failed.append(file_path)
+                    self.stderr.write('Ошибка импорта %s: %s' % (file_path, e))
+        else:
+            connections.close_all()  # Do not share connections with workers, не делим соединения с процессами
+            with ProcessPoolExecutor(max_workers=workers, initializer=init_import_worker) as pool:
+                futures = {pool.submit(import_file, file_path, **options): file_path for file_path in files}
+                for future in as_completed(futures):
+                    try:
+                        self.report(futures[future], future.result(), options['dry_run'])
+                    except Exception as e:
+                        failed.append(futures[future])
+                        self.stderr.write('Ошибка импорта %s: %s' % (futures[future], e))
 
-class Command(BaseCommand):
-    help = 'Импорт товаров из YAML файла'
+        self.stdout.write('Файлов: %d, процессов: %d, время: %.2fs' % (len(files), workers, time.monotonic() - started))
+        if failed:
+            raise CommandError('Не удалось импортировать: %s' % ', '.join(failed))
 
-    def handle(self, *args, **kwargs):
-        file_path = os.path.join('data', 'shop1.yaml')
-        data = load_data_from_yaml(file_path)
-        import_goods(data)
+    def report(self, file_path, stats, dry_run=False):
+        if stats is None:
+            self.stdout.write('Прайс-лист %s не изменился, пропущен' % file_path)
+            return
+        if dry_run:
+            self.stdout.write('Пробный запуск %s, изменения не записаны: %s' % (file_path, stats))
+            return
         self.stdout.write(self.style.SUCCESS('Успешно импортированы из %s' % file_path))
+        self.stdout.write('Статистика импорта: %s' % stats)
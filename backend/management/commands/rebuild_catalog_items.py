@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+from backend.catalog_items import rebuild_catalog_items
+from backend.models import CatalogItem
+
+
+class Command(BaseCommand):
+    help = 'Полное перестроение модели чтения каталога (CatalogItem)'
+
+    def handle(self, *args, **kwargs):
+        rebuild_catalog_items()
+        self.stdout.write(self.style.SUCCESS('Модель чтения каталога перестроена: %d строк' % CatalogItem.objects.count()))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from backend.search import rebuild_search_index, search_index_available
+
+
+class Command(BaseCommand):
+    help = 'Полное перестроение полнотекстового индекса каталога'
+
+    def handle(self, *args, **kwargs):
+        if not search_index_available():
+            self.stdout.write(self.style.WARNING('Полнотекстовый индекс недоступен, выполните migrate'))
+            return
+        rebuild_search_index()
+        self.stdout.write(self.style.SUCCESS('Полнотекстовый индекс перестроен'))
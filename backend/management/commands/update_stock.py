@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+from backend.importer import IMPORT_BATCH_SIZE, read_stock_csv, update_stock
+from backend.models import Shop
+
+
+class Command(BaseCommand):
+    help = 'Обновление остатков и цен магазина из CSV файла external_id,quantity[,price]'
+
+    def add_arguments(self, parser):
+        parser.add_argument('shop', help='Название магазина')
+        parser.add_argument('path', help='CSV файл со строками external_id,quantity[,price]')
+        parser.add_argument('--batch-size', type=int, default=IMPORT_BATCH_SIZE,
+                            help='Товаров в одном пакете записи')
+
+    def handle(self, *args, **kwargs):
+        shop = Shop.objects.filter(name=kwargs['shop']).first()
+        if shop is None:
+            raise CommandError('Магазин %s не найден' % kwargs['shop'])
+        try:
+            with open(kwargs['path'], encoding='utf-8-sig', newline='') as file:
+                rows = read_stock_csv(file)
+        except (OSError, ValueError) as e:
+            raise CommandError(str(e))
+
+        stats = update_stock(shop, rows, batch_size=kwargs['batch_size'])
+        self.stdout.write(self.style.SUCCESS('Остатки магазина %s обновлены из %s' % (shop, kwargs['path'])))
+        self.stdout.write('Статистика: %s, не найдено %d' % (stats, stats.missing))
@@ -10,10 +10,23 @@ class Shop(models.Model):
     name = models.CharField(max_length=50, verbose_name='Название')
     url = models.URLField(max_length=200, null=True, blank=True, verbose_name='Ссылка')
     state = models.BooleanField(default=True, verbose_name='статус получения заказов')
+    price_list_etag = models.CharField(max_length=200, blank=True, default='', verbose_name='ETag прайс-листа')
+    price_list_modified = models.CharField(max_length=50, blank=True, default='',
+                                           verbose_name='Last-Modified прайс-листа')
+    price_list_hash = models.CharField(max_length=64, blank=True, default='', verbose_name='Хэш прайс-листа')
+    user = models.ForeignKey(User, related_name='shops', on_delete=models.SET_NULL, null=True, blank=True,
+                             verbose_name='Владелец')
 
     def __str__(self):
         return self.name
 
+    def is_managed_by(self, user):
+        """
+        Whether the user may update goods of the shop: staff or the owner.
+        Может ли пользователь обновлять товары магазина: персонал или владелец.
+        """
+        return user.is_staff or (self.user_id is not None and self.user_id == user.id)
+
     class Meta:
         verbose_name = 'Магазин'
         verbose_name_plural = "Список магазинов"
@@ -45,6 +58,9 @@ class Product(models.Model):
         verbose_name = 'Товар'
         verbose_name_plural = "Товары"
         ordering = ('id',)
+        constraints = [
+            models.UniqueConstraint(fields=['name', 'category'], name='unique_product'),
+        ]
 
 
 class ProductInfo(models.Model):
@@ -57,6 +73,7 @@ class ProductInfo(models.Model):
     price_rrc = models.DecimalField(max_digits=12, decimal_places=2, verbose_name='Рекомендуемая розничная цена')
     model = models.CharField(max_length=80, blank=True, verbose_name='Модель')
     external_id = models.IntegerField(verbose_name='Внешний ИД')
+    import_hash = models.CharField(max_length=32, blank=True, default='', verbose_name='Хэш строки прайс-листа')
 
     class Meta:
         verbose_name = 'Информация о продукте'
@@ -64,10 +81,13 @@ class ProductInfo(models.Model):
         constraints = [
             models.UniqueConstraint(fields=['product', 'shop', 'external_id'], name='unique_product_info'),
         ]
+        indexes = [
+            models.Index(fields=['shop', 'external_id'], name='product_info_shop_external'),  # Import sync, импорт
+        ]
 
 
 class Parameter(models.Model):
-    name = models.CharField(max_length=50, verbose_name='Название')
+    name = models.CharField(max_length=50, unique=True, verbose_name='Название')
 
     def __str__(self):
         return self.name
@@ -84,6 +104,48 @@ class ProductParameter(models.Model):
         return f"{self.parameter.name}: {self.value}"
 
 
+class CatalogItem(models.Model):
+    """
+    Read model of the catalog: one flat row per ProductInfo with the same id, product, category and shop
+    fields copied and parameters folded into a list. Rows are written by backend.catalog_items only.
+    Модель чтения каталога: одна плоская строка на ProductInfo с тем же ИД, скопированными полями продукта,
+    категории и магазина и параметрами, свернутыми в список. Строки пишет только backend.catalog_items.
+    """
+    id = models.BigIntegerField(primary_key=True, verbose_name='ИД информации о продукте')
+    product_id = models.BigIntegerField(verbose_name='ИД продукта')
+    product_name = models.CharField(max_length=255, verbose_name='Название')
+    category_id = models.BigIntegerField(verbose_name='ИД категории')
+    category_name = models.CharField(max_length=255, verbose_name='Категория')
+    shop_id = models.BigIntegerField(verbose_name='ИД магазина')
+    shop_name = models.CharField(max_length=50, verbose_name='Магазин')
+    shop_state = models.BooleanField(verbose_name='статус получения заказов')
+    model = models.CharField(max_length=80, blank=True, verbose_name='Модель')
+    quantity = models.IntegerField(verbose_name='Количество')
+    price = models.DecimalField(max_digits=12, decimal_places=2, verbose_name='Цена')
+    price_rrc = models.DecimalField(max_digits=12, decimal_places=2, verbose_name='Рекомендуемая розничная цена')
+    parameters = models.JSONField(default=list, verbose_name='Параметры')
+    version = models.CharField(max_length=32, verbose_name='Версия строки')
+
+    class Meta:
+        verbose_name = 'Строка каталога'
+        verbose_name_plural = "Каталог для чтения"
+        indexes = [
+            models.Index(fields=['shop_state', 'id'], name='catalog_item_state'),  # Listing, список
+            models.Index(fields=['shop_id', 'id'], name='catalog_item_shop'),
+            models.Index(fields=['category_id', 'id'], name='catalog_item_category'),
+            # Orderings and price ranges over open shops only, сортировки и диапазоны цен только по открытым магазинам
+            models.Index(fields=['price', 'id'], name='catalog_item_price', condition=models.Q(shop_state=True)),
+            models.Index(fields=['product_name', 'id'], name='catalog_item_name',
+                         condition=models.Q(shop_state=True)),
+            models.Index(fields=['quantity', 'id'], name='catalog_item_quantity',
+                         condition=models.Q(shop_state=True)),
+            models.Index(fields=['shop_id', 'price', 'id'], name='catalog_item_shop_price',
+                         condition=models.Q(shop_state=True)),
+            models.Index(fields=['category_id', 'price', 'id'], name='catalog_item_category_price',
+                         condition=models.Q(shop_state=True)),
+        ]
+
+
 class Contact(models.Model):
 
     user = models.ForeignKey(User, related_name='contacts', on_delete=models.CASCADE,
@@ -149,3 +211,34 @@ class ProductImage(models.Model):
 
     def __str__(self):
         return f"Image for {self.product.name}"
+
+
+class ImportJob(models.Model):
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('skipped', 'Skipped'),
+        ('failed', 'Failed'),
+    ]
+    user = models.ForeignKey(User, related_name='import_jobs', on_delete=models.CASCADE, verbose_name='Пользователь')
+    url = models.URLField(max_length=200, null=True, blank=True, verbose_name='Ссылка на прайс-лист')
+    file = models.FileField(upload_to='price_lists/', null=True, blank=True, verbose_name='Файл прайс-листа')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending', verbose_name='Статус')
+    shop = models.ForeignKey(Shop, related_name='import_jobs', on_delete=models.SET_NULL, null=True, blank=True,
+                             verbose_name='Магазин')
+    total = models.IntegerField(null=True, blank=True, verbose_name='Всего товаров')
+    processed = models.IntegerField(default=0, verbose_name='Обработано товаров')
+    result = models.JSONField(default=dict, blank=True, verbose_name='Статистика импорта')
+    error = models.TextField(blank=True, verbose_name='Ошибка')
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"Import {self.pk} - {self.status}"
+
+    class Meta:
+        verbose_name = 'Импорт прайс-листа'
+        verbose_name_plural = "Импорты прайс-листов"
+        ordering = ('-id',)
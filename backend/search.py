@@ -0,0 +1,357 @@
+import math
+import re
+from django.db import DatabaseError, connection
+from django.db.models import FloatField, Q, Value
+from django.db.models.expressions import RawSQL
+
+from backend.models import CatalogItem, Product, ProductInfo, Shop
+
+
+"""
+Full-text search index of the catalog over product name, model and shop name.
+SQLite keeps it in an FTS5 virtual table with the porter tokenizer, PostgreSQL in a side table with
+a tsvector column under a GIN index and the russian configuration (russian snowball stemmer for
+cyrillic words, english for latin ones). Rows of the index are keyed by ProductInfo id.
+Полнотекстовый индекс каталога по названию продукта, модели и названию магазина.
+SQLite хранит его в виртуальной таблице FTS5 с токенизатором porter, PostgreSQL - в отдельной таблице
+с колонкой tsvector под GIN индексом и конфигурацией russian (стеммер snowball для кириллицы,
+английский для латиницы). Строки индекса идут по ИД ProductInfo.
+Fuzzy search corrects typos by character trigrams of product names and models. SQLite keeps a vocabulary
+of their words with a (trigram, word) table, query words are replaced by similar words found through it and
+goods are matched by the full-text index; PostgreSQL uses pg_trgm word_similarity under a GIN index.
+Нечеткий поиск исправляет опечатки по символьным триграммам названий продуктов и моделей. SQLite хранит
+словарь их слов с таблицей (триграмма, слово), слова запроса заменяются найденными через нее похожими
+словами, а товары подбираются по полнотекстовому индексу; PostgreSQL использует word_similarity из pg_trgm
+под GIN индексом.
+"""
+
+SEARCH_TABLE = 'backend_productinfo_search'
+SEARCH_CHUNK_SIZE = 500  # Ids per index update query, ИД в одном запросе обновления индекса
+SEARCH_WEIGHTS = (10.0, 5.0, 1.0)  # Name, model, shop for bm25, название, модель, магазин для bm25
+MIN_STEM_LENGTH = 4
+# Russian endings cut from query words on SQLite, porter stems english words only
+# Русские окончания, отсекаемые от слов запроса на SQLite, porter стеммит только английские слова
+RUSSIAN_ENDINGS = sorted((
+    'иями', 'ями', 'ами', 'ого', 'его', 'ому', 'ему', 'ыми', 'ими', 'ая', 'яя', 'ое', 'ее', 'ые', 'ие', 'ый',
+    'ий', 'ой', 'ом', 'ем', 'ам', 'ям', 'ах', 'ях', 'ов', 'ев', 'ей', 'ью', 'ия', 'а', 'я', 'о', 'е', 'ы', 'и',
+    'у', 'ю', 'ь', 'й',
+), key=len, reverse=True)
+WORD_TABLE = 'backend_search_word'
+TRIGRAM_TABLE = 'backend_search_trigram'
+TRIGRAM_INDEX = 'catalog_item_trigram'  # PostgreSQL GIN index of CatalogItem, GIN индекс CatalogItem на PostgreSQL
+FUZZY_THRESHOLD = 0.3  # Minimal similarity, as pg_trgm.similarity_threshold, минимальное сходство
+FUZZY_WORDS = 10  # Similar words per query word, похожих слов на слово запроса
+
+_available = {}
+_fuzzy_available = {}
+
+
+def search_index_available():
+    """
+    Whether the full-text index exists in the current database.
+    Есть ли полнотекстовый индекс в текущей базе данных.
+    """
+    key = connection.settings_dict['NAME']
+    if key not in _available:
+        _available[key] = (connection.vendor in ('sqlite', 'postgresql')
+                           and SEARCH_TABLE in connection.introspection.table_names())
+    return _available[key]
+
+
+def fuzzy_index_available():
+    """
+    Whether the trigram index exists: the word vocabulary on SQLite, the pg_trgm index on PostgreSQL.
+    Есть ли триграммный индекс: словарь слов на SQLite, индекс pg_trgm на PostgreSQL.
+    """
+    key = connection.settings_dict['NAME']
+    if key not in _fuzzy_available:
+        if connection.vendor == 'sqlite':
+            _fuzzy_available[key] = search_index_available() and WORD_TABLE in connection.introspection.table_names()
+        elif connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                _fuzzy_available[key] = TRIGRAM_INDEX in connection.introspection.get_constraints(
+                    cursor, CatalogItem._meta.db_table)
+        else:
+            _fuzzy_available[key] = False
+    return _fuzzy_available[key]
+
+
+def create_search_index(using='default', **kwargs):
+    """
+    post_migrate receiver: create the full-text and trigram indexes when they are missing and fill them
+    from the catalog.
+    Обработчик post_migrate: создает полнотекстовый и триграммный индексы, если их нет, и заполняет
+    их из каталога.
+    """
+    if using != 'default' or connection.vendor not in ('sqlite', 'postgresql'):
+        return
+    _available.pop(connection.settings_dict['NAME'], None)
+    _fuzzy_available.pop(connection.settings_dict['NAME'], None)
+    created = False
+    if not search_index_available():
+        with connection.cursor() as cursor:
+            try:
+                if connection.vendor == 'sqlite':
+                    cursor.execute(
+                        "CREATE VIRTUAL TABLE %s USING fts5(name, model, shop, "
+                        "tokenize='porter unicode61 remove_diacritics 2', prefix='2 3')" % SEARCH_TABLE)
+                else:
+                    cursor.execute('CREATE TABLE %s (product_info_id bigint PRIMARY KEY, document tsvector NOT NULL)'
+                                   % SEARCH_TABLE)
+                    cursor.execute('CREATE INDEX %s_document ON %s USING GIN (document)'
+                                   % (SEARCH_TABLE, SEARCH_TABLE))
+            except DatabaseError:  # SQLite built without FTS5, SQLite собран без FTS5
+                _available[connection.settings_dict['NAME']] = False
+                return
+        _available[connection.settings_dict['NAME']] = created = True
+    if not fuzzy_index_available():
+        created = create_fuzzy_index() or created
+    if created:
+        rebuild_search_index()
+
+
+def create_fuzzy_index():
+    """
+    Create the trigram index, returns whether it was created. On PostgreSQL the pg_trgm extension
+    needs a role allowed to create it, otherwise fuzzy search stays off.
+    Создает триграммный индекс, возвращает, создан ли он. На PostgreSQL для расширения pg_trgm нужна роль
+    с правом его создания, иначе нечеткий поиск остается выключенным.
+    """
+    with connection.cursor() as cursor:
+        try:
+            if connection.vendor == 'sqlite':
+                cursor.execute('CREATE TABLE %s (id INTEGER PRIMARY KEY, word TEXT NOT NULL UNIQUE, '
+                               'trigrams INTEGER NOT NULL)' % WORD_TABLE)
+                cursor.execute('CREATE TABLE %s (trigram TEXT NOT NULL, word_id INTEGER NOT NULL, '
+                               'PRIMARY KEY (trigram, word_id)) WITHOUT ROWID' % TRIGRAM_TABLE)
+            else:
+                cursor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+                cursor.execute("CREATE INDEX %s ON %s USING GIN ((product_name || ' ' || model) gin_trgm_ops)"
+                               % (TRIGRAM_INDEX, CatalogItem._meta.db_table))
+        except DatabaseError:
+            _fuzzy_available[connection.settings_dict['NAME']] = False
+            return False
+    _fuzzy_available[connection.settings_dict['NAME']] = True
+    return True
+
+
+def index_rows_sql(where):
+    """
+    INSERT ... SELECT statement filling index rows of ProductInfo selected by where.
+    Запрос INSERT ... SELECT, заполняющий строки индекса для ProductInfo, выбранных условием where.
+    """
+    tables = {'product_info': ProductInfo._meta.db_table, 'product': Product._meta.db_table,
+              'shop': Shop._meta.db_table, 'search': SEARCH_TABLE, 'where': where}
+    if connection.vendor == 'sqlite':
+        sql = ('INSERT INTO {search} (rowid, name, model, shop) SELECT pi.id, p.name, pi.model, s.name '
+               'FROM {product_info} pi JOIN {product} p ON p.id = pi.product_id JOIN {shop} s ON s.id = pi.shop_id')
+    else:
+        sql = ("INSERT INTO {search} (product_info_id, document) SELECT pi.id, "
+               "setweight(to_tsvector('russian', p.name), 'A') || setweight(to_tsvector('russian', pi.model), 'B') "
+               "|| setweight(to_tsvector('russian', s.name), 'C') "
+               "FROM {product_info} pi JOIN {product} p ON p.id = pi.product_id JOIN {shop} s ON s.id = pi.shop_id")
+    return (sql + ' {where}').format(**tables)
+
+
+def rebuild_search_index():
+    """
+    Refill the whole index from the catalog.
+    Полностью перезаполняет индекс из каталога.
+    """
+    if not search_index_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute('DELETE FROM %s' % SEARCH_TABLE)
+        cursor.execute(index_rows_sql(''))
+    if connection.vendor == 'sqlite' and fuzzy_index_available():
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM %s' % TRIGRAM_TABLE)
+            cursor.execute('DELETE FROM %s' % WORD_TABLE)
+        index_words(Product.objects.values_list('name', flat=True).iterator(chunk_size=10000))
+        index_words(ProductInfo.objects.order_by().values_list('model', flat=True).distinct().iterator(
+            chunk_size=10000))
+
+
+def update_search_index(product_info_ids):
+    """
+    Reindex the given ProductInfo ids: rows of deleted goods are removed, the others are rewritten.
+    Переиндексирует переданные ИД ProductInfo: строки удаленных товаров удаляются, остальные перезаписываются.
+    """
+    if not search_index_available():
+        return
+    key = 'rowid' if connection.vendor == 'sqlite' else 'product_info_id'
+    ids = sorted(set(product_info_ids))
+    with connection.cursor() as cursor:
+        for start in range(0, len(ids), SEARCH_CHUNK_SIZE):
+            chunk = ids[start:start + SEARCH_CHUNK_SIZE]
+            placeholders = ', '.join(['%s'] * len(chunk))
+            cursor.execute('DELETE FROM %s WHERE %s IN (%s)' % (SEARCH_TABLE, key, placeholders), chunk)
+            cursor.execute(index_rows_sql('WHERE pi.id IN (%s)' % placeholders), chunk)
+            # Deleted goods insert no rows and add no words, удаленные товары не вставляют строк и слов
+            if cursor.rowcount and connection.vendor == 'sqlite' and fuzzy_index_available():
+                rows = ProductInfo.objects.filter(id__in=chunk).values_list('product__name', 'model')
+                index_words(text for row in rows for text in row)
+
+
+def trigrams(word):
+    """
+    Character trigrams of a word padded as in pg_trgm: two spaces before, one after.
+    Символьные триграммы слова с дополнением как в pg_trgm: два пробела в начале, один в конце.
+    """
+    padded = '  %s ' % word
+    return {padded[number:number + 3] for number in range(len(padded) - 2)}
+
+
+def index_words(texts):
+    """
+    Add words of the texts missing in the vocabulary together with their trigrams. Words are never removed
+    one by one: a word without goods matches nothing, rebuild_search_index drops them.
+    Добавляет отсутствующие в словаре слова текстов вместе с их триграммами. Слова не удаляются по одному:
+    слово без товаров ничего не находит, rebuild_search_index их удаляет.
+    """
+    words = sorted({word for text in texts for word in search_words(text)})
+    with connection.cursor() as cursor:
+        for start in range(0, len(words), SEARCH_CHUNK_SIZE):
+            chunk = words[start:start + SEARCH_CHUNK_SIZE]
+            placeholders = ', '.join(['%s'] * len(chunk))
+            cursor.execute('SELECT word FROM %s WHERE word IN (%s)' % (WORD_TABLE, placeholders), chunk)
+            known = {row[0] for row in cursor.fetchall()}
+            new = [word for word in chunk if word not in known]
+            if not new:
+                continue
+            cursor.executemany('INSERT INTO %s (word, trigrams) VALUES (%%s, %%s)' % WORD_TABLE,
+                               [(word, len(trigrams(word))) for word in new])
+            cursor.execute('SELECT id, word FROM %s WHERE word IN (%s)' % (WORD_TABLE, ', '.join(['%s'] * len(new))),
+                           new)
+            cursor.executemany('INSERT INTO %s (trigram, word_id) VALUES (%%s, %%s)' % TRIGRAM_TABLE,
+                               [(trigram, pk) for pk, word in cursor.fetchall() for trigram in trigrams(word)])
+
+
+def similar_words(word):
+    """
+    Vocabulary words similar to the word as [(similarity, word)], the most similar first. Candidates are
+    read from the trigram table by the trigrams of the word, a candidate sharing too few of them cannot
+    reach FUZZY_THRESHOLD and is cut in SQL.
+    Слова словаря, похожие на слово, в виде [(сходство, слово)], сначала самые похожие. Кандидаты читаются
+    из таблицы триграмм по триграммам слова, кандидат с малым числом общих триграмм не может достичь
+    FUZZY_THRESHOLD и отсекается в SQL.
+    """
+    grams = sorted(trigrams(word))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT w.word, w.trigrams, COUNT(*) FROM {0} t JOIN {1} w ON w.id = t.word_id '
+            'WHERE t.trigram IN ({2}) GROUP BY w.id HAVING COUNT(*) >= %s'.format(
+                TRIGRAM_TABLE, WORD_TABLE, ', '.join(['%s'] * len(grams))),
+            grams + [math.ceil(FUZZY_THRESHOLD * len(grams))])
+        rows = cursor.fetchall()
+    scored = [(shared / (len(grams) + count - shared), candidate) for candidate, count, shared in rows]
+    return sorted((item for item in scored if item[0] >= FUZZY_THRESHOLD), key=lambda item: (-item[0], item[1]))[
+        :FUZZY_WORDS]
+
+
+def search_words(text):
+    """
+    Lower case words of a search string.
+    Слова строки поиска в нижнем регистре.
+    """
+    return re.findall(r'\w+', text.lower())
+
+
+def russian_stem(word):
+    """
+    Cut one common russian ending, the stem is matched as a prefix: смартфоны -> смартфон*.
+    Отсекает одно частое русское окончание, основа ищется как префикс: смартфоны -> смартфон*.
+    """
+    if not re.search('[а-яё]', word):
+        return word
+    for ending in RUSSIAN_ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= MIN_STEM_LENGTH:
+            return word[:-len(ending)]
+    return word
+
+
+def match_query(words):
+    """
+    Query of the index matching goods which contain every word, words are matched as prefixes.
+    Запрос к индексу, находящий товары со всеми словами, слова ищутся как префиксы.
+    """
+    if connection.vendor == 'sqlite':
+        return ' AND '.join('"%s"*' % russian_stem(word) for word in words)
+    return ' & '.join('%s:*' % word for word in words)
+
+
+def fuzzy_search_products(queryset, words):
+    """
+    Goods whose name or model has a word similar to every query word or starting with it, search_rank is
+    the mean similarity of the best matched words, prefix matches count as FUZZY_THRESHOLD.
+    On PostgreSQL the queryset must be of CatalogItem.
+    Товары, в названии или модели которых есть слово, похожее на каждое слово запроса или начинающееся
+    с него, search_rank - среднее сходство лучших найденных слов, совпадения по префиксу считаются как
+    FUZZY_THRESHOLD. На PostgreSQL queryset должен быть по CatalogItem.
+    """
+    table = connection.ops.quote_name(queryset.model._meta.db_table)
+    if connection.vendor == 'postgresql':
+        document = "({0}.product_name || ' ' || {0}.model)".format(table)
+        text = ' '.join(words)
+        return queryset.filter(id__in=RawSQL(
+            'SELECT id FROM {0} WHERE %s <%% {1}'.format(table, document), [text])).annotate(
+            search_rank=RawSQL('word_similarity(%s, {0})'.format(document), [text], output_field=FloatField()))
+
+    # Similar words by similarity, then the word itself as a prefix, as the ordinary search matches it
+    # Похожие слова по сходству, затем само слово как префикс, как его находит обычный поиск
+    groups = [[('"%s"' % similar, similarity) for similarity, similar in similar_words(word)]
+              + [('"%s"*' % russian_stem(word), FUZZY_THRESHOLD)] for word in words]
+    query = ' AND '.join('{name model} : (%s)' % ' OR '.join(term for term, _ in group) for group in groups)
+    # Every query word adds the similarity of its best matched term, each term is matched once per query
+    # Каждое слово запроса добавляет сходство лучшего найденного терма, каждый терм ищется один раз на запрос
+    cases, params = [], []
+    for group in groups:
+        cases.append('CASE %s ELSE 0 END' % ' '.join(
+            'WHEN {0}.id IN (SELECT rowid FROM {1} WHERE {1} MATCH %s) THEN %s'.format(table, SEARCH_TABLE)
+            for _ in group))
+        for term, similarity in group:
+            params.extend(['{name model} : %s' % term, similarity])
+    rank = '(%s) / %d.0' % (' + '.join(cases), len(groups))
+    matched = 'SELECT rowid FROM {0} WHERE {0} MATCH %s'.format(SEARCH_TABLE)
+    return queryset.filter(id__in=RawSQL(matched, [query])).annotate(
+        search_rank=RawSQL(rank, params, output_field=FloatField()))
+
+
+def search_products(queryset, text, fields=('product__name', 'model', 'shop__name'), fuzzy=False):
+    """
+    Filter a queryset of goods keyed by ProductInfo id (ProductInfo or CatalogItem) by the search string
+    and annotate search_rank, higher is more relevant. Without the index it falls back to icontains over
+    fields (name, model and shop) with zero rank. With fuzzy the trigram index tolerates typos, without
+    that index the ordinary search is used.
+    Фильтрует queryset товаров с ИД ProductInfo (ProductInfo или CatalogItem) по строке поиска и добавляет
+    search_rank, больше - релевантнее. Без индекса используется icontains по полям fields (название, модель
+    и магазин) с нулевым рангом. С fuzzy триграммный индекс допускает опечатки, без этого индекса
+    используется обычный поиск.
+    """
+    words = search_words(text)
+    if not words:  # Nothing to match, нечего искать
+        return queryset.none().annotate(search_rank=Value(0.0, output_field=FloatField()))
+    if fuzzy and fuzzy_index_available():
+        return fuzzy_search_products(queryset, words)
+    if not search_index_available():
+        query = Q()
+        for field in fields:
+            query |= Q(**{field + '__icontains': text})
+        return queryset.filter(query).annotate(search_rank=Value(0.0, output_field=FloatField()))
+
+    query = match_query(words)
+    product_info = connection.ops.quote_name(queryset.model._meta.db_table)
+    if connection.vendor == 'sqlite':
+        matched = 'SELECT rowid FROM {0} WHERE {0} MATCH %s'.format(SEARCH_TABLE)
+        # Scores are materialized once per query, not computed by a MATCH per row
+        # Оценки материализуются один раз на запрос, а не вычисляются отдельным MATCH для каждой строки
+        materialized = 'MATERIALIZED ' if connection.Database.sqlite_version_info >= (3, 35) else ''
+        rank = ('WITH scores AS {3}(SELECT rowid AS id, -bm25({0}, {1}) AS score FROM {0} '
+                'WHERE {0} MATCH %s) SELECT score FROM scores WHERE scores.id = {2}.id').format(
+            SEARCH_TABLE, ', '.join(map(str, SEARCH_WEIGHTS)), product_info, materialized)
+    else:
+        matched = "SELECT product_info_id FROM {0} WHERE document @@ to_tsquery('russian', %s)".format(SEARCH_TABLE)
+        rank = ("SELECT ts_rank(document, to_tsquery('russian', %s)) FROM {0} "
+                "WHERE {0}.product_info_id = {1}.id").format(SEARCH_TABLE, product_info)
+    return queryset.filter(id__in=RawSQL(matched, [query])).annotate(
+        search_rank=RawSQL(rank, [query], output_field=FloatField()))
@@ -2,7 +2,11 @@ from rest_framework import serializers
 from django.contrib.auth.models import User
 from django.contrib.auth.password_validation import validate_password
 from rest_framework.exceptions import ValidationError
-from .models import Product, ProductParameter, ProductInfo, Order, OrderedItem, Contact
+from django.utils import timezone
+from decimal import Decimal, InvalidOperation
+from .importer import check_price_list_url, check_stock_row, read_stock_csv
+from .models import CatalogItem, Product, ProductParameter, ProductInfo, Order, OrderedItem, Contact, ImportJob
+from .tasks import get_import_progress
 
 
 class LoginSerializer(serializers.Serializer):
@@ -79,6 +83,24 @@ class ProductInfoSerializer(serializers.ModelSerializer):
         read_only_fields = ('id',)
 
 
+class CatalogItemSerializer(serializers.ModelSerializer):
+    """
+    Serializer for catalog get from the read model, output is the same as ProductInfoSerializer.
+    Сериалайзер для catalog get из модели чтения, вывод такой же, как у ProductInfoSerializer.
+    """
+    product = serializers.SerializerMethodField()
+    shop = serializers.IntegerField(source='shop_id', read_only=True)
+    product_parameters = serializers.JSONField(source='parameters', read_only=True)
+
+    class Meta:
+        model = CatalogItem
+        fields = ('id', 'model', 'product', 'shop', 'quantity', 'price', 'price_rrc', 'product_parameters',)
+        read_only_fields = ('id',)
+
+    def get_product(self, obj):
+        return {'name': obj.product_name, 'category': obj.category_name}
+
+
 class OrderedItemSerializer(serializers.ModelSerializer):
     """
     Serializer for each ordered_item, provides info about ordered product, include name, shop, price, quantity
@@ -215,4 +237,100 @@ class OrderListSerializer(serializers.ModelSerializer):
 class UserAvatarSerializer(serializers.ModelSerializer):
     class Meta:
         model = User
-        fields = ['avatar']
\ No newline at end of file
+        fields = ['avatar']
+
+
+class PartnerUpdateSerializer(serializers.Serializer):
+    """
+    Serializer for partner price list upload, takes url or file.
+    Сериалайзер загрузки прайс-листа партнера, принимает ссылку или файл.
+    """
+    url = serializers.URLField(required=False)
+    file = serializers.FileField(required=False)
+
+    def validate_url(self, value):
+        # The server fetches the url, only public hosts, сервер скачивает ссылку, только публичные хосты
+        try:
+            check_price_list_url(value)
+        except ValueError as e:
+            raise ValidationError(str(e))
+        return value
+
+    def validate(self, attrs):
+        if not attrs.get('url') and not attrs.get('file'):
+            raise ValidationError("Укажите URL или загрузите файл")
+        return attrs
+
+
+class StockUpdateSerializer(serializers.Serializer):
+    """
+    Serializer for partner stock update: shop name and [external_id, quantity, price] rows or CSV file,
+    price is optional.
+    Сериалайзер обновления остатков партнера: название магазина и строки [внешний ИД, количество, цена]
+    или CSV файл, цена необязательна.
+    """
+    shop = serializers.CharField(max_length=50)
+    items = serializers.ListField(required=False)
+    file = serializers.FileField(required=False)
+
+    def validate_items(self, value):
+        # Plain loop instead of nested fields, 100k rows are validated in a fraction of a second
+        # Простой цикл вместо вложенных полей, 100k строк проверяются за доли секунды
+        rows = []
+        for number, row in enumerate(value, start=1):
+            if not isinstance(row, (list, tuple)) or len(row) not in (2, 3):
+                raise ValidationError("Строка %d: ожидается [external_id, quantity, price]" % number)
+            try:
+                if any(isinstance(item, (bool, float)) for item in row[:2]):
+                    raise TypeError
+                external_id, quantity = int(row[0]), int(row[1])
+                price = Decimal(str(row[2])) if len(row) == 3 and row[2] is not None else None
+            except (TypeError, ValueError, InvalidOperation):
+                raise ValidationError("Строка %d: неверное значение %r" % (number, row))
+            try:
+                check_stock_row(external_id, quantity, price)
+            except ValueError as e:
+                raise ValidationError("Строка %d: %s" % (number, e))
+            rows.append((external_id, quantity, price))
+        return rows
+
+    def validate(self, attrs):
+        if attrs.get('file'):
+            try:
+                attrs['items'] = read_stock_csv(line.decode('utf-8-sig') for line in attrs.pop('file'))
+            except (ValueError, UnicodeDecodeError) as e:
+                raise ValidationError({'file': str(e)})
+        if not attrs.get('items'):
+            raise ValidationError("Укажите items или загрузите CSV файл")
+        return attrs
+
+
+class ImportJobSerializer(serializers.ModelSerializer):
+    """
+    Serializer for price list import status, progress and timing.
+    Сериалайзер статуса импорта прайс-листа, прогресса и времени выполнения.
+    """
+    processed = serializers.SerializerMethodField()
+    elapsed = serializers.SerializerMethodField()
+    items_per_second = serializers.SerializerMethodField()
+
+    class Meta:
+        model = ImportJob
+        fields = ['id', 'status', 'shop', 'total', 'processed', 'elapsed', 'items_per_second', 'result', 'error',
+                  'created_at', 'started_at', 'finished_at']
+
+    def get_processed(self, obj):
+        return get_import_progress(obj)
+
+    def get_elapsed(self, obj):
+        """
+        Seconds since start, till finish for finished jobs.
+        Секунд с начала, для завершенных задач до окончания.
+        """
+        if not obj.started_at:
+            return None
+        return round(((obj.finished_at or timezone.now()) - obj.started_at).total_seconds(), 3)
+
+    def get_items_per_second(self, obj):
+        elapsed = self.get_elapsed(obj)
+        return round(self.get_processed(obj) / elapsed, 1) if elapsed else None
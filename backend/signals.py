@@ -1,6 +1,11 @@
-from django.db.models.signals import post_save
+from django.db.models import QuerySet
+from django.db.models.signals import post_delete, post_save, pre_save
 from django.dispatch import receiver
-from .models import UserProfile, ProductImage
+from .models import (UserProfile, ProductImage, ProductInfo, Product, Shop, Category, Parameter, ProductParameter,
+                     CatalogItem)
+from .catalog import bump_catalog_version
+from .catalog_items import refresh_catalog_items
+from .search import update_search_index
 from .tasks import process_product_image, process_user_avatar
 
 
@@ -21,3 +26,142 @@ def generate_product_thumbnails(sender, instance, **kwargs):
     """
     if instance.image:
         process_product_image.delay(instance.image.name)
+
+
+@receiver(pre_save, sender=ProductInfo)
+def remember_shop(sender, instance, **kwargs):
+    """
+    Remember the stored shop of edited goods, moved goods leave the catalog of the old shop
+    Запоминаем сохраненный магазин изменяемого товара, перенесенный товар уходит из каталога старого магазина
+    """
+    if instance.id:
+        instance._stored_shop_id = ProductInfo.objects.filter(id=instance.id).values_list('shop_id', flat=True).first()
+
+
+@receiver(post_save, sender=ProductInfo)
+@receiver(post_delete, sender=ProductInfo)
+def reindex_product_info(sender, instance, signal, origin=None, **kwargs):
+    """
+    Keep the search index and the read model in sync with edited goods, the importer reindexes its batches itself.
+    Parameters of deleted goods leave the facets too. Only goods deleted by themselves are reindexed here:
+    queryset deletes are reindexed once by the caller (importer, admin), cascades from a shop, category
+    or product by the receiver of the deleted object
+    Синхронизируем поисковый индекс и модель чтения с измененными товарами, импорт переиндексирует свои пакеты сам.
+    Параметры удаленных товаров тоже уходят из фильтров. Здесь переиндексируются только товары, удаленные сами
+    по себе: удаление через queryset переиндексирует один раз вызывающий код (импорт, админка), каскадное
+    удаление магазина, категории или продукта - обработчик удаленного объекта
+    """
+    if origin is not None and origin is not instance:
+        return
+    update_search_index([instance.id])
+    refresh_catalog_items([instance.id])
+    shops = {instance.shop_id, getattr(instance, '_stored_shop_id', None)} - {None}
+    bump_catalog_version(parameters=signal is post_delete, shops=shops)
+
+
+def remove_goods(**filters):
+    """
+    Remove goods deleted by a cascade from the search index and the read model in bulk. CatalogItem has no
+    foreign keys, so its rows still tell which goods were deleted.
+    Удаляем товары, удаленные каскадно, из поискового индекса и модели чтения пакетом. У CatalogItem нет
+    внешних ключей, поэтому его строки еще показывают, какие товары удалены.
+    """
+    ids = list(CatalogItem.objects.filter(**filters).values_list('id', flat=True))
+    update_search_index(ids)
+    refresh_catalog_items(ids)
+
+
+@receiver(post_save, sender=Product)
+def reindex_product(sender, instance, created, **kwargs):
+    """
+    Reindex goods of a renamed product
+    Переиндексируем товары переименованного продукта
+    """
+    bump_catalog_version()
+    if not created:
+        ids = list(ProductInfo.objects.filter(product_id=instance.id).values_list('id', flat=True))
+        update_search_index(ids)
+        refresh_catalog_items(ids)
+
+
+@receiver(post_delete, sender=Product)
+def remove_product(sender, instance, origin=None, **kwargs):
+    """
+    Remove goods of a deleted product at once, products deleted with their category are left to the category
+    Удаляем товары удаленного продукта разом, продукты, удаленные вместе с категорией, остаются категории
+    """
+    origin_model = origin.model if isinstance(origin, QuerySet) else type(origin)
+    if origin_model is Category:
+        return
+    remove_goods(product_id=instance.id)
+    bump_catalog_version(parameters=True)
+
+
+@receiver(post_save, sender=Shop)
+def reindex_shop(sender, instance, created, **kwargs):
+    """
+    Reindex goods of a renamed shop, its state changes the catalog too
+    Переиндексируем товары переименованного магазина, его статус тоже меняет каталог
+    """
+    bump_catalog_version(shops=[instance.id])
+    if not created:
+        ids = list(ProductInfo.objects.filter(shop_id=instance.id).values_list('id', flat=True))
+        update_search_index(ids)
+        refresh_catalog_items(ids)
+
+
+@receiver(post_delete, sender=Shop)
+def remove_shop(sender, instance, **kwargs):
+    """
+    Remove goods of a deleted shop at once
+    Удаляем товары удаленного магазина разом
+    """
+    remove_goods(shop_id=instance.id)
+    bump_catalog_version(parameters=True, shops=[instance.id])
+
+
+@receiver(post_save, sender=ProductParameter)
+@receiver(post_delete, sender=ProductParameter)
+def reset_facets(sender, instance, origin=None, **kwargs):
+    """
+    Rebuild parameter facets and the read model row after characteristics of goods changed.
+    Parameters deleted together with their goods are left to the signal of the goods
+    Перестраиваем фильтры по параметрам и строку модели чтения после изменения характеристик товаров.
+    Параметры, удаляемые вместе с товарами, остаются сигналу товаров
+    """
+    origin_model = origin.model if isinstance(origin, QuerySet) else type(origin)
+    if origin is not None and origin_model is not ProductParameter:
+        return
+    bump_catalog_version(parameters=True)
+    refresh_catalog_items([instance.product_info_id])
+
+
+@receiver(post_save, sender=Parameter)
+def rename_parameter(sender, instance, created, **kwargs):
+    """
+    Parameter names are copied to the read model and used by facets
+    Названия параметров копируются в модель чтения и используются фильтрами
+    """
+    if not created:
+        bump_catalog_version(parameters=True)
+        refresh_catalog_items(ProductParameter.objects.filter(parameter_id=instance.id).values_list('product_info_id', flat=True))
+
+
+@receiver(post_save, sender=Category)
+def reset_catalog(sender, instance, **kwargs):
+    """
+    Category names are part of catalog facets and of the read model
+    Названия категорий входят в фасеты каталога и модель чтения
+    """
+    bump_catalog_version()
+    refresh_catalog_items(ProductInfo.objects.filter(product__category_id=instance.id).values_list('id', flat=True))
+
+
+@receiver(post_delete, sender=Category)
+def remove_category(sender, instance, **kwargs):
+    """
+    Remove goods of a deleted category at once
+    Удаляем товары удаленной категории разом
+    """
+    remove_goods(category_id=instance.id)
+    bump_catalog_version(parameters=True)
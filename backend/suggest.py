@@ -0,0 +1,270 @@
+import re
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import Counter
+from heapq import nsmallest
+from django.core.cache import cache
+from django.db.models import Count
+
+from backend.catalog import new_version, shared_version
+from backend.models import CatalogItem
+
+
+"""
+Typeahead suggestions: a prefix index over product names, models and shop names of open shops, held
+in memory of every process. Every word start of a text is a key, keys are kept sorted, so a prefix is
+a range found with binary search. Texts are ranked by the number of goods that have them.
+The read model publishes changes of text counts after commit, processes apply them to their index
+incrementally; the index is rebuilt only on start, after very large changes or when changes are lost.
+An index is never changed once it is in use: changes produce a new index that replaces the reference,
+so requests read without locks.
+Подсказки при вводе: префиксный индекс по названиям товаров, моделям и названиям открытых магазинов,
+хранится в памяти каждого процесса. Каждое начало слова в тексте - это ключ, ключи хранятся
+отсортированными, поэтому префикс - это диапазон, найденный двоичным поиском. Тексты ранжируются
+по числу товаров с ними. Модель чтения публикует изменения счетчиков текстов после коммита, процессы
+применяют их к своему индексу по шагам; индекс перестраивается только при запуске, после очень больших
+изменений или при потере изменений.
+Используемый индекс никогда не меняется: изменения создают новый индекс, который заменяет ссылку,
+поэтому запросы читают без блокировок.
+"""
+
+SUGGEST_GENERATION_KEY = 'catalog:suggest:generation'  # New value forces a rebuild, новое значение - перестроение
+SUGGEST_SEQUENCE_KEY = 'catalog:suggest:sequence:{}'  # Last published change, последнее изменение
+SUGGEST_CHANGES_KEY = 'catalog:suggest:changes:{}:{}'
+SUGGEST_CHANGES_TIMEOUT = 60 * 60 * 24
+SUGGEST_CHANGES_LIMIT = 10000  # Above this a rebuild is cheaper, выше этого дешевле перестроить
+SUGGEST_LIMIT = 10
+SUGGEST_MAX_LIMIT = 50
+SUGGEST_BUILD_ATTEMPTS = 3  # Builds while changes are published meanwhile, построений, пока публикуются изменения
+SUGGEST_SCAN_LIMIT = 2000  # Wider prefix ranges are memoized, более широкие диапазоны запоминаются
+# Kinds of suggested texts and their CatalogItem fields, виды подсказок и поля CatalogItem
+SUGGEST_FIELDS = (('product', 'product_name'), ('model', 'model'), ('shop', 'shop_name'))
+WORD = re.compile(r'\w+')
+OFFSET_BITS = 8  # Keys pack (entry, word offset), ключи упаковывают (запись, смещение слова)
+OFFSET_MASK = (1 << OFFSET_BITS) - 1
+
+
+def normalize_text(text):
+    """
+    Text as it is indexed and searched: lower case, single spaces.
+    Текст в виде для индекса и поиска: нижний регистр, одиночные пробелы.
+    """
+    return ' '.join(text.lower().split())
+
+
+def text_counts(rows):
+    """
+    Counter of (kind, text) for rows of (product_name, model, shop_name, shop_state), closed shops are skipped.
+    Counter по (вид, текст) для строк (product_name, model, shop_name, shop_state), закрытые магазины пропускаются.
+    """
+    counts = Counter()
+    for product_name, model, shop_name, shop_state in rows:
+        if not shop_state:
+            continue
+        for kind, value in zip(('product', 'model', 'shop'), (product_name, model, shop_name)):
+            if value:
+                counts[(kind, value)] += 1
+    return counts
+
+
+class SuggestIndex:
+    """
+    Prefix index of one process. Entries are (kind, text) with a count of goods; keys are an array of
+    packed (entry, word offset) sorted by the text from the offset. Entries whose count drops to zero
+    stay as holes until the next rebuild.
+    Префиксный индекс одного процесса. Записи - это (вид, текст) с числом товаров; ключи - массив
+    упакованных (запись, смещение слова), отсортированный по тексту от смещения. Записи, чей счетчик
+    упал до нуля, остаются пустыми до следующего перестроения.
+    """
+    def __init__(self, generation=None, sequence=0):
+        self.generation = generation
+        self.sequence = sequence
+        self.entries = []  # (kind, value)
+        self.texts = []  # Normalized values, нормализованные значения
+        self.counts = []
+        self.ids = {}  # (kind, value) -> entry
+        self.keys = array('q')
+        self.memo = {}  # Prefix -> top entries of wide ranges, префикс -> лучшие записи широких диапазонов
+
+    @classmethod
+    def build(cls, generation=None, sequence=0):
+        """
+        Build the index from text counts grouped in the database, one query per kind.
+        Строит индекс по счетчикам текстов, сгруппированным в БД, один запрос на вид.
+        """
+        index = cls(generation, sequence)
+        keys = []
+        for kind, field in SUGGEST_FIELDS:
+            rows = CatalogItem.objects.filter(shop_state=True).exclude(**{field: ''}).order_by().values_list(
+                field).annotate(count=Count('id'))
+            for value, count in rows:
+                keys.extend(index.add_entry(kind, value, count))
+        keys.sort(key=index.key_text)
+        index.keys = array('q', keys)
+        return index
+
+    def key_text(self, key):
+        """
+        Indexed text of a packed key: the entry text from the word offset.
+        Индексируемый текст упакованного ключа: текст записи от смещения слова.
+        """
+        return self.texts[key >> OFFSET_BITS][key & OFFSET_MASK:]
+
+    def add_entry(self, kind, value, count):
+        """
+        Append an entry and return its packed keys, one per word start.
+        Добавляет запись и возвращает ее упакованные ключи, по одному на начало слова.
+        """
+        entry = len(self.entries)
+        text = normalize_text(value)
+        self.entries.append((kind, value))
+        self.texts.append(text)
+        self.counts.append(count)
+        self.ids[(kind, value)] = entry
+        return [entry << OFFSET_BITS | match.start() for match in WORD.finditer(text) if match.start() <= OFFSET_MASK]
+
+    def apply(self, changes):
+        """
+        New index with changes of text counts [(kind, value, delta)] applied, this index is left as it is.
+        Keys of new texts are sorted and merged into the sorted keys in one pass.
+        Новый индекс с примененными изменениями счетчиков текстов [(вид, значение, изменение)], этот индекс
+        не меняется. Ключи новых текстов сортируются и вливаются в отсортированные ключи за один проход.
+        """
+        index = SuggestIndex(self.generation, self.sequence)
+        index.entries, index.texts, index.counts = self.entries[:], self.texts[:], self.counts[:]
+        index.ids = dict(self.ids)
+        added = []
+        for kind, value, delta in changes:
+            entry = index.ids.get((kind, value))
+            if entry is not None:
+                index.counts[entry] = max(index.counts[entry] + delta, 0)
+            elif delta > 0:
+                added.extend(index.add_entry(kind, value, delta))
+        added.sort(key=index.key_text)
+
+        index.keys, start = array('q'), 0
+        for key in added:
+            end = bisect_right(self.keys, index.key_text(key), lo=start, key=index.key_text)
+            index.keys.extend(self.keys[start:end])
+            index.keys.append(key)
+            start = end
+        index.keys.extend(self.keys[start:])
+        return index
+
+    def top(self, prefix, limit):
+        """
+        Entries with a word starting with the prefix, by count descending, then by text.
+        Записи со словом, начинающимся с префикса, по убыванию числа товаров, затем по тексту.
+        """
+        start = bisect_left(self.keys, prefix, key=self.key_text)
+        end = bisect_left(self.keys, prefix + '\uffff', key=self.key_text)
+        if end - start > SUGGEST_SCAN_LIMIT and prefix in self.memo:
+            return self.memo[prefix][:limit]
+
+        entries = {key >> OFFSET_BITS for key in self.keys[start:end]}
+        size = SUGGEST_MAX_LIMIT if end - start > SUGGEST_SCAN_LIMIT else limit
+        top = nsmallest(size, (entry for entry in entries if self.counts[entry]),
+                        key=lambda entry: (-self.counts[entry], self.texts[entry], self.entries[entry][0]))
+        if end - start > SUGGEST_SCAN_LIMIT:
+            self.memo[prefix] = top
+        return top[:limit]
+
+    def suggest(self, prefix, limit=SUGGEST_LIMIT):
+        """
+        Suggestions for a prefix: [{'type', 'value', 'count'}], empty for a prefix without letters or digits.
+        Подсказки для префикса: [{'type', 'value', 'count'}], пустые для префикса без букв и цифр.
+        """
+        prefix = normalize_text(prefix)
+        match = WORD.search(prefix)
+        if not match:
+            return []
+        return [{'type': self.entries[entry][0], 'value': self.entries[entry][1], 'count': self.counts[entry]}
+                for entry in self.top(prefix[match.start():], limit)]
+
+
+_suggest_index = SuggestIndex()
+_suggest_lock = threading.Lock()
+
+
+def rebuild_suggestions():
+    """
+    Make every process rebuild its index on the next request.
+    Заставляет каждый процесс перестроить индекс при следующем запросе.
+    """
+    cache.set(SUGGEST_GENERATION_KEY, new_version(), None)
+
+
+def publish_suggest_changes(changes):
+    """
+    Publish changes of text counts {(kind, value): delta} for the indexes of all processes.
+    Large changes are published as a rebuild.
+    Публикует изменения счетчиков текстов {(вид, значение): изменение} для индексов всех процессов.
+    Большие изменения публикуются как перестроение.
+    """
+    changes = [(kind, value, delta) for (kind, value), delta in changes.items() if delta]
+    if not changes:
+        return
+    if len(changes) > SUGGEST_CHANGES_LIMIT:
+        rebuild_suggestions()
+        return
+    generation = shared_version(SUGGEST_GENERATION_KEY)
+    key = SUGGEST_SEQUENCE_KEY.format(generation)
+    cache.add(key, 0, None)
+    sequence = cache.incr(key)
+    cache.set(SUGGEST_CHANGES_KEY.format(generation, sequence), changes, SUGGEST_CHANGES_TIMEOUT)
+
+
+def build_suggest_index(generation):
+    """
+    Build the index of a generation from the database. A change published while the build reads the database
+    may be counted by the build already, so the build is repeated until the sequence stays the same; the last
+    attempt takes the sequence read after the build.
+    Строит индекс поколения по БД. Изменение, опубликованное, пока построение читает БД, может быть уже учтено
+    построением, поэтому построение повторяется, пока номер изменения не перестанет меняться; последняя
+    попытка берет номер, прочитанный после построения.
+    """
+    key = SUGGEST_SEQUENCE_KEY.format(generation)
+    sequence = cache.get(key, 0)
+    for _ in range(SUGGEST_BUILD_ATTEMPTS):
+        index = SuggestIndex.build(generation, sequence)
+        latest = cache.get(key, 0)
+        if latest == sequence:
+            break
+        sequence = index.sequence = latest
+    return index
+
+
+def get_suggest_index():
+    """
+    Suggest index of this process with all published changes applied. It is rebuilt when the generation
+    has changed or a published change is no longer in cache. While one thread brings the index up to date,
+    the others go on with the current one.
+    Индекс подсказок этого процесса со всеми опубликованными изменениями. Перестраивается, если сменилось
+    поколение или опубликованного изменения уже нет в кэше. Пока один поток обновляет индекс, остальные
+    продолжают работать с текущим.
+    """
+    global _suggest_index
+    generation = shared_version(SUGGEST_GENERATION_KEY)
+    sequence = cache.get(SUGGEST_SEQUENCE_KEY.format(generation), 0)
+    index = _suggest_index
+    if index.generation == generation and index.sequence == sequence:
+        return index
+    # Only a process without an index of the generation waits, ждет только процесс без индекса поколения
+    if not _suggest_lock.acquire(blocking=index.generation != generation):
+        return index
+    try:
+        index = _suggest_index
+        if index.generation == generation and index.sequence < sequence:
+            keys = [SUGGEST_CHANGES_KEY.format(generation, number) for number in range(index.sequence + 1, sequence + 1)]
+            published = cache.get_many(keys)
+            if len(published) == len(keys):
+                index = index.apply([change for key in keys for change in published[key]])
+                index.sequence = sequence
+                _suggest_index = index
+                return index
+        if index.generation != generation or index.sequence != sequence:
+            _suggest_index = build_suggest_index(generation)
+        return _suggest_index
+    finally:
+        _suggest_lock.release()
@@ -1,8 +1,15 @@
 from celery import shared_task
+from django.core.cache import cache
 from django.core.mail import send_mail
+from django.utils import timezone
 from easy_thumbnails.files import generate_all_aliases
 from django.core.files.storage import default_storage
 import os
+from backend.importer import import_file
+from backend.models import ImportJob
+
+IMPORT_PROGRESS_KEY = 'import_job:{}:processed'
+IMPORT_PROGRESS_TIMEOUT = 60 * 60 * 24
 
 
 @shared_task
@@ -39,3 +46,62 @@ def process_user_avatar(image_path):
         generate_all_aliases(image_path, include_global=True)
         return f"Миниатюры созданы для {image_path}"
     return f"Файл {image_path} не найден"
+
+
+def get_import_progress(job):
+    """
+    Processed goods of the job: live counter from cache while running, saved value otherwise.
+    Обработано товаров задачи: счетчик из кэша во время выполнения, иначе сохраненное значение.
+    """
+    if job.status == 'running':
+        return cache.get(IMPORT_PROGRESS_KEY.format(job.id), job.processed)
+    return job.processed
+
+
+@shared_task
+def import_price_list(job_id):
+    """
+    Async import of a partner price list from url or uploaded file, progress goes to cache.
+    Unchanged price lists are skipped, price lists of shops the user does not manage fail.
+    The uploaded file is deleted when the job finishes, the job keeps its result only.
+    Асинхронный импорт прайс-листа партнера по ссылке или из загруженного файла, прогресс пишется в кэш.
+    Неизмененные прайс-листы пропускаются, прайс-листы чужих магазинов завершаются ошибкой.
+    Загруженный файл удаляется по завершении задачи, задача хранит только результат.
+    """
+    job = ImportJob.objects.get(id=job_id)
+    job.status = 'running'
+    job.started_at = timezone.now()
+    job.save(update_fields=['status', 'started_at'])
+
+    progress_key = IMPORT_PROGRESS_KEY.format(job.id)
+
+    def set_total(total):
+        job.total = total
+        job.save(update_fields=['total'])
+
+    try:
+        stats = import_file(
+            job.url or job.file.path,
+            stream=True,
+            progress=lambda stats: cache.set(progress_key, stats.rows, IMPORT_PROGRESS_TIMEOUT),
+            on_total=set_total,
+            user=job.user,
+        )
+        if stats is None:  # Price list did not change, прайс-лист не изменился
+            job.status = 'skipped'
+        else:
+            job.status = 'done'
+            job.shop_id = stats.shop_id
+            job.processed = stats.rows
+            job.result = stats.as_dict()
+    except Exception as e:
+        job.status = 'failed'
+        job.error = str(e)
+    finally:
+        cache.delete(progress_key)
+        if job.file:
+            job.file.delete(save=False)
+
+    job.finished_at = timezone.now()
+    job.save()
+    return f"Импорт {job.id}: {job.status}"
@@ -0,0 +1,823 @@
+import json
+import time
+from unittest import mock, skipIf
+from urllib.parse import parse_qs, urlsplit
+from django.contrib import admin
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.http import QueryDict
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework import status
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APITestCase
+from backend.admin import ProductInfoAdmin
+from backend.importer import import_goods, update_stock
+from backend.models import CatalogItem, Category, Parameter, Product, ProductInfo, ProductParameter, Shop
+from backend.catalog import filter_products, get_facet_index, parse_filters
+from backend.columnar import ColumnarCatalog, get_columnar_catalog, numpy
+from backend.fragments import catalog_item_rows, join_fragments, render_json
+from backend.search import fuzzy_index_available, search_index_available
+from backend.serializers import CatalogItemSerializer, ProductInfoSerializer
+from backend.suggest import SuggestIndex, get_suggest_index, rebuild_suggestions
+from backend.tests.test_import import make_price_list
+from backend.views import ProductInfoPagination
+
+
+class CatalogTestCase(APITestCase):
+    """
+    Base of catalog API tests: empty cache, throttling off and `rows` goods of the test shop imported.
+    Основа тестов API каталога: пустой кэш, ограничение частоты отключено и импортировано `rows` товаров
+    тестового магазина.
+    """
+    url = '/api/v1/products/'
+    rows = 0
+
+    def setUp(self):
+        cache.clear()
+        throttle = mock.patch('rest_framework.throttling.SimpleRateThrottle.allow_request', return_value=True)
+        throttle.start()
+        self.addCleanup(throttle.stop)
+        if self.rows:
+            import_goods(make_price_list(self.rows))
+
+
+class CatalogPaginationTestCase(CatalogTestCase):
+    rows = 25
+
+    def test_cursor_pages(self):
+        """
+        Testing that cursor pages return every item once and the page size is bounded
+        Тестируем, что страницы по курсору возвращают каждый товар один раз, а размер страницы ограничен
+        """
+        ids = []
+        url = self.url + '?page_size=10'
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertLessEqual(len(response.json()['results']), 10)
+            ids.extend(item['id'] for item in response.json()['results'])
+            url = response.json()['next']
+
+        self.assertEqual(len(ids), 25)
+        self.assertEqual(ids, sorted(set(ids)))
+
+        with mock.patch.object(ProductInfoPagination, 'max_page_size', 15):
+            response = self.client.get(self.url + '?page_size=100000')
+        self.assertEqual(len(response.json()['results']), 15)
+
+    def test_ordering(self):
+        """
+        Testing that ordered cursor pages return every item once in order and unknown orderings are rejected
+        Тестируем, что отсортированные страницы по курсору возвращают каждый товар один раз по порядку,
+        а неизвестные сортировки отклоняются
+        """
+        for number, item in enumerate(ProductInfo.objects.order_by('id')):
+            update_stock(item.shop, [(item.external_id, 25 - number, 100 + number % 5)])
+        for ordering, key in (('price', lambda item: (item['price'], item['id'])),
+                              ('-price', lambda item: (-float(item['price']), -item['id'])),
+                              ('name', lambda item: (item['product']['name'], item['id'])),
+                              ('quantity', lambda item: (item['quantity'], item['id']))):
+            items = []
+            url = self.url + '?page_size=7&ordering=' + ordering
+            while url:
+                response = self.client.get(url).json()
+                items.extend(response['results'])
+                url = response['next']
+            self.assertEqual(len({item['id'] for item in items}), 25)
+            self.assertEqual(items, sorted(items, key=key), ordering)
+
+        response = self.client.get(self.url + '?ordering=shop')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_deep_page_uses_keyset(self):
+        """
+        Testing that the next page is selected by id, without OFFSET over previous rows
+        Тестируем, что следующая страница выбирается по ИД, без OFFSET по предыдущим строкам
+        """
+        first = self.client.get(self.url + '?page_size=20')
+
+        with CaptureQueriesContext(connection) as queries:
+            second = self.client.get(first.json()['next'])
+
+        self.assertEqual(len(second.json()['results']), 5)
+        sql = next(query['sql'] for query in queries.captured_queries if 'backend_catalogitem' in query['sql'])
+        self.assertIn('"backend_catalogitem"."id" >', sql)
+        self.assertNotIn('OFFSET', sql)
+
+
+class CatalogSearchTestCase(CatalogTestCase):
+
+    def setUp(self):
+        super().setUp()
+        data = make_price_list(6)
+        names = ['Смартфон Apple iPhone XS', 'Смартфоны Xiaomi Mi 9', 'Running shoes', 'Зубная щетка Oral-B',
+                 'Чехол для iPhone', 'Смартфон Apple iPhone 12 iPhone']
+        for item, name in zip(data['goods'], names):
+            item['name'] = name
+        data['goods'][3]['model'] = 'oral-b/iphone'
+        import_goods(data)
+
+    def search(self, text, **params):
+        response = self.client.get(self.url, {'search': text, **params})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [item['product']['name'] for item in response.json()['results']]
+
+    def test_search_index(self):
+        """
+        Testing full-text search with stemming, prefixes and all words required
+        Тестируем полнотекстовый поиск со стеммингом, префиксами и обязательностью всех слов
+        """
+        self.assertTrue(search_index_available())
+        self.assertEqual(set(self.search('смартфоны')), {'Смартфон Apple iPhone XS', 'Смартфоны Xiaomi Mi 9',
+                                                         'Смартфон Apple iPhone 12 iPhone'})
+        self.assertEqual(self.search('run'), ['Running shoes'])
+        self.assertEqual(self.search('щетки'), ['Зубная щетка Oral-B'])
+        self.assertEqual(set(self.search('apple xs')), {'Смартфон Apple iPhone XS'})
+        self.assertEqual(self.search('model/4'), ['Чехол для iPhone'])
+        # Name matches rank above model matches, совпадения в названии выше совпадений в модели
+        self.assertEqual(self.search('iphone')[-1], 'Зубная щетка Oral-B')
+        # Searches without words find nothing, поиск без слов ничего не находит
+        self.assertEqual(self.search('"'), [])
+        self.assertEqual(self.search('!?', fuzzy=1), [])
+
+    def test_index_follows_edits(self):
+        """
+        Testing that the index is updated on import, product rename and removal
+        Тестируем обновление индекса при импорте, переименовании продукта и удалении
+        """
+        product = Product.objects.get(name='Running shoes')
+        product.name = 'Trail boots'
+        with self.captureOnCommitCallbacks(execute=True):
+            product.save()
+        self.assertEqual(self.search('boots'), ['Trail boots'])
+        self.assertEqual(self.search('running'), [])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            ProductInfo.objects.get(product=product).delete()
+        self.assertEqual(self.search('boots'), [])
+
+        data = make_price_list(1)
+        data['goods'][0]['name'] = 'Наушники Sony'
+        with self.captureOnCommitCallbacks(execute=True):
+            import_goods(data)
+        self.assertEqual(self.search('наушники'), ['Наушники Sony'])
+        self.assertEqual(self.search('смартфон'), [])
+
+    def test_fuzzy_search(self):
+        """
+        Testing that fuzzy search finds names and models with typos, the most similar first
+        Тестируем, что нечеткий поиск находит названия и модели с опечатками, сначала самые похожие
+        """
+        self.assertTrue(fuzzy_index_available())
+        self.assertEqual(self.search('ipone xs'), [])
+        self.assertEqual(self.search('ipone xs', fuzzy=1), ['Смартфон Apple iPhone XS'])
+        self.assertEqual(self.search('xiaomi mi9', fuzzy=1), ['Смартфоны Xiaomi Mi 9'])
+        self.assertEqual(self.search('Aple iphone 12', fuzzy='true')[0], 'Смартфон Apple iPhone 12 iPhone')
+        self.assertEqual(self.search('orall-b', fuzzy=1), ['Зубная щетка Oral-B'])
+        self.assertEqual(self.search('qwerty', fuzzy=1), [])
+
+        data = make_price_list(1)
+        data['goods'][0]['name'] = 'Наушники Sony'
+        import_goods(data)
+        self.assertEqual(self.search('наушнки sonny', fuzzy=1), ['Наушники Sony'])
+
+
+class CatalogFacetTestCase(CatalogTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.data = make_price_list(12)
+        for number, item in enumerate(self.data['goods']):
+            item['parameters'] = {'Цвет': ['черный', 'белый', 'синий'][number % 3],
+                                  'Встроенная память (Гб)': [64, 128, 256, 512][number % 4]}
+        import_goods(self.data)
+
+    def external_ids(self, params):
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return sorted(ProductInfo.objects.filter(id__in=[item['id'] for item in response.json()['results']])
+                      .values_list('external_id', flat=True))
+
+    def test_facets(self):
+        """
+        Testing exact, multi-value and range facets and their intersection
+        Тестируем фильтры по точному значению, нескольким значениям, диапазону и их пересечение
+        """
+        self.assertEqual(self.external_ids({'param[Цвет]': 'черный'}), [1000, 1003, 1006, 1009])
+        self.assertEqual(self.external_ids({'param[Цвет]': ['черный', 'синий']}),
+                         [1000, 1002, 1003, 1005, 1006, 1008, 1009, 1011])
+        self.assertEqual(self.external_ids({'param[Встроенная память (Гб)]': '100..256'}),
+                         [1001, 1002, 1005, 1006, 1009, 1010])
+        self.assertEqual(self.external_ids({'param[Встроенная память (Гб)]': '256..'}),
+                         [1002, 1003, 1006, 1007, 1010, 1011])
+        self.assertEqual(self.external_ids({'param[Цвет]': 'черный', 'param[Встроенная память (Гб)]': '..128'}),
+                         [1000, 1009])
+        self.assertEqual(self.external_ids({'param[Цвет]': 'зеленый'}), [])
+
+        response = self.client.get(self.url, {'param[Встроенная память (Гб)]': 'много..'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_facets_without_joins(self):
+        """
+        Testing that facets add no joins and the subquery fallback gives the same result
+        Тестируем, что фильтры не добавляют соединений, а запасной вариант с подзапросами дает тот же результат
+        """
+        params = {'param[Цвет]': ['черный', 'белый'], 'param[Встроенная память (Гб)]': '128..512'}
+        with CaptureQueriesContext(connection) as queries:
+            expected = self.external_ids(params)
+        sql = next(query['sql'] for query in queries.captured_queries
+                   if query['sql'].startswith('SELECT "backend_catalogitem"."id"'))
+        self.assertNotIn('backend_productparameter', sql)
+
+        with mock.patch('backend.catalog.FACET_IDS_LIMIT', 1):
+            self.assertEqual(self.external_ids(params), expected)
+
+    def test_index_follows_import(self):
+        """
+        Testing that the facet index is rebuilt after import
+        Тестируем перестроение индекса фильтров после импорта
+        """
+        index = get_facet_index()
+        self.assertIs(get_facet_index(), index)
+        self.assertNotIn('красный', index.values['Цвет'])
+
+        # Prices and stock do not rebuild the index, цены и остатки не перестраивают индекс
+        self.data['goods'][0].update(price=777, quantity=70)
+        with self.captureOnCommitCallbacks(execute=True):
+            stats = import_goods(self.data)
+        self.assertEqual(stats.updated, 1)
+        self.assertIs(get_facet_index(), index)
+
+        self.data['goods'][0]['parameters']['Цвет'] = 'красный'
+        with self.captureOnCommitCallbacks(execute=True):
+            import_goods(self.data)
+        self.assertEqual(len(get_facet_index().values['Цвет']['красный']), 1)
+
+
+class CatalogFacetCountsTestCase(CatalogTestCase):
+    url = '/api/v1/products/facets/'
+
+    def setUp(self):
+        super().setUp()
+        data = make_price_list(10)
+        for number, item in enumerate(data['goods']):
+            item['price'] = 100 * (number + 1)
+            item['parameters'] = {'Цвет': ['черный', 'белый'][number % 2]}
+        import_goods(data)
+        import_goods(make_price_list(3, shop='Второй магазин', price=50))
+
+    def test_counts(self):
+        """
+        Testing counts per category, shop and parameter value and the price histogram
+        Тестируем подсчет по категориям, магазинам, значениям параметров и гистограмму цен
+        """
+        response = self.client.get(self.url, {'category_id': 1, 'bins': 3})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['total'], 7)
+        self.assertEqual([(shop['name'], shop['count']) for shop in response.data['shops']],
+                         [('Тестовый магазин', 5), ('Второй магазин', 2)])
+        self.assertEqual(response.data['categories'], [{'id': 1, 'name': 'Смартфоны', 'count': 7}])
+        self.assertEqual(response.data['parameters']['Цвет'], [{'value': 'черный', 'count': 7}])
+        self.assertEqual(response.data['price']['min'], '50.00')
+        self.assertEqual([bin['count'] for bin in response.data['price']['histogram']], [4, 1, 2])
+
+        response = self.client.get(self.url, {'param[Цвет]': 'белый', 'min_price': 'дорого'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_cache_follows_catalog(self):
+        """
+        Testing that equal filter sets share the cache and a catalog change invalidates it
+        Тестируем, что одинаковые наборы фильтров используют общий кэш, а изменение каталога его сбрасывает
+        """
+        first = self.client.get(self.url, {'search': 'товар', 'param[Цвет]': 'белый'}).data
+        with mock.patch('backend.catalog.count_facets') as count_facets:
+            again = self.client.get(self.url, {'param[Цвет]': 'белый', 'search': '  товар '}).data
+        count_facets.assert_not_called()
+        self.assertEqual(again, first)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            update_stock(Shop.objects.get(name='Тестовый магазин'), [(1001, 1, 5000)])
+        changed = self.client.get(self.url, {'search': 'товар', 'param[Цвет]': 'белый'}).data
+        self.assertEqual(changed['price']['max'], '5000.00')
+
+
+class CatalogReadModelTestCase(CatalogTestCase):
+    rows = 8
+
+    def setUp(self):
+        super().setUp()
+        self.shop = Shop.objects.get()
+
+    def assert_in_sync(self):
+        expected = ProductInfoSerializer(ProductInfo.objects.order_by('id'), many=True).data
+        self.assertEqual(json.loads(json.dumps(CatalogItemSerializer(CatalogItem.objects.order_by('id'), many=True).data)),
+                         json.loads(json.dumps(expected)))
+
+    def test_listing_output(self):
+        """
+        Testing that the listing from the read model is the same as ProductInfoSerializer and reads one table
+        Тестируем, что список из модели чтения совпадает с ProductInfoSerializer и читает одну таблицу
+        """
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url)
+        expected = ProductInfoSerializer(ProductInfo.objects.order_by('id'), many=True).data
+        self.assertEqual(json.loads(response.content)['results'], json.loads(json.dumps(expected)))
+        sql = [query['sql'] for query in queries.captured_queries if 'backend_' in query['sql']]
+        self.assertTrue(sql)
+        self.assertTrue(all('backend_catalogitem' in query and 'JOIN' not in query for query in sql))
+
+    def test_rows_follow_changes(self):
+        """
+        Testing that rows follow import, stock updates, edits and removal of goods
+        Тестируем, что строки следуют за импортом, обновлением остатков, правками и удалением товаров
+        """
+        version = CatalogItem.objects.get(id=ProductInfo.objects.get(external_id=1001).id).version
+        update_stock(self.shop, [(1001, 3, 999)])
+        self.assertNotEqual(CatalogItem.objects.get(id=ProductInfo.objects.get(external_id=1001).id).version, version)
+        self.assert_in_sync()
+
+        data = make_price_list(6)
+        data['categories'][0]['name'] = 'Телефоны'
+        data['goods'][2]['parameters']['Цвет'] = 'белый'
+        import_goods(data)
+        self.assertEqual(CatalogItem.objects.count(), 6)
+        self.assert_in_sync()
+
+        self.shop.state = False
+        self.shop.save()
+        ProductParameter.objects.filter(parameter__name='Цвет').first().delete()
+        Parameter.objects.filter(name='Цвет').update(name='Окрас')
+        Parameter.objects.get(name='Окрас').save()
+        self.assertFalse(CatalogItem.objects.filter(shop_state=True).exists())
+        self.assert_in_sync()
+
+        stats = import_goods(make_price_list(6, price=500), dry_run=True)
+        self.assertEqual(stats.updated, 6)
+        self.assert_in_sync()
+
+        with CaptureQueriesContext(connection) as queries:
+            self.shop.delete()
+        self.assertFalse(CatalogItem.objects.exists())
+        # Parameters deleted with their goods do not refresh rows, параметры, удаленные с товарами, не обновляют строки
+        self.assertLess(len(queries.captured_queries), 6 * 8)
+
+    def test_cascade_delete(self):
+        """
+        Testing that goods deleted with their product or category leave the read model
+        Тестируем, что товары, удаленные вместе с продуктом или категорией, уходят из модели чтения
+        """
+        Product.objects.filter(product_info__external_id=1000).get().delete()
+        self.assertEqual(CatalogItem.objects.count(), 7)
+        self.assert_in_sync()
+
+        Category.objects.filter(name='Смартфоны').delete()
+        self.assertEqual(CatalogItem.objects.count(), 4)
+        self.assert_in_sync()
+
+    def test_admin_bulk_delete(self):
+        """
+        Testing that goods deleted with the admin action leave the read model at once
+        Тестируем, что товары, удаленные действием админки, сразу уходят из модели чтения
+        """
+        ProductInfoAdmin(ProductInfo, admin.site).delete_queryset(None, ProductInfo.objects.filter(external_id__lt=1004))
+        self.assertEqual(CatalogItem.objects.count(), 4)
+        self.assert_in_sync()
+
+
+class CatalogFragmentTestCase(CatalogTestCase):
+    rows = 8
+
+    def get(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response
+
+    def test_fragments_reused(self):
+        """
+        Testing that the response equals DRF rendering and only changed rows are serialized again
+        Тестируем, что ответ совпадает с отрисовкой DRF, а заново сериализуются только измененные строки
+        """
+        first = self.get()
+        expected = {'next': None, 'previous': None,
+                    'results': CatalogItemSerializer(CatalogItem.objects.order_by('id'), many=True).data}
+        self.assertEqual(first.content, JSONRenderer().render(expected))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            update_stock(Shop.objects.get(), [(1003, 1, 777)])
+        with mock.patch('backend.fragments.catalog_item_rows', wraps=catalog_item_rows) as rows:
+            second = self.get()
+        rows.assert_called_once_with([ProductInfo.objects.get(external_id=1003).id])
+        self.assertEqual(json.loads(second.content)['results'][3]['price'], '777.00')
+
+        response = self.client.get(self.url, {'format': 'api'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('777.00', response.content.decode())
+
+    def test_fast_path_output(self):
+        """
+        Testing that rows rendered without serializers are byte for byte the same as ProductInfoSerializer
+        Тестируем, что строки, отрисованные без сериализаторов, побайтно совпадают с ProductInfoSerializer
+        """
+        data = make_price_list(3, shop='Юникод \u2028 "магазин"')
+        data['goods'][0].update(name='Чехол "Эко" \u2029 ✓', price=1234.5, price_rrc=99.999)
+        data['goods'][1]['parameters'] = {}
+        import_goods(data)
+        ids = list(ProductInfo.objects.filter(shop__name=data['shop']).order_by('id').values_list('id', flat=True))
+
+        rows = catalog_item_rows(ids)
+        fast = [render_json(rows[pk][1]) for pk in ids]
+        expected = JSONRenderer().render(
+            ProductInfoSerializer(ProductInfo.objects.filter(id__in=ids).order_by('id'), many=True).data)
+        self.assertEqual(join_fragments(fast), expected)
+
+
+class CatalogLookupTestCase(CatalogTestCase):
+    url = '/api/v1/products/lookup/'
+    rows = 8
+
+    def setUp(self):
+        super().setUp()
+        self.ids = list(CatalogItem.objects.order_by('id').values_list('id', flat=True))
+
+    def test_lookup(self):
+        """
+        Testing that items come in the order of the ids with the catalog output and unknown ids are missing
+        Тестируем, что товары приходят в порядке ИД с выводом каталога, а неизвестные ИД попадают в missing
+        """
+        ids = [self.ids[5], self.ids[0], 999999, self.ids[5], self.ids[2]]
+        catalog = {item['id']: item for item in self.client.get('/api/v1/products/').json()['results']}
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(self.url, {'ids': ids}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json(), {'results': [catalog[pk] for pk in (self.ids[5], self.ids[0], self.ids[2])],
+                                           'missing': [999999]})
+        # Fragments are cached by the catalog page, фрагменты закэшированы страницей каталога
+        self.assertEqual(len(queries), 1)
+
+        response = self.client.get(self.url, {'ids': '%d,%d' % (self.ids[1], self.ids[0])})
+        self.assertEqual([item['id'] for item in response.json()['results']], [self.ids[1], self.ids[0]])
+
+        Shop.objects.update(state=False)
+        CatalogItem.objects.update(shop_state=False)
+        response = self.client.get(self.url, {'ids': str(self.ids[0])})
+        self.assertEqual(response.json(), {'results': [], 'missing': [self.ids[0]]})
+
+    def test_invalid_ids(self):
+        """
+        Testing that empty, invalid and too long id lists are rejected
+        Тестируем, что пустые, неверные и слишком длинные списки ИД отклоняются
+        """
+        for data in ({}, {'ids': []}, {'ids': 'abc'}, {'ids': [1, 'x']}, {'ids': [0]}, {'ids': [1.5]},
+                     {'ids': list(range(1, 5002))}):
+            with self.subTest(data=str(data)[:40]):
+                response = self.client.post(self.url, data, format='json')
+                self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        for ids in ('1,a', '99999999999999999999999', str(2 ** 63)):
+            with self.subTest(ids=ids):
+                self.assertEqual(self.client.get(self.url, {'ids': ids}).status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get(self.url, {'ids': str(2 ** 63 - 1)})
+        self.assertEqual(response.json(), {'results': [], 'missing': [2 ** 63 - 1]})
+        response = self.client.post(self.url, {'ids': list(range(1, 5001))}, format='json')
+        self.assertEqual(len(response.json()['results']), len(self.ids))
+
+
+class CatalogConditionalTestCase(CatalogTestCase):
+    rows = 4
+
+    def setUp(self):
+        super().setUp()
+        import_goods(make_price_list(4, shop='Второй магазин'))
+        self.first, self.second = Shop.objects.order_by('id')
+
+    def etag(self, params):
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('Last-Modified', response)
+        return response['ETag']
+
+    def test_not_modified(self):
+        """
+        Testing that a matching If-None-Match is answered with 304 without DB queries
+        Тестируем, что на совпадающий If-None-Match отвечаем 304 без запросов к БД
+        """
+        etag = self.etag({'category_id': 1})
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url, {'category_id': 1}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(len(queries.captured_queries), 0)
+
+        self.assertNotEqual(self.etag({'category_id': 2}), etag)
+        with self.captureOnCommitCallbacks(execute=True):
+            update_stock(self.first, [(1001, 9)])
+        response = self.client.get(self.url, {'category_id': 1}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_shop_versions(self):
+        """
+        Testing that changes of one shop keep ETags of queries for another shop
+        Тестируем, что изменения одного магазина сохраняют ETag запросов по другому магазину
+        """
+        first, second, every = (self.etag({'shop_id': self.first.id}), self.etag({'shop_id': self.second.id}),
+                                self.etag({}))
+        with self.captureOnCommitCallbacks(execute=True):
+            update_stock(self.first, [(1001, 9)])
+
+        self.assertNotEqual(self.etag({'shop_id': self.first.id}), first)
+        self.assertEqual(self.etag({'shop_id': self.second.id}), second)
+        self.assertNotEqual(self.etag({}), every)
+
+        self.second.state = False
+        with self.captureOnCommitCallbacks(execute=True):
+            self.second.save()
+        closed = self.etag({'shop_id': self.second.id})
+        self.assertNotEqual(closed, second)
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.first().save()  # Shared by all shops, общий для всех магазинов
+        self.assertNotEqual(self.etag({'shop_id': self.second.id}), closed)
+
+    def test_moved_goods(self):
+        """
+        Testing that goods moved to another shop change ETags of both shops
+        Тестируем, что перенос товара в другой магазин меняет ETag обоих магазинов
+        """
+        first, second = self.etag({'shop_id': self.first.id}), self.etag({'shop_id': self.second.id})
+        product_info = ProductInfo.objects.get(shop=self.first, external_id=1001)
+        product_info.shop, product_info.external_id = self.second, 2001
+        with self.captureOnCommitCallbacks(execute=True):
+            product_info.save()
+
+        self.assertNotEqual(self.etag({'shop_id': self.first.id}), first)
+        self.assertNotEqual(self.etag({'shop_id': self.second.id}), second)
+        response = self.client.get(self.url, {'shop_id': self.first.id})
+        self.assertNotIn(product_info.id, [item['id'] for item in response.json()['results']])
+
+    def test_versions_published_after_commit(self):
+        """
+        Testing that catalog versions change only after the writing transaction commits
+        Тестируем, что версии каталога меняются только после коммита пишущей транзакции
+        """
+        etag = self.etag({})
+        with self.captureOnCommitCallbacks() as callbacks:
+            update_stock(self.first, [(1001, 9)])
+            Product.objects.first().save()
+            # Requests during the transaction keep the old version, запросы во время транзакции видят старую версию
+            self.assertEqual(self.etag({}), etag)
+        self.assertTrue(callbacks)
+        for callback in callbacks:
+            callback()
+        self.assertNotEqual(self.etag({}), etag)
+
+
+class CatalogResponseCacheTestCase(CatalogTestCase):
+    rows = 4
+
+    def setUp(self):
+        super().setUp()
+        import_goods(make_price_list(4, shop='Второй магазин'))
+        self.first, self.second = Shop.objects.order_by('id')
+
+    def prices(self, params):
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [item['price'] for item in response.json()['results']]
+
+    def test_cache_follows_versions(self):
+        """
+        Testing that responses are cached until a relevant change and stay fresh right after it
+        Тестируем, что ответы кэшируются до значимого изменения и свежие сразу после него
+        """
+        self.prices({'shop_id': self.second.id})
+        with CaptureQueriesContext(connection) as queries:
+            self.prices({'shop_id': self.second.id})
+        self.assertEqual(len(queries.captured_queries), 0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            update_stock(self.first, [(1001, 1, 300)])
+        self.assertIn('300.00', self.prices({'shop_id': self.first.id}))
+        self.assertIn('300.00', self.prices({}))
+        with CaptureQueriesContext(connection) as queries:
+            self.prices({'shop_id': self.second.id})  # Other shop stays cached, другой магазин остается в кэше
+        self.assertEqual(len(queries.captured_queries), 0)
+
+    def test_canonical_keys(self):
+        """
+        Testing that semantically equal queries share one entry and the counters are exposed to staff
+        Тестируем, что одинаковые по смыслу запросы используют одну запись, а счетчики доступны персоналу
+        """
+        params = f'shop_id={self.first.id}&search=Товар&min_price=50'
+        self.client.get(self.url + '?' + params)
+        with CaptureQueriesContext(connection) as queries:
+            for query in (f'search=%20товар%20%20&min_price=50.00&shop_id={self.first.id}',
+                          f'min_price=50.0&shop_id={self.first.id}&search=ТОВАР&utm_source=mail'):
+                response = self.client.get(self.url + '?' + query)
+                self.assertEqual(len(response.json()['results']), 4)
+        self.assertEqual(len(queries.captured_queries), 0)
+
+        url = '/api/v1/products/cache-stats/'
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_401_UNAUTHORIZED)
+        self.client.force_authenticate(User.objects.create_user('staff', password='testpass', is_staff=True))
+        self.assertEqual(self.client.get(url).json()['products'], {'hits': 2, 'misses': 1, 'hit_rate': 0.6667})
+        self.assertEqual(self.client.delete(url).status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(self.client.get(url).json()['products']['hits'], 0)
+
+    def test_links_follow_request(self):
+        """
+        Testing that a cached page gets next links built from the url of each request
+        Тестируем, что закэшированная страница получает ссылки next, построенные по ссылке каждого запроса
+        """
+        queries = (f'shop_id={self.first.id}&page_size=2', f'page_size=2&utm_source=mail&shop_id={self.first.id}')
+        first = self.client.get(self.url + '?' + queries[0]).json()
+        with CaptureQueriesContext(connection) as captured:
+            second = self.client.get(self.url + '?' + queries[1]).json()
+        self.assertEqual(len(captured.captured_queries), 0)
+
+        self.assertEqual(second['results'], first['results'])
+        for query, page in zip(queries, (first, second)):
+            link = urlsplit(page['next'])
+            self.assertEqual(link.path, self.url)
+            self.assertEqual({name: values for name, values in parse_qs(link.query).items() if name != 'cursor'},
+                             parse_qs(query))
+        next_page = self.client.get(second['next']).json()
+        self.assertEqual(len(next_page['results']), 2)
+        self.assertIn('utm_source=mail', next_page['previous'])
+
+
+class CatalogSuggestTestCase(CatalogTestCase):
+    url = '/api/v1/products/suggest/'
+    rows = 12
+
+    def suggest(self, prefix, **params):
+        response = self.client.get(self.url, {'q': prefix, **params})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [(item['type'], item['value'], item['count']) for item in response.json()['results']]
+
+    def test_prefix_suggestions(self):
+        """
+        Testing that names, models and shops are suggested by any word start without database queries
+        Тестируем, что названия, модели и магазины подсказываются по началу любого слова без запросов к БД
+        """
+        self.assertEqual(self.suggest('магаз'), [('shop', 'Тестовый магазин', 12)])
+        self.suggest('товар')
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.suggest('  ТОВАР 1', limit=3),
+                             [('product', 'Товар 1', 1), ('product', 'Товар 10', 1), ('product', 'Товар 11', 1)])
+            self.assertEqual(self.suggest('model/11'), [('model', 'model/11', 1)])
+            self.assertEqual(self.suggest('11'), [('model', 'model/11', 1), ('product', 'Товар 11', 1)])
+            self.assertEqual(self.suggest('/'), [])
+        self.assertEqual(len(queries.captured_queries), 0)
+
+        self.assertEqual(self.client.get(self.url, {'q': 'т', 'limit': 51}).status_code,
+                         status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.get(self.url, {'q': 'т', 'limit': 'x'}).status_code,
+                         status.HTTP_400_BAD_REQUEST)
+
+    def test_incremental_changes(self):
+        """
+        Testing that imports and shop changes reach the index after commit without rebuilding it
+        Тестируем, что импорт и изменения магазина попадают в индекс после коммита без его перестроения
+        """
+        self.suggest('товар')
+        index = get_suggest_index()
+        with mock.patch.object(SuggestIndex, 'build') as build:
+            with self.captureOnCommitCallbacks(execute=True):
+                import_goods(make_price_list(3, shop='Новый магазин'))
+            self.assertEqual(self.suggest('товар 1', limit=2), [('product', 'Товар 1', 2), ('product', 'Товар 10', 1)])
+            self.assertEqual(self.suggest('магазин'), [('shop', 'Тестовый магазин', 12), ('shop', 'Новый магазин', 3)])
+
+            shop = Shop.objects.get(name='Новый магазин')
+            shop.state = False
+            with self.captureOnCommitCallbacks(execute=True):
+                shop.save()
+            self.assertEqual(self.suggest('нов'), [])
+            self.assertEqual(self.suggest('товар 1', limit=1), [('product', 'Товар 1', 1)])
+        build.assert_not_called()
+        # Changes make a new index, the earlier one is left as it was
+        # Изменения создают новый индекс, прежний остается как был
+        self.assertIsNot(get_suggest_index(), index)
+        self.assertEqual([(item['value'], item['count']) for item in index.suggest('товар 1', limit=2)],
+                         [('Товар 1', 1), ('Товар 10', 1)])
+
+    def test_changes_published_during_build(self):
+        """
+        Testing that a change committed and published while the index is built is counted once
+        Тестируем, что изменение, закоммиченное и опубликованное во время построения индекса, учитывается один раз
+        """
+        rebuild_suggestions()
+        build = SuggestIndex.build
+
+        def import_and_build(generation, sequence):
+            if not Shop.objects.filter(name='Новый магазин').exists():
+                with self.captureOnCommitCallbacks(execute=True):
+                    import_goods(make_price_list(3, shop='Новый магазин'))
+            return build(generation, sequence)
+
+        with mock.patch.object(SuggestIndex, 'build', side_effect=import_and_build):
+            self.assertEqual(self.suggest('новый'), [('shop', 'Новый магазин', 3)])
+        self.assertEqual(self.suggest('новый'), [('shop', 'Новый магазин', 3)])
+
+    def test_latency(self):
+        """
+        Testing that the work of a suggest request, getting the current index and looking the prefix up,
+        takes under 5 ms at p99 once the index is warm
+        Тестируем, что работа запроса подсказок, получение текущего индекса и поиск префикса, занимает меньше
+        5 мс на p99 после прогрева индекса
+        """
+        import_goods(make_price_list(5000, shop='Большой магазин'))
+        rebuild_suggestions()
+        prefixes = [('т', 'товар', f'товар {number}', f'model/{number % 50}', 'маг', str(number))[number % 6]
+                    for number in range(300)]
+        for prefix in prefixes:
+            get_suggest_index().suggest(prefix)
+        timings = []
+        for prefix in prefixes:
+            started = time.perf_counter()
+            get_suggest_index().suggest(prefix)
+            timings.append(time.perf_counter() - started)
+        timings.sort()
+        self.assertLess(timings[int(len(timings) * 0.99)], 0.005)
+
+
+@skipIf(numpy is None, 'numpy is not installed')
+class CatalogColumnarTestCase(CatalogTestCase):
+    rows = 20
+
+    def setUp(self):
+        super().setUp()
+        import_goods(make_price_list(10, shop='Второй магазин', price=150))
+        self.shop = Shop.objects.get(name='Тестовый магазин')
+        update_stock(self.shop, [(1000 + number, number % 4, 100 + number % 3 * 25) for number in range(20)])
+
+    def walk(self, params):
+        """
+        Ids of every page following next links, then of every page back following previous links.
+        ИД всех страниц по ссылкам next, затем всех страниц обратно по ссылкам previous.
+        """
+        cache.clear()
+        forward, backward, page = [], [], None
+        url = self.url + '?page_size=4&' + params
+        while url:
+            page = self.client.get(url).json()
+            forward.append([item['id'] for item in page['results']])
+            url = page['next']
+        url = page['previous']
+        while url:
+            page = self.client.get(url).json()
+            backward.append([item['id'] for item in page['results']])
+            url = page['previous']
+        return forward, backward
+
+    def test_pages_match_orm(self):
+        """
+        Testing that the engine returns the same pages as the ORM for filters, orderings and both cursor directions
+        Тестируем, что движок возвращает те же страницы, что и ORM, для фильтров, сортировок и обоих направлений курсора
+        """
+        for filters in ('', f'shop_id={self.shop.id}', 'category_id=%d' % CatalogItem.objects.first().category_id,
+                        'min_price=125&max_price=150', 'in_stock=1', f'in_stock=1&shop_id={self.shop.id}&max_price=125'):
+            for ordering in ('', 'price', '-price', 'quantity'):
+                params = '%s&ordering=%s' % (filters, ordering)
+                with self.subTest(params=params):
+                    expected = self.walk(params)
+                    self.assertTrue(expected[0][0])
+                    with override_settings(CATALOG_COLUMNAR_ENGINE=True), \
+                            mock.patch.object(ColumnarCatalog, 'window', autospec=True,
+                                              side_effect=ColumnarCatalog.window) as window:
+                        self.assertEqual(self.walk(params), expected)
+                    self.assertTrue(window.called)
+
+    def test_fractional_price_bounds(self):
+        """
+        Testing that price bounds with fractions of a cent select the same rows as the ORM
+        Тестируем, что границы цены с долями копейки выбирают те же строки, что и ORM
+        """
+        catalog = ColumnarCatalog.build()
+        for params in ('min_price=100.001', 'max_price=149.999', 'min_price=124.995&max_price=125.004',
+                       'min_price=99.999&max_price=100.009', 'min_price=150.001', 'max_price=99.999'):
+            with self.subTest(params=params):
+                filters = parse_filters(QueryDict(params))
+                expected = list(filter_products(filters).order_by('id').values_list('id', flat=True))
+                self.assertEqual(catalog.window(filters, ('id',), None, 100), expected)
+
+    @override_settings(CATALOG_COLUMNAR_ENGINE=True)
+    def test_reload_and_fallback(self):
+        """
+        Testing that the engine reloads after catalog changes and leaves search and name ordering to the ORM
+        Тестируем, что движок перезагружается после изменений каталога и оставляет поиск и сортировку
+        по названию ORM
+        """
+        self.client.get(self.url + '?ordering=price')
+        version = get_columnar_catalog().version
+        with self.captureOnCommitCallbacks(execute=True):
+            update_stock(self.shop, [(1000, 5, 10)])
+        response = self.client.get(self.url + '?ordering=price&page_size=1')
+        self.assertEqual(response.json()['results'][0]['price'], '10.00')
+        self.assertNotEqual(get_columnar_catalog().version, version)
+
+        with mock.patch.object(ColumnarCatalog, 'window') as window:
+            self.assertEqual(len(self.client.get(self.url + '?search=товар').json()['results']), 30)
+            self.assertEqual(self.client.get(self.url + '?ordering=name&page_size=1').json()['results'][0]['id'],
+                             CatalogItem.objects.order_by('product_name', 'id').first().id)
+            self.client.get(self.url + '?param[Цвет]=черный')
+        window.assert_not_called()
@@ -0,0 +1,474 @@
+import os
+import tempfile
+import tracemalloc
+from concurrent.futures import Future
+from io import StringIO
+from unittest import mock
+import yaml
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import OperationalError, connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from backend.importer import (ImportStats, file_hash, import_file, import_goods, init_import_worker, load_data_from_yaml,
+                              load_snapshot, snapshot_path, stream_data_from_yaml, write_snapshot)
+from backend.management.commands.generate_price_list import write_price_list
+from backend.models import (CatalogItem, Category, Product, ProductInfo, Parameter, ProductParameter, Shop, Order,
+                            OrderedItem)
+from backend.search import SEARCH_TABLE, search_index_available
+from backend.suggest import rebuild_suggestions
+
+
+def make_price_list(count, shop='Тестовый магазин', price=100):
+    """
+    Build price list data in the shop/categories/goods shape.
+    Формирует данные прайс-листа в формате shop/categories/goods.
+    """
+    return {
+        'shop': shop,
+        'categories': [{'id': 1, 'name': 'Смартфоны'}, {'id': 2, 'name': 'Аксессуары'}],
+        'goods': [{
+            'id': 1000 + number,
+            'category': 1 + number % 2,
+            'model': f'model/{number}',
+            'name': f'Товар {number}',
+            'price': price,
+            'price_rrc': price + 10,
+            'quantity': number,
+            'parameters': {'Цвет': 'черный', 'Встроенная память (Гб)': 128},
+        } for number in range(count)],
+    }
+
+
+class ImportGoodsTestCase(TestCase):
+
+    def test_import_creates_rows(self):
+        """
+        Testing that goods, products, parameters and categories are created
+        Тестируем создание товаров, продуктов, параметров и категорий
+        """
+        stats = import_goods(make_price_list(10), batch_size=4)
+
+        self.assertEqual(stats.rows, 10)
+        self.assertEqual(Shop.objects.count(), 1)
+        self.assertEqual(Category.objects.count(), 2)
+        self.assertEqual(Product.objects.count(), 10)
+        self.assertEqual(ProductInfo.objects.count(), 10)
+        self.assertEqual(Parameter.objects.count(), 2)
+        self.assertEqual(ProductParameter.objects.count(), 20)
+        self.assertEqual(Category.objects.get(id=1).shops.count(), 1)
+
+    def test_reimport_updates_and_removes(self):
+        """
+        Testing that repeated import updates prices and removes missing goods
+        Тестируем, что повторный импорт обновляет цены и удаляет отсутствующие товары
+        """
+        import_goods(make_price_list(10))
+        stats = import_goods(make_price_list(6, price=200))
+
+        self.assertEqual((stats.inserted, stats.updated, stats.unchanged, stats.removed), (0, 6, 0, 4))
+        self.assertEqual(ProductInfo.objects.count(), 6)
+        self.assertEqual(set(ProductInfo.objects.values_list('price', flat=True)), {200})
+        self.assertEqual(ProductParameter.objects.count(), 12)
+
+    def test_reimport_keeps_unchanged_rows(self):
+        """
+        Testing that unchanged goods keep their rows, parameters and ordered items
+        Тестируем, что неизмененные товары сохраняют строки, параметры и позиции заказов
+        """
+        import_goods(make_price_list(5))
+        product_info = ProductInfo.objects.get(external_id=1000)
+        parameter_ids = set(ProductParameter.objects.values_list('id', flat=True))
+        user = User.objects.create_user(username='buyer', password='testpass')
+        order = Order.objects.create(user=user, status='basket')
+        OrderedItem.objects.create(order=order, product_info=product_info, shop=product_info.shop, quantity=1)
+
+        data = make_price_list(6)
+        data['goods'][1]['parameters']['Цвет'] = 'белый'
+        stats = import_goods(data)
+
+        self.assertEqual((stats.inserted, stats.updated, stats.unchanged, stats.removed), (1, 1, 4, 0))
+        self.assertEqual(ProductInfo.objects.get(external_id=1000).id, product_info.id)
+        self.assertEqual(OrderedItem.objects.count(), 1)
+        self.assertEqual(ProductParameter.objects.filter(id__in=parameter_ids).count(), 8)
+        self.assertEqual(ProductParameter.objects.get(product_info__external_id=1001, parameter__name='Цвет').value,
+                         'белый')
+
+    def test_query_count_does_not_grow_with_rows(self):
+        """
+        Testing that the number of queries depends on batches, not on goods
+        Тестируем, что число запросов зависит от числа пакетов, а не товаров
+        """
+        small = import_goods(make_price_list(5, shop='Малый'), batch_size=100)
+        large = import_goods(make_price_list(100, shop='Большой'), batch_size=100)
+
+        self.assertLessEqual(large.queries, small.queries)
+
+    def test_memory_does_not_grow_with_rows(self):
+        """
+        Testing that peak memory of a re-import grows only by the ids of goods, not by their rows
+        Тестируем, что пиковая память повторного импорта растет только на ИД товаров, а не на их строки
+        """
+        peaks = []
+        for count in (400, 1600):
+            import_goods(make_price_list(count, shop=f'Магазин {count}'), batch_size=100)
+            data = make_price_list(count, shop=f'Магазин {count}', price=200)
+            with mock.patch('backend.importer.INVALIDATE_OBJECTS_LIMIT', 100), \
+                    mock.patch('backend.catalog_items.SUGGEST_CHANGES_LIMIT', 100):
+                tracemalloc.start()
+                try:
+                    self.assertEqual(import_goods(data, batch_size=100).updated, count)
+                    peaks.append(tracemalloc.get_traced_memory()[1])
+                finally:
+                    tracemalloc.stop()
+
+        # Product id maps stay, about 0.2 KB per product, словари ИД продуктов остаются, около 0,2 КБ на продукт
+        self.assertLess((peaks[1] - peaks[0]) / 1200, 1024)
+
+    def test_large_imports_fall_back_to_whole_models(self):
+        """
+        Testing that suggestions are published once per import, and past the limits models are invalidated
+        and suggestions rebuilt whole
+        Тестируем, что подсказки публикуются один раз за импорт, а после пределов модели инвалидируются
+        и подсказки перестраиваются целиком
+        """
+        with self.captureOnCommitCallbacks() as callbacks:
+            import_goods(make_price_list(30, shop='Первый'), batch_size=10)
+        self.assertEqual(sum(callback.__qualname__.startswith('deferred_refresh.') for callback in callbacks), 1)
+
+        with mock.patch('backend.importer.INVALIDATE_OBJECTS_LIMIT', 10), \
+                mock.patch('backend.catalog_items.SUGGEST_CHANGES_LIMIT', 10), \
+                mock.patch('backend.importer.invalidate_model') as invalidate_model, \
+                mock.patch('backend.importer.invalidate_obj') as invalidate_obj, \
+                self.captureOnCommitCallbacks() as callbacks:
+            import_goods(make_price_list(30, shop='Второй'), batch_size=10)
+        self.assertIn(rebuild_suggestions, callbacks)
+        invalidate_model.assert_called_once_with(ProductInfo)
+        invalidate_obj.assert_not_called()
+
+    def test_removal_queries_do_not_grow_with_rows(self):
+        """
+        Testing that stale goods are removed and reindexed per batch and the catalog version is bumped once
+        Тестируем, что устаревшие товары удаляются и переиндексируются пакетами, а версия каталога меняется один раз
+        """
+        import_goods(make_price_list(5, shop='Малый'))
+        import_goods(make_price_list(300, shop='Большой'))
+
+        small = import_goods(make_price_list(0, shop='Малый'))
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            large = import_goods(make_price_list(0, shop='Большой'))
+
+        self.assertEqual((small.removed, large.removed), (5, 300))
+        self.assertLess(large.queries, small.queries * 2)
+        # One catalog version bump, одно изменение версии каталога
+        self.assertEqual(sum(callback.__qualname__ == 'bump_catalog_version.<locals>.publish'
+                             for callback in callbacks), 1)
+        self.assertFalse(CatalogItem.objects.exists())
+        if search_index_available():
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT COUNT(*) FROM %s' % SEARCH_TABLE)
+                self.assertEqual(cursor.fetchone()[0], 0)
+
+    def test_dimension_queries_do_not_grow_with_batches(self):
+        """
+        Testing that parameters and products are resolved once per import, not once per batch
+        Тестируем, что параметры и продукты разрешаются один раз на импорт, а не на каждый пакет
+        """
+        import_goods(make_price_list(60, shop='Первый'))
+        with CaptureQueriesContext(connection) as queries:
+            stats = import_goods(make_price_list(60, shop='Второй'), batch_size=5)
+
+        dimension_queries = [query['sql'] for query in queries.captured_queries
+                             if 'FROM "backend_parameter"' in query['sql'] or 'FROM "backend_product"' in query['sql']]
+        self.assertEqual(stats.inserted, 60)
+        self.assertEqual(len(dimension_queries), 2)
+
+    def test_shop_delete_queries_do_not_grow_with_rows(self):
+        """
+        Testing that goods of a deleted shop leave the search index and the read model at once
+        Тестируем, что товары удаленного магазина уходят из поискового индекса и модели чтения разом
+        """
+        import_goods(make_price_list(5, shop='Малый'))
+        import_goods(make_price_list(300, shop='Большой'))
+
+        with CaptureQueriesContext(connection) as small:
+            Shop.objects.filter(name='Малый').delete()
+        with CaptureQueriesContext(connection) as large, \
+                self.captureOnCommitCallbacks(execute=True) as callbacks:
+            Shop.objects.filter(name='Большой').delete()
+
+        self.assertLess(len(large.captured_queries), len(small.captured_queries) * 2)
+        self.assertEqual(sum(callback.__qualname__ == 'bump_catalog_version.<locals>.publish'
+                             for callback in callbacks), 1)
+        self.assertFalse(CatalogItem.objects.exists())
+        if search_index_available():
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT COUNT(*) FROM %s' % SEARCH_TABLE)
+                self.assertEqual(cursor.fetchone()[0], 0)
+
+
+class StreamYamlTestCase(TestCase):
+
+    def setUp(self):
+        file = tempfile.NamedTemporaryFile('w', suffix='.yaml', encoding='utf-8', delete=False)
+        with file:
+            yaml.safe_dump(make_price_list(25), file, allow_unicode=True, sort_keys=False)
+        self.file_path = file.name
+
+    def tearDown(self):
+        os.remove(self.file_path)
+
+    def test_stream_matches_full_load(self):
+        """
+        Testing that streamed goods are equal to the fully loaded document
+        Тестируем, что потоково прочитанные товары совпадают с полной загрузкой документа
+        """
+        data = stream_data_from_yaml(self.file_path)
+        self.assertNotIsInstance(data['goods'], list)
+
+        data['goods'] = list(data['goods'])
+        self.assertEqual(data, load_data_from_yaml(self.file_path))
+
+    def test_stream_goods_before_shop(self):
+        """
+        Testing streaming of a file where goods precede shop and categories
+        Тестируем потоковое чтение файла, в котором goods идут раньше shop и categories
+        """
+        with open(self.file_path, 'w', encoding='utf-8') as file:
+            yaml.safe_dump(make_price_list(7), file, allow_unicode=True)  # Sorted keys, ключи по алфавиту
+
+        data = stream_data_from_yaml(self.file_path)
+        data['goods'] = list(data['goods'])
+        self.assertEqual(data, load_data_from_yaml(self.file_path))
+
+    def test_generated_price_list(self):
+        """
+        Testing that the synthetic price list generator writes an importable file
+        Тестируем, что генератор синтетического прайс-листа пишет импортируемый файл
+        """
+        write_price_list(self.file_path, 50, shop='Генератор')
+
+        data = load_data_from_yaml(self.file_path)
+        self.assertEqual(len(data['goods']), 50)
+        self.assertEqual(import_goods(stream_data_from_yaml(self.file_path)).inserted, 50)
+
+    def test_stream_import(self):
+        """
+        Testing import from the streamed file
+        Тестируем импорт из потоково читаемого файла
+        """
+        stats = import_goods(stream_data_from_yaml(self.file_path), batch_size=10)
+
+        self.assertEqual(stats.rows, 25)
+        self.assertEqual(ProductInfo.objects.count(), 25)
+
+
+@override_settings(PRICE_LIST_SNAPSHOT_DIR=None)
+class ImportCommandTestCase(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        for number in range(3):
+            with open(os.path.join(self.directory.name, f'shop{number}.yaml'), 'w', encoding='utf-8') as file:
+                yaml.safe_dump(make_price_list(5, shop=f'Магазин {number}'), file, allow_unicode=True)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_import_directory(self):
+        """
+        Testing import of every file of a directory, shared products and parameters are not duplicated
+        Тестируем импорт всех файлов каталога, общие продукты и параметры не дублируются
+        """
+        output = StringIO()
+        call_command('import_goods', self.directory.name, workers=3, stdout=output)
+
+        self.assertEqual(Shop.objects.count(), 3)
+        self.assertEqual(ProductInfo.objects.count(), 15)
+        self.assertEqual(Product.objects.count(), 5)
+        self.assertEqual(Parameter.objects.count(), 2)
+        if connection.vendor == 'sqlite':
+            # SQLite falls back to one process, SQLite переходит на один процесс
+            self.assertIn('процессов: 1', output.getvalue())
+
+    def test_parallel_import(self):
+        """
+        Testing that workers above one submit every file to the process pool
+        Тестируем, что при нескольких процессах каждый файл передается в пул процессов
+        """
+        def run_now(function, *args, **kwargs):
+            future = Future()
+            future.set_result(function(*args, **kwargs))
+            return future
+
+        output = StringIO()
+        with mock.patch('backend.management.commands.import_goods.ProcessPoolExecutor') as executor, \
+                mock.patch('backend.management.commands.import_goods.connection', vendor='postgresql'), \
+                mock.patch('backend.management.commands.import_goods.connections'):
+            pool = executor.return_value.__enter__.return_value
+            pool.submit.side_effect = run_now
+            call_command('import_goods', self.directory.name, workers=3, stdout=output)
+
+        executor.assert_called_once_with(max_workers=3, initializer=init_import_worker)
+        self.assertEqual(pool.submit.call_count, 3)
+        self.assertIn('процессов: 3', output.getvalue())
+        self.assertEqual(Shop.objects.count(), 3)
+        self.assertEqual(ProductInfo.objects.count(), 15)
+
+
+@override_settings(PRICE_LIST_SNAPSHOT_DIR=None)
+class ImportSkipTestCase(TestCase):
+
+    def setUp(self):
+        file = tempfile.NamedTemporaryFile('wb', suffix='.yaml', delete=False)
+        with file:
+            file.write(yaml.safe_dump(make_price_list(10), allow_unicode=True).encode())
+        self.file_path = file.name
+
+    def tearDown(self):
+        os.remove(self.file_path)
+
+    def test_unchanged_file_is_skipped(self):
+        """
+        Testing that the same file is skipped by content hash unless forced
+        Тестируем, что тот же файл пропускается по хэшу содержимого, если не задан force
+        """
+        self.assertEqual(import_file(self.file_path).inserted, 10)
+        self.assertIsNone(import_file(self.file_path))
+        self.assertEqual(import_file(self.file_path, force=True).unchanged, 10)
+
+    def test_dimensions_created_before_shop_transaction(self):
+        """
+        Testing that shared rows are created before the shop import, which then inserts none of them
+        Тестируем, что общие строки создаются до импорта магазина, который затем не вставляет ни одной из них
+        """
+        captured = []
+
+        def import_and_capture(*args, **kwargs):
+            with CaptureQueriesContext(connection) as queries:
+                stats = import_goods(*args, **kwargs)
+            captured.extend(query['sql'] for query in queries.captured_queries)
+            return stats
+
+        with mock.patch('backend.importer.import_goods', side_effect=import_and_capture):
+            self.assertEqual(import_file(self.file_path).inserted, 10)
+        self.assertEqual((Category.objects.count(), Product.objects.count(), Parameter.objects.count()), (2, 10, 2))
+        shared = {f'"{model._meta.db_table}"' for model in (Category, Product, Parameter)}
+        inserts = [sql.split(' (')[0].split()[-1] for sql in captured if sql.startswith('INSERT')]
+        self.assertFalse(shared.intersection(inserts))
+
+    def test_retry_backoff(self):
+        """
+        Testing that conflicting imports are retried after growing pauses
+        Тестируем, что конфликтующие импорты повторяются после растущих пауз
+        """
+        conflict = OperationalError('deadlock detected')
+        with mock.patch('backend.importer.import_goods', side_effect=[conflict, conflict, ImportStats()]), \
+                mock.patch('backend.importer.time.sleep') as sleep:
+            import_file(self.file_path)
+        first, second = (call.args[0] for call in sleep.call_args_list)
+        self.assertTrue(0.5 <= first <= 1 <= second <= 2)
+
+        with mock.patch('backend.importer.import_goods', side_effect=conflict), \
+                mock.patch('backend.importer.time.sleep') as sleep, self.assertRaises(OperationalError):
+            import_file(self.file_path)
+        self.assertEqual(sleep.call_count, 2)
+
+    def test_unchanged_goods_skip_db(self):
+        """
+        Testing that goods with the stored hash do not reach the batch queries
+        Тестируем, что товары с сохраненным хэшем не доходят до пакетных запросов
+        """
+        import_goods(make_price_list(10))
+        unchanged = import_goods(make_price_list(10))
+        data = make_price_list(10)
+        data['goods'][3]['quantity'] = 100
+        changed = import_goods(data)
+
+        self.assertEqual(unchanged.unchanged, 10)
+        self.assertEqual((changed.updated, changed.unchanged), (1, 9))
+        self.assertLess(unchanged.queries, changed.queries)
+
+    def test_url_conditional_get(self):
+        """
+        Testing that the saved ETag is sent and 304 skips the import
+        Тестируем, что сохраненный ETag отправляется, а ответ 304 пропускает импорт
+        """
+        url = 'https://example.com/shop.yaml'
+        with open(self.file_path, 'rb') as file:
+            content = file.read()
+        response = mock.MagicMock(status_code=200, headers={'ETag': '"v1"'})
+        response.__enter__.return_value = response
+        response.iter_content.return_value = [content]
+
+        with mock.patch('backend.importer.requests.get', return_value=response) as get:
+            self.assertEqual(import_file(url).inserted, 10)
+            response.status_code = 304
+            self.assertIsNone(import_file(url))
+
+        self.assertEqual(get.call_args.kwargs['headers'], {'If-None-Match': '"v1"'})
+
+
+class SnapshotTestCase(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.settings = override_settings(PRICE_LIST_SNAPSHOT_DIR=self.directory.name)
+        self.settings.enable()
+        self.file_path = os.path.join(self.directory.name, 'shop.yaml')
+        with open(self.file_path, 'w', encoding='utf-8') as file:
+            yaml.safe_dump(make_price_list(15), file, allow_unicode=True)
+
+    def tearDown(self):
+        self.settings.disable()
+        self.directory.cleanup()
+
+    def test_snapshot_written_and_reused(self):
+        """
+        Testing that import writes a snapshot equal to the yaml and forced re-import does not parse yaml
+        Тестируем, что импорт пишет снимок, равный yaml, а принудительный повторный импорт не разбирает yaml
+        """
+        stats = import_file(self.file_path, stream=True)
+        self.assertEqual(stats.inserted, 15)
+        self.assertTrue(os.path.exists(snapshot_path(file_hash(self.file_path))))
+
+        data = load_snapshot(file_hash(self.file_path))
+        data['goods'] = list(data['goods'])
+        self.assertEqual(data, load_data_from_yaml(self.file_path))
+
+        with mock.patch('backend.importer.StreamLoader') as loader, \
+                mock.patch('backend.importer.load_data_from_yaml') as load:
+            stats = import_file(self.file_path, force=True)
+        loader.assert_not_called()
+        load.assert_not_called()
+        self.assertEqual(stats.unchanged, 15)
+
+    def test_concurrent_snapshot_writes(self):
+        """
+        Testing that two interleaved writes of the same snapshot in one process do not corrupt it
+        Тестируем, что две чередующиеся записи одного снимка в одном процессе не портят его
+        """
+        data = load_data_from_yaml(self.file_path)
+        content_hash = file_hash(self.file_path)
+        first = write_snapshot(data, content_hash)['goods']
+        second = write_snapshot(data, content_hash)['goods']
+        for _ in data['goods']:
+            next(first)
+            next(second)
+        for goods in (first, second):
+            self.assertEqual(list(goods), [])
+
+        snapshot = load_snapshot(content_hash)
+        self.assertEqual(list(snapshot['goods']), data['goods'])
+        self.assertFalse([name for name in os.listdir(self.directory.name) if name.endswith('.tmp')])
+
+    def test_dry_run(self):
+        """
+        Testing that dry run reports changes and writes nothing
+        Тестируем, что пробный запуск показывает изменения и ничего не записывает
+        """
+        stats = import_file(self.file_path, dry_run=True)
+
+        self.assertEqual(stats.inserted, 15)
+        self.assertEqual(ProductInfo.objects.count(), 0)
+        self.assertFalse(Shop.objects.exists())
@@ -0,0 +1,126 @@
+import os
+import tempfile
+from unittest import mock
+import yaml
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import override_settings
+from rest_framework import status
+from rest_framework.test import APITestCase
+from backend.importer import fetch_price_list
+from backend.models import ImportJob, ProductInfo, Shop
+from backend.tasks import import_price_list
+from backend.tests.test_import import make_price_list
+
+
+class PartnerUpdateTestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.media = tempfile.TemporaryDirectory()
+        self.settings = override_settings(MEDIA_ROOT=self.media.name, PRICE_LIST_SNAPSHOT_DIR=None)
+        self.settings.enable()
+        self.user = User.objects.create_user(username='partner', password='testpass')
+        self.shop = Shop.objects.create(name='Тестовый магазин', user=self.user)
+        self.client.force_authenticate(user=self.user)
+
+    def tearDown(self):
+        self.settings.disable()
+        self.media.cleanup()
+
+    def test_upload_returns_job_and_imports_in_background(self):
+        """
+        Testing that upload returns job id at once and the task reports progress
+        Тестируем, что загрузка сразу возвращает ИД задачи, а задача сообщает прогресс
+        """
+        content = yaml.safe_dump(make_price_list(12), allow_unicode=True).encode()
+        price_list = SimpleUploadedFile('shop.yaml', content)
+
+        with mock.patch('backend.views.import_price_list.delay') as delay:
+            response = self.client.post('/api/v1/partner/update', {'file': price_list}, format='multipart')
+
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        job_id = response.data['job_id']
+        delay.assert_called_once_with(job_id)
+        self.assertEqual(ImportJob.objects.get(id=job_id).status, 'pending')
+
+        import_price_list(job_id)
+
+        response = self.client.get(response.data['status_url'])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['status'], 'done', response.data['error'])
+        self.assertEqual((response.data['processed'], response.data['total']), (12, 12))
+        self.assertEqual(response.data['result']['inserted'], 12)
+        self.assertEqual(ProductInfo.objects.count(), 12)
+        # Uploads are not kept after the job, загрузки не хранятся после задачи
+        self.assertEqual(os.listdir(os.path.join(self.media.name, 'price_lists')), [])
+
+    def test_upload_requires_url_or_file(self):
+        """
+        Testing validation of empty upload
+        Тестируем валидацию пустой загрузки
+        """
+        response = self.client.post('/api/v1/partner/update', {})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_upload_requires_shop_owner(self):
+        """
+        Testing that price lists of other shops are rejected at upload and in the import task
+        Тестируем, что прайс-листы чужих магазинов отклоняются при загрузке и в задаче импорта
+        """
+        other = User.objects.create_user(username='other', password='testpass')
+        Shop.objects.create(name='Чужой магазин', user=other)
+        content = yaml.safe_dump(make_price_list(3, shop='Чужой магазин'), allow_unicode=True).encode()
+
+        response = self.client.post('/api/v1/partner/update', {'file': SimpleUploadedFile('shop.yaml', content)},
+                                    format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.assertFalse(ImportJob.objects.exists())
+
+        # Users without shops cannot upload by url, пользователи без магазинов не загружают по ссылке
+        self.client.force_authenticate(user=User.objects.create_user(username='buyer', password='testpass'))
+        with mock.patch('backend.importer.socket.getaddrinfo', return_value=[(2, 1, 6, '', ('93.184.216.34', 80))]):
+            response = self.client.post('/api/v1/partner/update', {'url': 'http://example.com/price.yaml'})
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+        # A file of another shop behind an owner's job fails, файл чужого магазина в задаче владельца не импортируется
+        job = ImportJob.objects.create(user=self.user, file=SimpleUploadedFile('shop.yaml', content))
+        import_price_list(job.id)
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'failed')
+        self.assertFalse(job.file)
+        self.assertFalse(ProductInfo.objects.exists())
+
+        # A url of another shop is not fetched and its state is kept, ссылка чужого магазина не скачивается,
+        # а его состояние сохраняется
+        url = 'http://example.com/other.yaml'
+        Shop.objects.filter(name='Чужой магазин').update(url=url, price_list_etag='"v1"', price_list_hash='abc')
+        with mock.patch('backend.importer.socket.getaddrinfo', return_value=[(2, 1, 6, '', ('93.184.216.34', 80))]), \
+                mock.patch('backend.importer.requests.get') as get:
+            job = ImportJob.objects.create(user=self.user, url=url)
+            import_price_list(job.id)
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'failed')
+        get.assert_not_called()
+        self.assertEqual(Shop.objects.filter(name='Чужой магазин').values_list(
+            'price_list_etag', 'price_list_hash').get(), ('"v1"', 'abc'))
+
+    def test_private_urls_rejected(self):
+        """
+        Testing that urls of internal hosts and other schemes are not fetched, redirects included
+        Тестируем, что ссылки на внутренние хосты и другие схемы не скачиваются, включая перенаправления
+        """
+        for url in ('http://127.0.0.1/price.yaml', 'http://localhost:8000/price.yaml', 'http://10.0.0.5/price.yaml',
+                    'http://169.254.169.254/latest/meta-data/', 'ftp://example.com/price.yaml'):
+            with self.subTest(url=url), mock.patch('backend.importer.requests.get') as get:
+                response = self.client.post('/api/v1/partner/update', {'url': url})
+                self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+                get.assert_not_called()
+
+        redirect = mock.MagicMock(is_redirect=True, headers={'Location': 'http://127.0.0.1/admin'})
+        with mock.patch('backend.importer.socket.getaddrinfo', side_effect=lambda host, port: [
+                (2, 1, 6, '', ('127.0.0.1' if host == '127.0.0.1' else '93.184.216.34', 80))]), \
+                mock.patch('backend.importer.requests.get', return_value=redirect) as get:
+            with self.assertRaises(ValueError):
+                fetch_price_list('http://example.com/price.yaml', public_only=True)
+        get.assert_called_once()
@@ -0,0 +1,83 @@
+from decimal import Decimal
+from unittest import skipUnless
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from backend.catalog import CATALOG_ORDERINGS, filter_products
+from backend.importer import import_goods
+from backend.models import CatalogItem
+from backend.tests.test_catalog import CatalogTestCase
+from backend.tests.test_import import make_price_list
+
+TABLE = CatalogItem._meta.db_table
+# Supported filter combinations, поддерживаемые сочетания фильтров
+FILTERS = {
+    'none': {},
+    'shop': {'shop_id': 1},
+    'category': {'category_id': 1},
+    'shop+category': {'shop_id': 1, 'category_id': 1},
+    'price': {'min_price': Decimal('100'), 'max_price': Decimal('500')},
+    'min_price': {'min_price': Decimal('100')},
+    'shop+price': {'shop_id': 1, 'min_price': Decimal('100'), 'max_price': Decimal('500')},
+    'category+price': {'category_id': 1, 'max_price': Decimal('500')},
+}
+ORDERINGS = {'id': ('id',), **CATALOG_ORDERINGS}
+# Combinations served in index order, without sorting the matched rows
+# Сочетания, отдаваемые в порядке индекса, без сортировки подходящих строк
+INDEX_ORDERED = {
+    ('none', ordering) for ordering in ORDERINGS
+} | {
+    (filters, ordering) for filters in ('shop', 'category', 'shop+category') for ordering in ('id', 'price', '-price')
+} | {
+    (filters, ordering) for filters in ('price', 'min_price', 'shop+price', 'category+price')
+    for ordering in ('price', '-price')
+}
+
+
+@skipUnless(connection.vendor == 'sqlite', 'Plans are checked in the SQLite EXPLAIN QUERY PLAN format')
+class CatalogQueryPlanTestCase(CatalogTestCase):
+
+    def assert_uses_index(self, plan, sorted_in_index, message):
+        """
+        Check that the catalog table is read through an index and, when expected, not sorted afterwards.
+        Проверяет, что таблица каталога читается по индексу и, если ожидается, не сортируется после.
+        """
+        steps = [line for line in plan.splitlines() if TABLE in line]
+        self.assertTrue(steps, message)
+        for step in steps:
+            self.assertIn('USING', step, '%s: %s' % (message, plan))
+        if sorted_in_index:
+            self.assertNotIn('TEMP B-TREE FOR ORDER BY', plan, '%s: %s' % (message, plan))
+
+    def test_filter_and_order_combinations(self):
+        """
+        Testing that every supported filter and ordering combination is answered from an index
+        Тестируем, что каждое поддерживаемое сочетание фильтров и сортировки отвечает по индексу
+        """
+        for filters_name, filters in FILTERS.items():
+            for ordering_name, ordering in ORDERINGS.items():
+                with self.subTest(filters=filters_name, ordering=ordering_name):
+                    plan = filter_products(filters).order_by(*ordering)[:40].explain()
+                    self.assert_uses_index(plan, (filters_name, ordering_name) in INDEX_ORDERED,
+                                           '%s, %s' % (filters_name, ordering_name))
+
+    def test_cursor_pages(self):
+        """
+        Testing that next pages of the API keep using the index of the ordering
+        Тестируем, что следующие страницы API продолжают использовать индекс сортировки
+        """
+        import_goods(make_price_list(30))
+        shop_id = CatalogItem.objects.values_list('shop_id', flat=True).first()
+        for params in ('ordering=price', 'ordering=-price', f'ordering=price&shop_id={shop_id}', 'ordering=name'):
+            with self.subTest(params=params):
+                first = self.client.get('/api/v1/products/?page_size=10&' + params).json()
+                with CaptureQueriesContext(connection) as queries:
+                    self.client.get(first['next'])
+                selects = [query['sql'] for query in queries.captured_queries
+                           if query['sql'].startswith('SELECT') and TABLE in query['sql']]
+                # Page and fragment rows, no deferred field loads, строки страницы и фрагментов, без догрузки полей
+                self.assertLessEqual(len(selects), 2)
+                selects = [sql for sql in selects if 'ORDER BY' in sql]
+                with connection.cursor() as cursor:
+                    cursor.execute('EXPLAIN QUERY PLAN ' + selects[0])
+                    plan = '\n'.join(row[-1] for row in cursor.fetchall())
+                self.assert_uses_index(plan, True, params)
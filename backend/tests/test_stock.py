@@ -0,0 +1,130 @@
+import os
+import tempfile
+from io import StringIO
+from unittest import mock
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from rest_framework import status
+from rest_framework.test import APITestCase
+from backend.importer import import_goods, update_stock
+from backend.models import ProductInfo, ProductParameter, Shop
+from backend.tests.test_import import make_price_list
+
+
+class StockUpdateTestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        import_goods(make_price_list(10))
+        self.shop = Shop.objects.get()
+        self.user = User.objects.create_user(username='partner', password='testpass')
+        Shop.objects.filter(id=self.shop.id).update(user=self.user)
+        self.client.force_authenticate(user=self.user)
+
+    def test_update_changes_only_stock(self):
+        """
+        Testing that only changed rows are written and products and parameters stay untouched
+        Тестируем, что записываются только измененные строки, а продукты и параметры не затрагиваются
+        """
+        parameter_ids = set(ProductParameter.objects.values_list('id', flat=True))
+
+        stats = update_stock(self.shop, [(1000, 50), (1001, 1, 150), (1002, 7), (1003, 3), (999, 5)])
+
+        self.assertEqual((stats.updated, stats.unchanged, stats.missing), (3, 1, 1))
+        self.assertEqual(ProductInfo.objects.get(external_id=1000).quantity, 50)
+        self.assertEqual(ProductInfo.objects.get(external_id=1001).price, 150)
+        self.assertEqual(set(ProductParameter.objects.values_list('id', flat=True)), parameter_ids)
+
+        # The next price list import restores stock, следующий импорт прайс-листа восстанавливает остатки
+        stats = import_goods(make_price_list(10))
+        self.assertEqual((stats.updated, stats.unchanged), (3, 7))
+        self.assertEqual(ProductInfo.objects.get(external_id=1000).quantity, 0)
+        self.assertEqual(ProductInfo.objects.get(external_id=1001).price, 100)
+
+    def test_api_items_and_csv(self):
+        """
+        Testing stock update through API with rows and with CSV file
+        Тестируем обновление остатков через API строками и CSV файлом
+        """
+        response = self.client.post('/api/v1/partner/stock', {'shop': self.shop.name, 'items': [[1003, 30]]},
+                                    format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['updated'], 1)
+
+        csv_file = SimpleUploadedFile('stock.csv', b'external_id,quantity,price\n1004,40,99.90\n')
+        response = self.client.post('/api/v1/partner/stock', {'shop': self.shop.name, 'file': csv_file},
+                                    format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(ProductInfo.objects.get(external_id=1003).quantity, 30)
+        self.assertEqual(str(ProductInfo.objects.get(external_id=1004).price), '99.90')
+
+        response = self.client.post('/api/v1/partner/stock', {'shop': self.shop.name, 'items': [[1003, -1]]},
+                                    format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_invalid_values(self):
+        """
+        Testing that values outside the ProductInfo columns are rejected with the row number, not written or rounded
+        Тестируем, что значения вне колонок ProductInfo отклоняются с номером строки, а не записываются и не округляются
+        """
+        throttle = mock.patch('rest_framework.throttling.SimpleRateThrottle.allow_request', return_value=True)
+        throttle.start()
+        self.addCleanup(throttle.stop)
+        rows = {
+            'nan': [1003, 1, 'NaN'], 'infinity': [1003, 1, 'Infinity'], 'huge price': [1003, 1, '1e30'],
+            'digits': [1003, 1, '10000000000'], 'cents': [1003, 1, '0.001'],
+            'huge quantity': [1003, 99999999999999999999, 1], 'huge id': [99999999999999999999, 1],
+            'fractional quantity': [1003, 1.5],
+        }
+        for name, row in rows.items():
+            with self.subTest(row=name):
+                response = self.client.post('/api/v1/partner/stock', {'shop': self.shop.name, 'items': [[1004, 1], row]},
+                                            format='json')
+                self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+                self.assertIn('Строка 2', str(response.data))
+                if name != 'fractional quantity':
+                    csv_file = SimpleUploadedFile('stock.csv', ('1004,1\n%s\n' % ','.join(map(str, row))).encode())
+                    response = self.client.post('/api/v1/partner/stock', {'shop': self.shop.name, 'file': csv_file},
+                                                format='multipart')
+                    self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+                    self.assertIn('Строка 2', str(response.data))
+        self.assertEqual(ProductInfo.objects.get(external_id=1003).quantity, 3)
+
+        response = self.client.post('/api/v1/partner/stock', {'shop': self.shop.name, 'items': [[1003, 1, '1.500']]},
+                                    format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(str(ProductInfo.objects.get(external_id=1003).price), '1.50')
+
+    def test_api_requires_shop_owner(self):
+        """
+        Testing that users who do not own the shop cannot change its stock, staff can
+        Тестируем, что пользователи, не владеющие магазином, не могут менять его остатки, а персонал может
+        """
+        self.client.force_authenticate(user=User.objects.create_user(username='other', password='testpass'))
+        response = self.client.post('/api/v1/partner/stock', {'shop': self.shop.name, 'items': [[1003, 30, 1]]},
+                                    format='json')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.assertEqual(ProductInfo.objects.get(external_id=1003).quantity, 3)
+
+        self.client.force_authenticate(user=User.objects.create_user(username='staff', password='testpass',
+                                                                     is_staff=True))
+        response = self.client.post('/api/v1/partner/stock', {'shop': self.shop.name, 'items': [[1003, 30]]},
+                                    format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(ProductInfo.objects.get(external_id=1003).quantity, 30)
+
+    def test_command(self):
+        """
+        Testing update_stock management command
+        Тестируем команду update_stock
+        """
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as file:
+            file.write('1005,55\n1006,66,120\n')
+        try:
+            call_command('update_stock', self.shop.name, file.name, stdout=StringIO())
+        finally:
+            os.remove(file.name)
+
+        self.assertEqual(ProductInfo.objects.get(external_id=1005).quantity, 55)
+        self.assertEqual(ProductInfo.objects.get(external_id=1006).price, 120)
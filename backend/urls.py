@@ -1,7 +1,9 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from backend.views import (LoginView, RegisterAccountView, ConfirmEmailView, ProductInfoView, BasketViewSet,
-                           ContactViewSet, OrderViewSet, UserProfileViewSet, ProductImageViewSet, SentryTestView)
+                           ContactViewSet, OrderViewSet, UserProfileViewSet, ProductImageViewSet, SentryTestView,
+                           PartnerUpdateView, PartnerUpdateStatusView, PartnerStockView, ProductFacetsView,
+                           ProductCacheStatsView, ProductSuggestView, ProductLookupView)
 
 
 app_name = 'backend'
@@ -21,6 +23,13 @@ urlpatterns = [
     path('user/register', RegisterAccountView.as_view(), name='user-register'),
     path('confirm-email/<int:user_id>/', ConfirmEmailView.as_view(), name='confirm-email'),
     path('products/', ProductInfoView.as_view(), name='product-list'),
+    path('products/facets/', ProductFacetsView.as_view(), name='product-facets'),
+    path('products/suggest/', ProductSuggestView.as_view(), name='product-suggest'),
+    path('products/lookup/', ProductLookupView.as_view(), name='product-lookup'),
+    path('products/cache-stats/', ProductCacheStatsView.as_view(), name='product-cache-stats'),
+    path('partner/update', PartnerUpdateView.as_view(), name='partner-update'),
+    path('partner/update/<int:job_id>', PartnerUpdateStatusView.as_view(), name='partner-update-status'),
+    path('partner/stock', PartnerStockView.as_view(), name='partner-stock'),
     path('', include(router.urls)), # Add route for viewset, добавляем роуты для viewset
     path("sentry-test/", SentryTestView.as_view(), name="sentry-test"),
     ]
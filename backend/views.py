@@ -1,15 +1,22 @@
+import json
 import requests
+from urllib.parse import parse_qs, urlsplit
 import sentry_sdk
+import yaml
+from django.core.cache import cache
+from django.core.exceptions import PermissionDenied as DjangoPermissionDenied
 from django.core.files.base import ContentFile
+from django.http import HttpResponse
 from django.utils.decorators import method_decorator
 from django.views.decorators.cache import cache_page
+from django.views.decorators.http import condition
 from rest_framework.authentication import TokenAuthentication
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.request import Request
 from rest_framework import status, viewsets
-from django.db.models import Q, F, Sum
-from rest_framework.permissions import IsAuthenticated
+from django.db.models import F, Sum
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
 from django.core.mail import send_mail
 from django.conf import settings
 from rest_framework.decorators import action
@@ -19,13 +26,24 @@ from django.contrib.auth import authenticate
 from django.contrib.auth.models import User
 from rest_framework.authtoken.models import Token
 from rest_framework.viewsets import ViewSet
-from .tasks import send_order_confirmation_email, process_user_avatar, process_product_image
+from .tasks import send_order_confirmation_email, process_user_avatar, process_product_image, import_price_list
 
-from backend.serializers import (LoginSerializer, RegisterAccountSerializer, ProductInfoSerializer,
+from backend.serializers import (LoginSerializer, RegisterAccountSerializer, CatalogItemSerializer,
                                  OrderSerializer, OrderConfirmSerializer, OrderListSerializer, ContactSerializer,
+                                 PartnerUpdateSerializer, ImportJobSerializer, StockUpdateSerializer,
                                  )
-from backend.models import ProductInfo, Order, OrderedItem, Contact, UserProfile, ProductImage
-from rest_framework.throttling import UserRateThrottle, AnonRateThrottle
+from backend.models import (ProductInfo, Order, OrderedItem, Contact, UserProfile, ProductImage, ImportJob, Shop,
+                            CatalogItem)
+from backend.importer import check_shop_access, read_shop_name, update_stock
+from backend.catalog import (CATALOG_RESPONSE_KEY, CATALOG_RESPONSE_TIMEOUT, PRICE_BINS, cache_stats, cached_facets,
+                             catalog_etag, catalog_last_modified, count_cache_lookup, filter_products, parse_filters,
+                             parse_ids, parse_ordering, reset_cache_stats)
+from backend.columnar import columnar_window
+from backend.fragments import join_fragments, render_fragments
+from backend.suggest import SUGGEST_LIMIT, SUGGEST_MAX_LIMIT, get_suggest_index
+from rest_framework.throttling import UserRateThrottle, AnonRateThrottle, ScopedRateThrottle
+from rest_framework.pagination import CursorPagination
+from rest_framework.utils.urls import replace_query_param
 
 
 class LoginView(APIView):
@@ -117,7 +135,92 @@ class ConfirmEmailView(APIView):
         return Response({"message": "Email confirmed successfully."}, status=status.HTTP_200_OK)
 
 
-@method_decorator(cache_page(60 * 5), name="dispatch")
+class ProductInfoPagination(CursorPagination):
+    """
+    Keyset pagination of the catalog: pages continue after the id of the previous page, so a deep page
+    costs as much as the first one. Cursors are opaque, page size is bounded by max_page_size.
+    Постраничный вывод каталога по ключу: страница продолжается после ИД предыдущей, поэтому дальняя
+    страница стоит столько же, сколько первая. Курсоры непрозрачны, размер страницы ограничен max_page_size.
+    """
+    ordering = 'id'
+    page_size = 40
+    page_size_query_param = 'page_size'
+    max_page_size = 200
+
+    def get_fragment_page(self, fragments):
+        """
+        Page of pre-rendered fragments of the rows with cursors of the next and previous pages. It does not
+        depend on the request url, so it is shared by semantically equal requests; links are built by
+        fragment_response.
+        Страница из заранее отрисованных фрагментов строк с курсорами следующей и предыдущей страниц. Она не
+        зависит от ссылки запроса, поэтому общая для одинаковых по смыслу запросов; ссылки строит
+        fragment_response.
+        """
+        return {'next': self.link_cursor(self.get_next_link()), 'previous': self.link_cursor(self.get_previous_link()),
+                'results': join_fragments(fragments)}
+
+    def link_cursor(self, link):
+        """
+        Cursor of a page link, None without link.
+        Курсор ссылки на страницу, None без ссылки.
+        """
+        if link is None:
+            return None
+        return parse_qs(urlsplit(link).query)[self.cursor_query_param][0]
+
+    @classmethod
+    def fragment_response(cls, request, page):
+        """
+        Paginated JSON response of a fragment page, next and previous links keep the url of the request.
+        Постраничный JSON ответ из страницы фрагментов, ссылки next и previous сохраняют ссылку запроса.
+        """
+        url = request.build_absolute_uri()
+        next_link, previous_link = (None if cursor is None else replace_query_param(url, cls.cursor_query_param, cursor)
+                                    for cursor in (page['next'], page['previous']))
+        content = b'{"next":%s,"previous":%s,"results":%s}' % (
+            json.dumps(next_link).encode(), json.dumps(previous_link).encode(), page['results'])
+        return HttpResponse(content, content_type='application/json')
+
+
+CATALOG_REQUEST_PARAMETERS = ('cursor', 'page_size', 'ordering', 'bins', 'format')  # Besides filters, кроме фильтров
+
+
+def catalog_request_filters(request):
+    """
+    Filters of a catalog request for conditional GET, None when they are invalid.
+    Фильтры запроса каталога для условного GET, None, если они неверны.
+    """
+    try:
+        return parse_filters(request.GET)
+    except ValueError:
+        return None
+
+
+def product_etag(request, *args, **kwargs):
+    """
+    ETag of a catalog response from the catalog versions and the canonical form of the request, computed
+    without DB queries. Parameters other than filters and CATALOG_REQUEST_PARAMETERS do not change it.
+    ETag ответа каталога по версиям каталога и канонической форме запроса, вычисляется без запросов к БД.
+    Параметры, кроме фильтров и CATALOG_REQUEST_PARAMETERS, на него не влияют.
+    """
+    filters = catalog_request_filters(request)
+    if filters is None:
+        return None
+    parameters = {name: request.GET[name].strip() for name in CATALOG_REQUEST_PARAMETERS if request.GET.get(name)}
+    # Host is a part of next and previous links, хост входит в ссылки next и previous
+    return catalog_etag(filters, request.get_host(), request.path, parameters, request.headers.get('Accept', ''))
+
+
+def product_last_modified(request, *args, **kwargs):
+    """
+    Last-Modified of a catalog response from the catalog versions.
+    Last-Modified ответа каталога по версиям каталога.
+    """
+    filters = catalog_request_filters(request)
+    return None if filters is None else catalog_last_modified(filters)
+
+
+@method_decorator(condition(etag_func=product_etag, last_modified_func=product_last_modified), name="dispatch")
 class ProductInfoView(APIView):
     """
     A class for searching products view, based on the specified filters with get parameters
@@ -126,45 +229,173 @@ class ProductInfoView(APIView):
     - get: Retrieve the product information based on the specified filters.
     Получение информации о продукте, возможно использование фильтров
     Parameters examples(примеры параметров): ?shop_id=1 ?category_id=2 ?search=Smartphone ?min_price=500&max_price=1000
+    Characteristics(характеристики): ?param[Цвет]=черный&param[Цвет]=белый ?param[Встроенная память (Гб)]=128..512
+    Pages(страницы): ?page_size=100, next and previous links hold the cursor, ссылки next и previous содержат курсор
+    Ordering(сортировка): ?ordering=price|-price|name|quantity, by id by default, по умолчанию по ИД
+    In stock(в наличии): ?in_stock=1
+    Responses carry ETag and Last-Modified of the catalog version, If-None-Match is answered with 304 before
+    any DB query. JSON pages are cached by the ETag, so they live until the catalog they depend on changes;
+    links to pages are built from the url of each request.
+    Ответы содержат ETag и Last-Modified версии каталога, на If-None-Match отвечаем 304 до запросов к БД.
+    JSON страницы кэшируются по ETag, поэтому живут до изменения каталога, от которого зависят; ссылки на
+    страницы строятся по ссылке каждого запроса.
     """
     throttle_classes = [UserRateThrottle, AnonRateThrottle]
+    pagination_class = ProductInfoPagination
 
     def get(self, request: Request, *args, **kwargs):
-        query = Q(shop__state=True)
+        try:
+            filters = parse_filters(request.query_params)
+            ordering = parse_ordering(request.query_params.get('ordering'))
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        if request.accepted_renderer.format != 'json':
+            return self.get_page(request, filters, ordering)
+
+        # Semantically equal queries share the entry, одинаковые по смыслу запросы используют общую запись
+        key = CATALOG_RESPONSE_KEY.format(product_etag(request))
+        page = cache.get(key)
+        count_cache_lookup('products', page is not None)
+        if page is None:
+            page = self.get_page(request, filters, ordering)
+            cache.set(key, page, CATALOG_RESPONSE_TIMEOUT)
+        return self.pagination_class.fragment_response(request, page)
+
+    def get_page(self, request, filters, ordering=None):
+        """
+        Page of the catalog for parsed filters and ordering: the fragment page for JSON, the response otherwise.
+        Страница каталога для разобранных фильтров и сортировки: страница фрагментов для JSON, иначе ответ.
+        """
+        paginator = self.pagination_class()
+        if ordering:
+            # Partial indexes over open shops, частичные индексы по открытым магазинам
+            paginator.ordering = ordering
+        elif 'search' in filters:
+            # Full-text index, most relevant first, полнотекстовый индекс, сначала самые релевантные
+            paginator.ordering = ('-search_rank', 'id')
+
+        # Columnar engine selects the page rows in memory, the ORM reads only them
+        # Колоночный движок выбирает строки страницы в памяти, ORM читает только их
+        window = columnar_window(filters, paginator.get_ordering(request, None, self), paginator.decode_cursor(request),
+                                 paginator.get_page_size(request))
+        if window is None:
+            # Flat read model, one table without joins, плоская модель чтения, одна таблица без соединений
+            queryset = filter_products(filters)
+        else:
+            queryset = CatalogItem.objects.filter(id__in=window)
+        if request.accepted_renderer.format == 'json':
+            # Rows are read as id, version and the ordering field of the cursor, the JSON comes from fragment cache
+            # Строки читаются как ИД, версия и поле сортировки для курсора, JSON берется из кэша фрагментов
+            queryset = queryset.only('id', 'version', *(field.lstrip('-') for field in ordering or ()))
 
-        shop_id = request.query_params.get('shop_id')
-        category_id = request.query_params.get('category_id')
-        min_price = request.query_params.get('min_price')
-        max_price = request.query_params.get('max_price')
-        search = request.query_params.get('search')
+        page = paginator.paginate_queryset(queryset, request, view=self)
+        if request.accepted_renderer.format == 'json':
+            return paginator.get_fragment_page(render_fragments(page))
+        serializer = CatalogItemSerializer(page, many=True)
+        return paginator.get_paginated_response(serializer.data)
 
-        if shop_id:
-            query &= Q(shop_id=shop_id)
 
-        if category_id:
-            query &= Q(product__category_id=category_id)
+@method_decorator(condition(etag_func=product_etag, last_modified_func=product_last_modified), name="dispatch")
+class ProductFacetsView(APIView):
+    """
+    Class for catalog sidebar: for the filters of the catalog request returns counts per category, shop
+    and top parameter values plus a price histogram. Results are cached per filter set until the catalog
+    changes.
+    Класс для боковой панели каталога: для фильтров запроса каталога возвращает количество товаров по
+    категориям, магазинам и самым частым значениям параметров, а также гистограмму цен. Результаты
+    кэшируются по набору фильтров до изменения каталога.
+    Parameters(параметры): те же фильтры, что у products/, ?bins=10 - интервалов гистограммы цен
+    """
+    throttle_classes = [UserRateThrottle, AnonRateThrottle]
 
-        if min_price:
-            query &= Q(price__gte=min_price)
+    def get(self, request: Request, *args, **kwargs):
+        try:
+            filters = parse_filters(request.query_params)
+            bins = int(request.query_params.get('bins', PRICE_BINS))
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        if not 1 <= bins <= 100:
+            return Response({"error": "bins должно быть от 1 до 100"}, status=status.HTTP_400_BAD_REQUEST)
 
-        if max_price:
-            query &= Q(price__lte=max_price)
+        return Response(cached_facets(filters, bins))
 
-        if search:
-            query &= Q(
-                Q(product__name__icontains=search) |
-                Q(model__icontains=search) |
-                Q(shop__name__icontains=search)
-            )
 
-        queryset = ProductInfo.objects.filter(query).select_related(
-            'shop', 'product__category'
-        ).prefetch_related(
-            'product_parameters__parameter'
-        ).distinct()
+class ProductSuggestView(APIView):
+    """
+    Class for typeahead: product names, models and shop names with a word starting with the prefix,
+    the most frequent first. Answered from the in-memory prefix index, without database queries.
+    Класс для подсказок при вводе: названия товаров, модели и названия магазинов со словом, начинающимся
+    с префикса, сначала самые частые. Ответ из префиксного индекса в памяти, без запросов к БД.
+    Parameters(параметры): ?q=<префикс>, ?limit=10 - число подсказок, не больше 50
+    """
+    throttle_classes = [ScopedRateThrottle]
+    throttle_scope = 'suggest'
 
-        serializer = ProductInfoSerializer(queryset, many=True)
-        return Response(serializer.data)
+    def get(self, request: Request, *args, **kwargs):
+        prefix = request.query_params.get('q', '')
+        try:
+            limit = int(request.query_params.get('limit', SUGGEST_LIMIT))
+        except ValueError:
+            return Response({"error": "limit должно быть числом"}, status=status.HTTP_400_BAD_REQUEST)
+        if not 1 <= limit <= SUGGEST_MAX_LIMIT:
+            return Response({"error": "limit должно быть от 1 до %d" % SUGGEST_MAX_LIMIT},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        return Response({'prefix': prefix, 'results': get_suggest_index().suggest(prefix, limit)})
+
+
+class ProductLookupView(APIView):
+    """
+    Class for bulk lookup of catalog items by ids, e.g. to re-price a basket or render a wishlist.
+    Items of open shops are returned in the order of the ids with one query for ids and versions, JSON comes
+    from the fragment cache of the catalog. Ids of unknown items and goods of closed shops are listed in missing.
+    Класс для пакетного получения товаров каталога по ИД, например для пересчета корзины или списка желаний.
+    Товары открытых магазинов возвращаются в порядке ИД одним запросом ИД и версий, JSON берется из кэша
+    фрагментов каталога. ИД неизвестных товаров и товаров закрытых магазинов перечисляются в missing.
+    Methods:
+    - get: ?ids=1,2,3
+    - post: {"ids": [1, 2, 3]}, for long lists, для длинных списков
+    """
+    throttle_classes = [UserRateThrottle, AnonRateThrottle]
+
+    def get(self, request: Request, *args, **kwargs):
+        return self.lookup(request.query_params.get('ids', ''))
+
+    def post(self, request: Request, *args, **kwargs):
+        return self.lookup(request.data.get('ids') if isinstance(request.data, dict) else None)
+
+    def lookup(self, value):
+        try:
+            ids = parse_ids(value)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Named rows are enough for fragments, without model instances
+        # Для фрагментов достаточно именованных строк, без экземпляров моделей
+        items = {item.id: item for item in CatalogItem.objects.filter(id__in=ids, shop_state=True).values_list(
+            'id', 'version', named=True)}
+        fragments = render_fragments([items[pk] for pk in ids if pk in items])
+        missing = [pk for pk in ids if pk not in items]
+        content = b'{"results":%s,"missing":%s}' % (join_fragments(fragments), json.dumps(missing).encode())
+        return HttpResponse(content, content_type='application/json')
+
+
+class ProductCacheStatsView(APIView):
+    """
+    Class for hit and miss counters of catalog caches (products and facets), for staff only.
+    Класс для счетчиков попаданий и промахов кэшей каталога (products и facets), только для персонала.
+    Methods:
+    - get: counters and hit rate, счетчики и доля попаданий
+    - delete: reset counters, сброс счетчиков
+    """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request: Request, *args, **kwargs):
+        return Response(cache_stats())
+
+    def delete(self, request: Request, *args, **kwargs):
+        reset_cache_stats()
+        return Response(status=status.HTTP_204_NO_CONTENT)
 
 
 class BasketViewSet(ViewSet):
@@ -467,6 +698,86 @@ class ProductImageViewSet(viewsets.ViewSet):
         return Response({"error": "Укажите URL или загрузите файл"}, status=status.HTTP_400_BAD_REQUEST)
 
 
+class PartnerUpdateView(APIView):
+    """
+    Class for partner price list upload, the import runs in Celery.
+    Класс загрузки прайс-листа партнером, импорт выполняется в Celery.
+    Methods:
+    - post: Create import job from url or file and return its id.
+    Создание задачи импорта по ссылке или из файла, в ответе ИД задачи.
+    variables(поля): url или file
+    Staff or shop owners only: the shop of an uploaded file is checked at once, the shop of a price list
+    from url is checked by the import task.
+    Только персонал или владельцы магазинов: магазин загруженного файла проверяется сразу, магазин
+    прайс-листа по ссылке проверяет задача импорта.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        serializer = PartnerUpdateSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        if not request.user.is_staff:
+            if not request.user.shops.exists():
+                self.permission_denied(request, message="Загрузка прайс-листов доступна только владельцам магазинов")
+            if serializer.validated_data.get('file'):
+                try:
+                    shop_name = read_shop_name(serializer.validated_data['file'])
+                except yaml.YAMLError:
+                    return Response({"error": "Неверный формат прайс-листа"}, status=status.HTTP_400_BAD_REQUEST)
+                try:
+                    check_shop_access(shop_name, request.user)
+                except DjangoPermissionDenied as e:
+                    self.permission_denied(request, message=str(e))
+
+        job = ImportJob.objects.create(
+            user=request.user,
+            url=serializer.validated_data.get('url'),
+            file=serializer.validated_data.get('file'),
+        )
+        import_price_list.delay(job.id)  # Отправляем в Celery
+
+        return Response({
+            'Status': True,
+            'job_id': job.id,
+            'status_url': reverse('backend:partner-update-status', kwargs={'job_id': job.id}),
+        }, status=status.HTTP_202_ACCEPTED)
+
+
+class PartnerUpdateStatusView(APIView):
+    """
+    Class for price list import status: processed/total goods and timing.
+    Класс статуса импорта прайс-листа: обработано/всего товаров и время выполнения.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, job_id):
+        job = get_object_or_404(ImportJob, id=job_id, user=request.user)
+        return Response(ImportJobSerializer(job).data)
+
+
+class PartnerStockView(APIView):
+    """
+    Class for partner stock update: quantities and prices of known goods, without a price list import.
+    Класс обновления остатков партнером: количества и цены известных товаров без импорта прайс-листа.
+    Methods:
+    - post: Apply [external_id, quantity, price] rows or CSV file, return update statistics.
+    Применение строк [внешний ИД, количество, цена] или CSV файла, в ответе статистика обновления.
+    variables(поля): shop, items или file
+    Staff or the shop owner only, только персонал или владелец магазина.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        serializer = StockUpdateSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        shop = get_object_or_404(Shop, name=serializer.validated_data['shop'])
+        if not shop.is_managed_by(request.user):
+            self.permission_denied(request, message="Нет прав на обновление магазина %s" % shop.name)
+        stats = update_stock(shop, serializer.validated_data['items'])
+        return Response({'Status': True, **stats.as_dict()})
+
+
 class SentryTestView(APIView):
     def get(self, request):
         sentry_sdk.capture_message("Тестовое сообщение Sentry!")
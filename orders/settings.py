@@ -179,6 +179,7 @@ REST_FRAMEWORK = {
     'DEFAULT_THROTTLE_RATES': {
         'anon': '3/minute',  # Not authorized users,неавторизованные пользователи: 3  per minute, в минуту
         'user': '5/minute',  # Authorized users,авторизованные пользователи: 5 per minute, в минуту
+        'suggest': '120/minute',  # Typeahead, called on every keystroke,подсказки, вызываются на каждое нажатие
     }
 }
 
@@ -261,6 +262,12 @@ CACHEOPS = {
     'backend.Product': {'ops': 'all', 'timeout': 60 * 15},  # Кэшируем все запросы к Product на 15 минут
     'backend.ProductInfo': {'ops': 'all', 'timeout': 60 * 10},  # Кэшируем ProductInfo на 10 минут
 }
+# Binary snapshots of parsed price lists, бинарные снимки разобранных прайс-листов
+PRICE_LIST_SNAPSHOT_DIR = BASE_DIR / 'snapshots'
+PRICE_LIST_SNAPSHOT_LIMIT = 500  # Snapshots kept, число хранимых снимков
+# In-process NumPy engine for catalog listing filters, needs numpy installed
+# Колоночный движок фильтров каталога на NumPy внутри процесса, нужен установленный numpy
+CATALOG_COLUMNAR_ENGINE = False
 # Sentry settings, настройки Sentry
 SENTRY_DSN = "https://74fb7468bdb64dc447a14742ba004442@o4508830241652736.ingest.de.sentry.io/4508830264197200"
 